@@ -0,0 +1,229 @@
+"""
+Addressindex.py maps every public key (pk_script) to the outputs it has received and spent so that balance and
+history queries cost time proportional to that key's outputs instead of the whole blockchain.
+
+The index is persisted as an append-only log (./blockchain/address_index.log) holding one json line per block:
+{"height": 5, "received": [[pk, height, tx index, output index, value], ...],
+              "spent": [[pk, height, tx index, output index, value], ...]}
+
+When the node starts the log is replayed and only blocks that are missing from it are indexed from the chain. The log
+is derived data, if it is ever unreadable it is thrown away and rebuilt from the blocks.
+"""
+
+import os
+import json
+
+log_path = None
+log_file = None
+
+# Number of blocks (starting from genesis) that are in the index
+indexed_blocks = 0
+
+# pk -> {outpoint: value} of unspent confirmed outputs, kept in chain order
+unspent_by_address = {}
+
+# pk -> list of ('received' or 'spent', height of the block it happened in, outpoint, value)
+history_by_address = {}
+
+# Byte offset of every block's record in the log, used to take blocks off the tip during a reorganization
+record_offsets = []
+
+
+# Load the log and return the number of blocks it covers, anything past chain_length throws the log away
+def initialize(chain_length, path='./blockchain/address_index.log'):
+    global log_path
+    global log_file
+    global indexed_blocks
+
+    if log_file is not None:
+        log_file.close()
+
+    log_path = path
+    indexed_blocks = 0
+    unspent_by_address.clear()
+    history_by_address.clear()
+    record_offsets.clear()
+
+    records, good_bytes = read_log()
+    if len(records) > chain_length:
+        records = []
+        record_offsets.clear()
+        good_bytes = 0
+
+    for record in records:
+        apply_record(record)
+
+    log_file = open(log_path, 'ab')
+    log_file.truncate(good_bytes)
+    log_file.seek(good_bytes)
+
+    return indexed_blocks
+
+
+# Index a block, spent_outputs is the list of (outpoint, output) pairs returned by utxo.connect_block
+def connect_block(block_dict, height, spent_outputs):
+    record = {
+        'height': height,
+        'received': [],
+        'spent': []
+    }
+
+    for outpoint, output in spent_outputs:
+        record['spent'].append([output['pk_script'], *outpoint, output['value']])
+
+    for tx_index, tx in enumerate(block_dict['transactions']):
+        for output_index, output in enumerate(tx['outputs']):
+            record['received'].append([output['pk_script'], height, tx_index, output_index, output['value']])
+
+    record_offsets.append(log_file.tell())
+    log_file.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+    log_file.flush()
+
+    apply_record(record)
+
+
+# Take the most recently indexed block back out of the index and the log
+def disconnect_block():
+    global indexed_blocks
+
+    with open(log_path, 'rb') as f:
+        f.seek(record_offsets[-1])
+        record = json.loads(f.readline())
+        f.close()
+
+    # Its history entries are the last ones of every key it touched
+    for pk, height, tx_index, output_index, value in record['received'] + record['spent']:
+        history = history_by_address.get(pk, [])
+        while len(history) > 0 and history[-1][1] == record['height']:
+            history.pop()
+        if len(history) == 0:
+            history_by_address.pop(pk, None)
+
+    for pk, height, tx_index, output_index, value in record['received']:
+        unspent_by_address.get(pk, {}).pop((height, tx_index, output_index), None)
+
+    for pk, height, tx_index, output_index, value in record['spent']:
+        unspent_by_address.setdefault(pk, {})[(height, tx_index, output_index)] = value
+
+    log_file.truncate(record_offsets[-1])
+    log_file.seek(record_offsets[-1])
+    record_offsets.pop()
+    indexed_blocks = record['height']
+
+
+# Apply one block's record of the log to the in memory index
+def apply_record(record):
+    global indexed_blocks
+
+    for pk, height, tx_index, output_index, value in record['received']:
+        outpoint = (height, tx_index, output_index)
+        unspent_by_address.setdefault(pk, {})[outpoint] = value
+        history_by_address.setdefault(pk, []).append(('received', record['height'], outpoint, value))
+
+    for pk, height, tx_index, output_index, value in record['spent']:
+        outpoint = (height, tx_index, output_index)
+        unspent_by_address.get(pk, {}).pop(outpoint, None)
+        history_by_address.setdefault(pk, []).append(('spent', record['height'], outpoint, value))
+
+    indexed_blocks = record['height'] + 1
+
+
+# Returns the records (oldest first) of the usable part of the log, only reading up to max_bytes if given, and how many
+# bytes they take up. Their offsets are added to record_offsets
+def read_log(max_bytes=None):
+    records = []
+    good_bytes = 0
+    if not os.path.isfile(log_path):
+        return records, good_bytes
+
+    with open(log_path, 'rb') as f:
+        for line in f:
+            # A torn last line from a crash ends the usable part of the log
+            if not line.endswith(b'\n') or max_bytes is not None and good_bytes + len(line) > max_bytes:
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record['height'] != len(records):
+                break
+            records.append(record)
+            record_offsets.append(good_bytes)
+            good_bytes += len(line)
+        f.close()
+
+    return records, good_bytes
+
+
+# Returns where the log ends so a checkpoint can restore the index from it, the log is flushed but the checkpoint
+# fsyncs it (see checkpoint.py)
+def get_state():
+    log_file.flush()
+
+    state = {
+        'blocks': indexed_blocks,
+        'log_size': log_file.tell()
+    }
+
+    return state
+
+
+# Restore the index by replaying the log up to where it was when the state was taken, cutting off the rest
+# Returns False if the log is shorter than that, then the index has to be rebuilt with initialize
+def restore(state, path='./blockchain/address_index.log'):
+    global log_path
+    global log_file
+    global indexed_blocks
+
+    if log_file is not None:
+        log_file.close()
+        log_file = None
+
+    log_path = path
+    indexed_blocks = 0
+    unspent_by_address.clear()
+    history_by_address.clear()
+    record_offsets.clear()
+
+    records, good_bytes = read_log(state['log_size'])
+    if len(records) != state['blocks'] or good_bytes != state['log_size']:
+        record_offsets.clear()
+        return False
+
+    for record in records:
+        apply_record(record)
+
+    log_file = open(log_path, 'ab')
+    log_file.truncate(good_bytes)
+    log_file.seek(good_bytes)
+
+    return True
+
+
+"""
+Address getters
+"""
+
+
+# Returns a list of ([height, tx index, output index], value) of every unspent confirmed output of a key
+def get_unspent(public_key):
+    return [(list(outpoint), value) for outpoint, value in unspent_by_address.get(public_key, {}).items()]
+
+
+# Returns one page of a key's history, newest first
+def get_history(public_key, page=0, page_size=25):
+    history = history_by_address.get(public_key, [])
+
+    end = len(history) - page * page_size
+    start = max(end - page_size, 0)
+
+    page_entries = []
+    for event, height, outpoint, value in reversed(history[start:max(end, 0)]):
+        page_entries.append({
+            'type': event,
+            'height': height,
+            'outpoint': list(outpoint),
+            'value': value
+        })
+
+    return page_entries, len(history)
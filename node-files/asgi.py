@@ -0,0 +1,182 @@
+"""
+Asgi.py is an optional way to run the node on an asyncio event loop instead of Flask's thread per connection server.
+It serves exactly the routes in server.py (it runs the same Flask app), but connections are held by the event loop:
+a wallet keeping a connection open, a peer slowly sending a big batch or a client slowly reading the chain costs a
+coroutine instead of a thread. Only the time spent in a route handler, which is where the node verifies and reads its
+state (see core.py), is taken by a thread from executor.
+
+Every request has a deadline. The body has to arrive within BODY_TIMEOUT seconds and be at most MAX_BODY_BYTES, the
+handler has to answer within HANDLER_TIMEOUT seconds (SLOW_ROUTES get longer) and every chunk of a streamed response
+has to be produced within HANDLER_TIMEOUT as well. A handler that runs out of time is answered with 504, the thread it
+runs on can't be stopped and finishes the work in the background.
+
+Run it with the same arguments as server.py:
+python asgi.py [difficulty] [tx minimum] [tx maximum] [verify workers] [own url] [--snapshot=...] [--mempool-size=...]
+[--durability=...] [--verify-chain]
+
+It needs uvicorn (pip install uvicorn), which is only imported when the server is started.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import sys
+import server
+
+EXECUTOR_WORKERS = 64
+MAX_BODY_BYTES = 32 * 1024 * 1024
+BODY_TIMEOUT = 10
+HANDLER_TIMEOUT = 30
+
+# Routes that wait on other nodes get longer to answer
+SLOW_ROUTES = {
+    '/node/chain/sync': 600,
+    '/node/chain/broadcast': 600
+}
+
+executor = ThreadPoolExecutor(EXECUTOR_WORKERS)
+
+
+# The ASGI application
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await run_lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        return
+
+    try:
+        body = await asyncio.wait_for(read_body(receive), BODY_TIMEOUT)
+    except asyncio.TimeoutError:
+        await send_text(send, 408, "The request body took too long to arrive")
+        return
+
+    if body is None:
+        await send_text(send, 413, f"The request body can't be larger than [{MAX_BODY_BYTES}] bytes")
+        return
+
+    timeout = SLOW_ROUTES.get(scope['path'], HANDLER_TIMEOUT)
+    loop = asyncio.get_running_loop()
+    response = {}
+
+    # Flask calls this before it hands back the body
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    try:
+        chunks = await asyncio.wait_for(
+            loop.run_in_executor(executor, server.app, make_environ(scope, body), start_response), timeout)
+    except asyncio.TimeoutError:
+        await send_text(send, 504, f"The node did not answer within [{timeout}] seconds")
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': response['status'],
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response['headers']]
+    })
+
+    # Streamed bodies are read from disk a chunk at a time, so every chunk is produced on the executor
+    iterator = iter(chunks)
+    try:
+        while True:
+            chunk = await asyncio.wait_for(loop.run_in_executor(executor, next, iterator, None), timeout)
+            if chunk is None:
+                break
+            if len(chunk) > 0:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        if hasattr(chunks, 'close'):
+            await loop.run_in_executor(executor, chunks.close)
+
+
+# Returns the whole request body, or None if it is larger than MAX_BODY_BYTES
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return None
+
+        if not message.get('more_body', False):
+            break
+
+    return bytes(body)
+
+
+# Returns the WSGI environ the Flask app expects for an ASGI request
+def make_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = f'HTTP_{name}'
+
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+
+    return environ
+
+
+# Answer with a plain text error
+async def send_text(send, status, text):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')]
+    })
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+# The node is set up when server.py is imported, so there is nothing to do when the server starts or stops other than
+# saying so
+async def run_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        print("Serving on an event loop needs uvicorn (pip install uvicorn), server.py runs without it")
+        sys.exit(1)
+
+    uvicorn.run(app, host='0.0.0.0', port=1337, backlog=4096)
@@ -6,12 +6,35 @@ Blocks in total, transactions in block, transactions in total, etc.
 
 An important role this module has is to define and return template transactions, coinbase transactions, and blocks.
 What ever data types are set in the template are the ones the nodes will use to verify further incoming data
+
+Block versions:
+1 (no 'version' key) - the proof-of-work hash is the hash of the whole block serialized as json
+2                    - the block also holds a 'merkle_root' of its transaction hashes and the proof-of-work hash only
+                       covers a fixed size header, so the cost of hashing doesn't grow with the number of transactions
+
+Version 2 header layout (88 bytes, big-endian):
+[32 bytes previous block hash][32 bytes merkle root][8 byte height][8 byte float timestamp][8 byte nonce]
 """
 
 from datetime import datetime
 from hashlib import sha256
 import os
 import json
+import copy
+import struct
+import blockstore
+
+BLOCK_VERSION = 2
+HEADER_FORMAT = struct.Struct('>32s32sQdQ')
+
+# Hash of the most recent block, worked out once and then kept up to date by add_block
+tip_hash = None
+
+# Compact header of every block from genesis, filled in the first time they are asked for and then kept up to date
+block_headers = []
+
+# Block hash -> height for every header in block_headers
+hash_heights = {}
 
 """
 Initialization Functions
@@ -19,27 +42,33 @@ Initialization Functions
 
 
 # Initialization of file paths
-def initialize():
+def initialize(segment_max_bytes=16 * 1024 * 1024, fsync_policy='always'):
+    global tip_hash
+
     # Create blockchain directory
     if not os.path.exists('./blockchain'):
         os.mkdir('./blockchain')
 
-    if not os.path.isfile('./blockchain/blockchain.json'):
+    blockstore.initialize('./blockchain', segment_max_bytes, fsync_policy)
+    tip_hash = None
+    block_headers.clear()
+    hash_heights.clear()
+
+    # One time migration of a chain written by the old whole-file format
+    if blockstore.count() == 0 and os.path.isfile('./blockchain/blockchain.json'):
+        blockstore.migrate_legacy_chain('./blockchain/blockchain.json')
+
+    if blockstore.count() == 0:
         create_genesis()
 
 
 # Writes a seed block with default values to the blockchain directory
 def create_genesis():
-    # If the blockchain json is empty, create a genesis block with no transactions
+    # If the block store is empty, create a genesis block with no transactions
     template_block = get_block_template()
-
-    with open('./blockchain/blockchain.json', 'w+') as f:
-        data = [template_block]
-        data = json.dumps(data, indent=4)
-        f.seek(0)
-        f.write(data)
-        f.truncate()
-        f.close()
+    template_block['version'] = BLOCK_VERSION
+    template_block['merkle_root'] = compute_merkle_root(template_block['transactions'])
+    blockstore.append(template_block)
 
 
 """
@@ -49,34 +78,47 @@ Block getters and setters
 
 # Add a block to the blockchain directory
 def add_block(block_dict):
-    with open('./blockchain/blockchain.json', 'r+') as f:
-        data = json.load(f)
-        data.append(block_dict)
-        data = json.dumps(data, indent=4)
-        f.seek(0)
-        f.write(data)
-        f.truncate()
-        f.close()
+    global tip_hash
+
+    blockstore.append(block_dict)
+    tip_hash = hash_block(block_dict)
+
+    # Only extend the header cache if it already reached the old tip
+    if len(block_headers) == blockstore.count() - 1:
+        cache_header(make_header(block_dict, tip_hash))
+
+
+# Remove the most recent block from the blockchain directory and return it
+def remove_last_block():
+    global tip_hash
+
+    block = get_last_block()
+    height = blockstore.count() - 1
+    blockstore.truncate(height)
+    tip_hash = None
+
+    if len(block_headers) > height:
+        del hash_heights[block_headers.pop()['hash']]
+
+    return block
 
 
 # Returns list or dict from the blockchain directory (all blocks, by index, or by header string)
 def get_block(all_blocks=False, index=-1, header=None):
-    # Writes all blocks to one json file and returns it
+    # Joins the stored json of every block into one stringified list and returns it
     if all_blocks:
-        with open('./blockchain/blockchain.json', 'r') as f:
-            data = f.read()
-            f.close()
-            return data
+        return get_blocks_raw(0, blockstore.count())
 
-    # If index is specified and header is not then return file at index
+    # If index is specified and header is not then return the block at index
     if index >= 0 and header is None:
-        data = json.load(open('./blockchain/blockchain.json', 'r'))
-        return data
+        if index >= blockstore.count():
+            return None
+        return blockstore.read(index)
 
-    # If header is specified and index is not then find file with name header
+    # If header is specified and index is not then find the block with that header
     elif header is not None and index < 0:
-        data = json.load(open('./blockchain/blockchain.json', 'r'))
-        for block in data:
+        for raw in blockstore.iter_raw():
+            block = json.loads(raw)
             if block['header'] == header:
                 return block
 
@@ -85,6 +127,86 @@ def get_block(all_blocks=False, index=-1, header=None):
     return None
 
 
+# Returns every block in order as dicts without loading the whole chain at once
+def iter_blocks(start=0, end=None):
+    for raw in blockstore.iter_raw(start, end):
+        yield json.loads(raw)
+
+
+# Returns the most recent block
+def get_last_block():
+    return blockstore.read(blockstore.count() - 1)
+
+
+# Returns the hash of the most recent block
+def get_tip_hash():
+    global tip_hash
+
+    if tip_hash is None:
+        tip_hash = hash_block(get_last_block())
+
+    return tip_hash
+
+
+# Returns the compact headers of the blocks from start up to (not including) end
+def get_headers(start, end):
+    end = min(end, blockstore.count())
+
+    # Read any blocks whose headers haven't been cached yet
+    if len(block_headers) < end:
+        for block in iter_blocks(len(block_headers), end):
+            cache_header(make_header(block))
+
+    return block_headers[start:end]
+
+
+# Returns the height of the block with this hash, or None if it isn't in the chain
+def get_block_height(block_hash):
+    if len(block_headers) < blockstore.count():
+        get_headers(0, blockstore.count())
+
+    return hash_heights.get(block_hash)
+
+
+# Fill the header cache with headers saved earlier (see checkpoint.py), starting from genesis
+def restore_headers(headers):
+    block_headers.clear()
+    hash_heights.clear()
+
+    for header in headers:
+        cache_header(header)
+
+
+# Add the header of the next block to the header cache
+def cache_header(header):
+    block_headers.append(header)
+    hash_heights[header['hash']] = len(block_headers) - 1
+
+
+# Returns the stored json of the blocks from start up to (not including) end as one stringified list
+def get_blocks_raw(start, end):
+    return '[' + ','.join(raw.decode() for raw in blockstore.iter_raw(start, end)) + ']'
+
+
+# Yields the stored json of the blocks from start up to (not including) end one block at a time
+def iter_blocks_raw(start=0, end=None):
+    for raw in blockstore.iter_raw(start, end):
+        yield raw.decode()
+
+
+# Returns the stored json of a single block, or None if there is no block at that height
+def get_block_raw(index):
+    if index < 0 or index >= blockstore.count():
+        return None
+
+    return blockstore.read_raw(index).decode()
+
+
+# Returns the number of blocks in the chain
+def get_block_count():
+    return blockstore.count()
+
+
 """
 Template Getters
 """
@@ -94,7 +216,7 @@ Template Getters
 def get_block_template():
     # Creates a block template with all of the dict keys
     # Load block
-    block_data = json.load(open('../example-json/block.json', 'r'))
+    block_data = load_example('block.json')
 
     # Set default block data
     block_data['header'] = 0
@@ -109,7 +231,7 @@ def get_block_template():
 # Returns a properly formatted json transaction with default values
 def get_transaction_template():
     # Returns a transaction template with all of the dict keys
-    tx_data = json.load(open('../example-json/transaction.json', 'r'))
+    tx_data = load_example('transaction.json')
 
     # Set default transaction data
     tx_data['tx_id'] = ''
@@ -126,7 +248,7 @@ def get_transaction_template():
 
 # Returns a template of a coinbase transaction
 def get_coinbase_template():
-    coinbase_data = json.load(open('../example-json/coinbase_transaction.json'))
+    coinbase_data = load_example('coinbase_transaction.json')
 
     coinbase_data['tx_id'] = ''
     coinbase_data['locktime'] = 0.0
@@ -138,6 +260,20 @@ def get_coinbase_template():
     return coinbase_data
 
 
+# Parsed example-json files, each one is only read from disk the first time it is needed
+example_templates = {}
+
+
+# Returns a fresh copy of a file in the example-json folder
+def load_example(file_name):
+    if file_name not in example_templates:
+        with open(f'../example-json/{file_name}', 'r') as f:
+            example_templates[file_name] = json.load(f)
+            f.close()
+
+    return copy.deepcopy(example_templates[file_name])
+
+
 """
 Hashing Functions
 """
@@ -158,3 +294,66 @@ def hash_dict_bytes(transaction):
     dict_hash = sha256(tx_data.encode()).digest()
 
     return dict_hash
+
+
+# Returns the hash of a block that the next block's header has to match and that proof-of-work is checked against
+def hash_block(block_dict):
+    if block_dict.get('version', 1) >= 2:
+        return sha256(serialize_header(block_dict)).hexdigest()
+
+    return hash_dict_hex(block_dict)
+
+
+# Returns the header fields of a block along with its hash
+def make_header(block_dict, block_hash=None):
+    header = {
+        'header': block_dict['header'],
+        'height': block_dict['height'],
+        'timestamp': block_dict['timestamp'],
+        'nonce': block_dict['nonce'],
+        'hash': block_hash if block_hash is not None else hash_block(block_dict)
+    }
+
+    if block_dict.get('version', 1) >= 2:
+        header['version'] = block_dict['version']
+        header['merkle_root'] = block_dict['merkle_root']
+
+    return header
+
+
+# Returns the fixed size header of a version 2 block as bytes
+def serialize_header(block_dict):
+    # The genesis block has no previous block, its header is 0
+    if type(block_dict['header']) is str:
+        previous_hash = bytes.fromhex(block_dict['header'])
+    else:
+        previous_hash = bytes(32)
+
+    # Fields that don't fit the fixed size header make the block badly formed like any other bad value
+    for key in ['height', 'nonce']:
+        if type(block_dict[key]) is not int or not 0 <= block_dict[key] < 2 ** 64:
+            raise ValueError(f"Block {key} should be a whole number that fits in 8 bytes")
+
+    if type(block_dict['timestamp']) not in [int, float]:
+        raise ValueError("Block timestamp should be a unix timestamp in seconds")
+
+    try:
+        return HEADER_FORMAT.pack(previous_hash, bytes.fromhex(block_dict['merkle_root']), block_dict['height'],
+                                  block_dict['timestamp'], block_dict['nonce'])
+    except (struct.error, OverflowError) as e:
+        raise ValueError(f"Block header does not fit the fixed size header: {e}")
+
+
+# Returns the merkle root of a list of transactions as a hex string
+def compute_merkle_root(transactions):
+    if len(transactions) == 0:
+        return bytes(32).hex()
+
+    level = [hash_dict_bytes(tx) for tx in transactions]
+    while len(level) > 1:
+        # An odd one out is paired with itself
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+
+    return level[0].hex()
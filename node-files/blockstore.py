@@ -0,0 +1,277 @@
+"""
+Blockstore.py is the storage engine that sits underneath blockchain.py. Blocks are written exactly once to append-only
+segment files and found again through a fixed width offset index, so adding a block costs the size of that block
+instead of the size of the whole chain. Nothing in here knows what a block means, it only stores and returns json.
+
+Segment record layout (./blockchain/segments/segment_xxxxxx.dat):
+[4 byte big-endian length of the json][compact json of the block]
+
+Index record layout (./blockchain/index.dat), one record per block height:
+[4 byte segment number][8 byte offset of the segment record][4 byte length of the json]
+
+Segments are rotated once they grow past segment_max_bytes. The fsync policy decides when written data is forced
+to disk:
+'always' - after every block (safest, slowest)
+'rotate' - only when a segment is closed
+'never'  - leave it up to the operating system
+"""
+
+import os
+import json
+import struct
+
+INDEX_RECORD = struct.Struct('>IQI')
+LENGTH_PREFIX = struct.Struct('>I')
+FSYNC_POLICIES = ['always', 'rotate', 'never']
+
+store_directory = None
+segment_directory = None
+index_path = None
+segment_max_bytes = None
+fsync_policy = None
+
+# In memory copy of index.dat, entry n is (segment, offset, length) of the block at height n
+block_index = []
+
+segment_number = 0
+segment_file = None
+index_file = None
+
+
+"""
+Initialization Functions
+"""
+
+
+# Open (or create) the store in directory, recovering from a write that was cut off part way through
+def initialize(directory='./blockchain', max_bytes=16 * 1024 * 1024, policy='always'):
+    global store_directory
+    global segment_directory
+    global index_path
+    global segment_max_bytes
+    global fsync_policy
+
+    if policy not in FSYNC_POLICIES:
+        raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES} but it was [{policy}]")
+
+    close()
+
+    store_directory = directory
+    segment_directory = os.path.join(directory, 'segments')
+    index_path = os.path.join(directory, 'index.dat')
+    segment_max_bytes = max_bytes
+    fsync_policy = policy
+
+    if not os.path.isdir(segment_directory):
+        os.makedirs(segment_directory)
+
+    load_index()
+    open_for_append()
+
+
+# Read index.dat into memory and drop any records that point past the end of their segment
+def load_index():
+    global block_index
+
+    block_index = []
+    if not os.path.isfile(index_path):
+        open(index_path, 'wb').close()
+        return
+
+    with open(index_path, 'rb') as f:
+        data = f.read()
+        f.close()
+
+    # A torn index record at the end of the file is thrown away
+    usable_bytes = len(data) - len(data) % INDEX_RECORD.size
+    for position in range(0, usable_bytes, INDEX_RECORD.size):
+        block_index.append(INDEX_RECORD.unpack_from(data, position))
+
+    # Only keep records whose data actually made it into the segment
+    while len(block_index) > 0:
+        segment, offset, length = block_index[-1]
+        path = get_segment_path(segment)
+        if os.path.isfile(path) and os.path.getsize(path) >= offset + LENGTH_PREFIX.size + length:
+            break
+        block_index.pop()
+
+    if len(block_index) * INDEX_RECORD.size != len(data):
+        with open(index_path, 'r+b') as f:
+            f.truncate(len(block_index) * INDEX_RECORD.size)
+            f.close()
+
+
+# Open the newest segment and the index for appending, cutting off any record that was never indexed
+def open_for_append():
+    global segment_number
+    global segment_file
+    global index_file
+
+    if len(block_index) > 0:
+        segment, offset, length = block_index[-1]
+        segment_number = segment
+        end_of_data = offset + LENGTH_PREFIX.size + length
+    else:
+        segment_number = 0
+        end_of_data = 0
+
+    path = get_segment_path(segment_number)
+    if os.path.isfile(path) and os.path.getsize(path) > end_of_data:
+        with open(path, 'r+b') as f:
+            f.truncate(end_of_data)
+            f.close()
+
+    # Segments newer than the last indexed record hold nothing but unindexed data
+    for name in os.listdir(segment_directory):
+        if name.startswith('segment_') and int(name[8:-4]) > segment_number:
+            os.remove(os.path.join(segment_directory, name))
+
+    segment_file = open(path, 'ab')
+    index_file = open(index_path, 'ab')
+
+
+# Flush and close the open file handles
+def close():
+    global segment_file
+    global index_file
+
+    for f in [segment_file, index_file]:
+        if f is not None:
+            f.flush()
+            if fsync_policy != 'never':
+                os.fsync(f.fileno())
+            f.close()
+
+    segment_file = None
+    index_file = None
+
+
+# Copies every block from a legacy blockchain.json file into the store and renames the old file
+def migrate_legacy_chain(json_path):
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+        f.close()
+
+    for block in data:
+        append(block, sync=False)
+
+    sync()
+    os.replace(json_path, json_path + '.migrated')
+
+
+"""
+Block getters and setters
+"""
+
+
+# Writes a block once to the current segment, indexes it and returns its height
+def append(block_dict, sync=True):
+    global segment_number
+    global segment_file
+
+    data = json.dumps(block_dict, separators=(',', ':')).encode()
+
+    # Rotate to a new segment if this one is full
+    offset = segment_file.tell()
+    if offset > 0 and offset + LENGTH_PREFIX.size + len(data) > segment_max_bytes:
+        segment_file.flush()
+        if fsync_policy != 'never':
+            os.fsync(segment_file.fileno())
+        segment_file.close()
+
+        segment_number += 1
+        segment_file = open(get_segment_path(segment_number), 'ab')
+        offset = 0
+
+    # Data goes down before the index record that points at it
+    segment_file.write(LENGTH_PREFIX.pack(len(data)) + data)
+    segment_file.flush()
+    if sync and fsync_policy == 'always':
+        os.fsync(segment_file.fileno())
+
+    index_file.write(INDEX_RECORD.pack(segment_number, offset, len(data)))
+    index_file.flush()
+    if sync and fsync_policy == 'always':
+        os.fsync(index_file.fileno())
+
+    block_index.append((segment_number, offset, len(data)))
+    return len(block_index) - 1
+
+
+# Drops every block from height onwards, the blocks before it are left untouched
+def truncate(height):
+    if height >= len(block_index):
+        return
+
+    close()
+    del block_index[height:]
+
+    with open(index_path, 'r+b') as f:
+        f.truncate(len(block_index) * INDEX_RECORD.size)
+        if fsync_policy != 'never':
+            os.fsync(f.fileno())
+        f.close()
+
+    # Cuts the segment back to the end of the new last block and removes the segments after it
+    open_for_append()
+
+
+# Forces everything written so far to disk regardless of the fsync policy
+def sync():
+    for f in [segment_file, index_file]:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Returns the raw json bytes of the block at height
+def read_raw(height):
+    segment, offset, length = block_index[height]
+    with open(get_segment_path(segment), 'rb') as f:
+        f.seek(offset + LENGTH_PREFIX.size)
+        data = f.read(length)
+        f.close()
+
+    return data
+
+
+# Returns the block at height as a dict
+def read(height):
+    return json.loads(read_raw(height))
+
+
+# Yields the raw json bytes of every block from start up to (not including) end
+def iter_raw(start=0, end=None):
+    if end is None or end > len(block_index):
+        end = len(block_index)
+
+    f = None
+    open_segment = None
+    try:
+        for height in range(start, end):
+            segment, offset, length = block_index[height]
+            if segment != open_segment:
+                if f is not None:
+                    f.close()
+                f = open(get_segment_path(segment), 'rb')
+                open_segment = segment
+
+            f.seek(offset + LENGTH_PREFIX.size)
+            yield f.read(length)
+    finally:
+        if f is not None:
+            f.close()
+
+
+# Returns the number of blocks in the store
+def count():
+    return len(block_index)
+
+
+"""
+Helpers
+"""
+
+
+# Returns the path of a segment file by its number
+def get_segment_path(number):
+    return os.path.join(segment_directory, f'segment_{number:06d}.dat')
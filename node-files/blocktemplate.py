@@ -0,0 +1,77 @@
+"""
+Blocktemplate.py builds ready to mine block templates so a miner only needs one request per round instead of
+downloading the mempool, the parameters and the empty templates and then looking up every input to work out the fees.
+
+A template holds the block with the previous block's hash, height, version and the transactions picked from the
+mempool (the highest fee per byte first, never more than the node's tx_maximum), the coinbase transaction with its
+value already set to the block reward plus the fees, and the node's difficulty. The miner fills in its key and a tx_id
+on the coinbase, puts it first, sets the merkle root and searches for a nonce.
+
+The template is cached and only built again when the tip or the mempool has changed since. Building it only looks at
+as many mempool transactions as fit in a block, taken from the front of the mempool's fee rate index, and their fees
+were already worked out when they were admitted, so it costs the same no matter how long the chain or how big the
+mempool is.
+"""
+
+from itertools import islice
+import blockchain
+import mempool
+import node
+
+# (tip hash, mempool version tag, tx maximum) the cached template was built for
+template_key = None
+template = None
+
+
+# Returns a template for the next block, max_transactions can lower the number of transactions below tx_maximum
+def get_template(max_transactions=None):
+    global template_key
+    global template
+
+    key = (blockchain.get_tip_hash(), mempool.get_version_tag(), node.block_transaction_maximum)
+    if key != template_key:
+        template = build_template()
+        template_key = key
+
+    transaction_count = len(template['transactions'])
+    if max_transactions is not None:
+        transaction_count = min(transaction_count, max(max_transactions, 0))
+
+    fees = sum(template['fees'][:transaction_count])
+
+    block = blockchain.get_block_template()
+    block['header'] = template['header']
+    block['height'] = template['height']
+    block['version'] = blockchain.BLOCK_VERSION
+    block['transactions'] = template['transactions'][:transaction_count]
+
+    coinbase = blockchain.get_coinbase_template()
+    coinbase['inputs'][0]['previous_output'] = ['COINBASE']
+    coinbase['outputs'][0]['value'] = node.block_reward + fees
+
+    mining_template = {
+        'block': block,
+        'coinbase': coinbase,
+        'fees': fees,
+        'reward': node.block_reward,
+        'difficulty': node.block_difficulty,
+        'tx_minimum': node.block_transaction_minimum,
+        'tx_maximum': node.block_transaction_maximum,
+        'ready': transaction_count >= node.block_transaction_minimum
+    }
+
+    return mining_template
+
+
+# Pick the transactions for the next block, the ones paying the most per byte first
+def build_template():
+    transactions = list(islice(mempool.iter_by_fee_rate(), node.block_transaction_maximum))
+
+    template_data = {
+        'header': blockchain.get_tip_hash(),
+        'height': blockchain.get_block_count(),
+        'transactions': transactions,
+        'fees': [mempool.fees[tx['tx_id']] for tx in transactions]
+    }
+
+    return template_data
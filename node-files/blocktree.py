@@ -0,0 +1,137 @@
+"""
+Blocktree.py keeps track of every block this node knows about, not just the ones in its chain, so it can tell when a
+competing chain has more work behind it than its own and should be switched to.
+
+Every known block is an entry in block_tree keyed by its hash:
+{'parent': hash of the block before it, 'height': height, 'work': cumulative work from genesis up to this block}
+
+The work of a block is 16 ** difficulty, the number of hashes it takes on average to find a hash that starts with that
+many zeroes. The chain with the most cumulative work is the one the node follows.
+
+Blocks in the node's chain live in the block store (see blockstore.py). Blocks on a side chain, received from another
+node or taken off the chain during a reorganization, are kept as separate files in ./blockchain/sidechains named
+after their hash. The tree is rebuilt from the chain headers and those files when the node starts.
+"""
+
+import os
+import json
+import blockchain
+
+side_directory = None
+
+# Work each block adds to the chain it is in
+block_work = 16
+
+# Block hash -> {'parent': hash, 'height': int, 'work': int}
+block_tree = {}
+
+# Block hash -> set of hashes of the blocks built on it
+children = {}
+
+
+# Build the tree from the chain and the stored side chain blocks, difficulty is the proof-of-work every block has
+def initialize(difficulty, directory='./blockchain/sidechains'):
+    global side_directory
+    global block_work
+
+    side_directory = directory
+    block_work = 16 ** difficulty
+    block_tree.clear()
+    children.clear()
+
+    if not os.path.isdir(side_directory):
+        os.makedirs(side_directory)
+
+    for header in blockchain.get_headers(0, blockchain.get_block_count()):
+        add_block(header['hash'], header['header'], header['height'])
+
+    # Side chain blocks go in by height so every parent is in the tree before its children
+    side_blocks = []
+    for name in os.listdir(side_directory):
+        if name.endswith('.json'):
+            block = read_side_block(name[:-5])
+            side_blocks.append((block['height'], name[:-5], block['header']))
+
+    for height, block_hash, parent_hash in sorted(side_blocks):
+        if parent_hash in block_tree and block_hash not in block_tree:
+            add_block(block_hash, parent_hash, height)
+        else:
+            # Its chain is gone, or it is already back in the node's chain
+            os.remove(get_side_path(block_hash))
+
+
+# Add a block to the tree, the genesis block (which has no parent in the tree) only counts its own work
+def add_block(block_hash, parent_hash, height):
+    parent = block_tree.get(parent_hash)
+
+    block_tree[block_hash] = {
+        'parent': parent_hash,
+        'height': height,
+        'work': block_work + (parent['work'] if parent is not None else 0)
+    }
+    children.setdefault(parent_hash, set()).add(block_hash)
+
+
+# Remove a block and every block built on it from the tree along with their side chain files
+def discard(block_hash):
+    pending = [block_hash]
+    while len(pending) > 0:
+        current_hash = pending.pop()
+        entry = block_tree.pop(current_hash, None)
+        if entry is not None:
+            children.get(entry['parent'], set()).discard(current_hash)
+
+        pending.extend(children.pop(current_hash, set()))
+        remove_side_block(current_hash)
+
+
+"""
+Tree getters
+"""
+
+
+# Returns True if the block is anywhere in the tree
+def contains(block_hash):
+    return block_hash in block_tree
+
+
+# Returns the tree entry of a block, or None
+def get_entry(block_hash):
+    return block_tree.get(block_hash)
+
+
+# Returns the cumulative work up to and including a block
+def get_work(block_hash):
+    return block_tree[block_hash]['work']
+
+
+"""
+Side chain storage
+"""
+
+
+# Store a block that isn't part of the node's chain
+def store_side_block(block_dict, block_hash):
+    with open(get_side_path(block_hash), 'w') as f:
+        f.write(json.dumps(block_dict, separators=(',', ':')))
+        f.close()
+
+
+# Returns a stored side chain block as a dict
+def read_side_block(block_hash):
+    with open(get_side_path(block_hash), 'r') as f:
+        block = json.load(f)
+        f.close()
+
+    return block
+
+
+# Delete the stored copy of a side chain block, if there is one
+def remove_side_block(block_hash):
+    if os.path.isfile(get_side_path(block_hash)):
+        os.remove(get_side_path(block_hash))
+
+
+# Returns the path a side chain block is stored at
+def get_side_path(block_hash):
+    return os.path.join(side_directory, f'{block_hash}.json')
@@ -0,0 +1,222 @@
+"""
+Checkpoint.py saves the state the node derives from its chain so a restart doesn't have to replay every block again:
+the UTXO set, where the address index and undo logs ended, the block headers (and with them the block hash index) and
+the chain stats. The checkpoint is tagged with the height and hash of the tip it was taken at.
+
+Checkpoint layout (./blockchain/checkpoint.json), two lines:
+{"version": 2, "height": 120, "tip_hash": "...", "checksum": sha256 of the second line}
+{"utxo": [...], "address_index": {...}, "undo_log": {...}, "headers": {"count": ..., "log_size": ...},
+ "chain_stats": {...}}
+
+The headers are kept in ./blockchain/headers.log, one compact json header per line. Every checkpoint only appends the
+headers of the blocks added since the one before it (after cutting off any a reorganization took out of the chain),
+and the address index is restored by replaying its own log, so writing a checkpoint doesn't cost more as the chain
+grows. The state is collected on the writer thread and written to disk on a background thread, one checkpoint at a
+time.
+
+node.py writes a checkpoint every CHECKPOINT_INTERVAL blocks and when the server shuts down. When the node starts it
+loads the checkpoint and only replays the blocks after it. If the checkpoint is missing, from another version, fails
+its checksum or was taken on a block that is no longer in the chain the node rebuilds everything from genesis instead.
+"""
+
+from hashlib import sha256
+import os
+import json
+import threading
+import addressindex
+import blockchain
+import blockstore
+import undolog
+import utxo
+
+CHECKPOINT_VERSION = 2
+CHECKPOINT_INTERVAL = 100
+
+checkpoint_path = './blockchain/checkpoint.json'
+headers_path = './blockchain/headers.log'
+
+# Height of the tip the last checkpoint was written or loaded at
+checkpoint_height = None
+
+# (hash, byte offset of the end of its line) of every header in headers.log, entry n belongs to the block at height n
+saved_headers = []
+
+# The background thread writing the last checkpoint
+write_thread = None
+
+
+# Take a checkpoint of the derived state of the node at its current tip and write it in the background, the old
+# checkpoint is only replaced once the new one is done. A checkpoint isn't started while the last one is still being
+# written unless wait is set, then it waits for both
+def write(chain_stats, path=None, wait=False):
+    global checkpoint_height
+    global write_thread
+
+    if write_thread is not None and write_thread.is_alive():
+        if not wait:
+            return
+        write_thread.join()
+
+    if path is None:
+        path = checkpoint_path
+
+    height = blockchain.get_block_count() - 1
+
+    # Only the headers that aren't in headers.log yet are written, the ones a reorganization replaced are cut off
+    kept_headers = min(len(saved_headers), height + 1)
+    while kept_headers > 0 and blockchain.get_headers(kept_headers - 1, kept_headers)[0]['hash'] \
+            != saved_headers[kept_headers - 1][0]:
+        kept_headers -= 1
+
+    state = {
+        'address_index': addressindex.get_state(),
+        'undo_log': undolog.get_state(),
+        'chain_stats': chain_stats
+    }
+    header = {
+        'version': CHECKPOINT_VERSION,
+        'height': height,
+        'tip_hash': blockchain.get_tip_hash()
+    }
+
+    # Everything the checkpoint points at has to be on disk before it is
+    data_paths = [blockstore.get_segment_path(blockstore.segment_number), blockstore.index_path, addressindex.log_path,
+                  undolog.log_path]
+
+    write_thread = threading.Thread(target=write_files, daemon=True, args=(
+        path, header, state, dict(utxo.unspent_outputs), kept_headers, blockchain.get_headers(kept_headers, height + 1),
+        data_paths))
+    write_thread.start()
+    checkpoint_height = height
+
+    if wait:
+        write_thread.join()
+
+
+# Wait for the checkpoint being written in the background, if there is one
+def wait():
+    if write_thread is not None:
+        write_thread.join()
+
+
+# Write a checkpoint collected by write, this runs on the background thread
+def write_files(path, header, state, unspent_outputs, kept_headers, new_headers, data_paths):
+    for data_path in data_paths:
+        sync_path(data_path)
+
+    state['headers'] = save_headers(kept_headers, new_headers)
+    state['utxo'] = [[*outpoint, output['value'], output['pk_script']] for outpoint, output in unspent_outputs.items()]
+    state_data = json.dumps(state, separators=(',', ':')).encode()
+    header['checksum'] = sha256(state_data).hexdigest()
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(json.dumps(header).encode() + b'\n' + state_data)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    os.replace(path + '.tmp', path)
+
+
+# Cut headers.log back to its first kept_headers headers and append new_headers to it
+# Returns the count and log size the checkpoint records
+def save_headers(kept_headers, new_headers):
+    del saved_headers[kept_headers:]
+    log_size = saved_headers[-1][1] if len(saved_headers) > 0 else 0
+
+    with open(headers_path, 'ab') as f:
+        f.truncate(log_size)
+        for block_header in new_headers:
+            f.write((json.dumps(block_header, separators=(',', ':')) + '\n').encode())
+            saved_headers.append((block_header['hash'], f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+        log_size = f.tell()
+        f.close()
+
+    return {'count': len(saved_headers), 'log_size': log_size}
+
+
+# Read the headers a checkpoint recorded back from headers.log, returns None if the log doesn't hold them anymore
+def load_headers(saved):
+    saved_headers.clear()
+    if not os.path.isfile(headers_path):
+        return None
+
+    headers = []
+    log_size = 0
+    with open(headers_path, 'rb') as f:
+        for line in f:
+            if len(headers) == saved['count'] or not line.endswith(b'\n'):
+                break
+            log_size += len(line)
+            headers.append(json.loads(line))
+            saved_headers.append((headers[-1]['hash'], log_size))
+        f.close()
+
+    if len(headers) != saved['count'] or log_size != saved['log_size']:
+        saved_headers.clear()
+        return None
+
+    return headers
+
+
+# Fsync a file that may be open somewhere else by its path
+def sync_path(path):
+    if path is None or not os.path.isfile(path):
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Read the checkpoint and check that it still matches the chain
+# Returns (height, state), None if there is no checkpoint, or a string describing why it can't be used
+def load(path=None):
+    if path is None:
+        path = checkpoint_path
+
+    # A checkpoint still being written in the background is finished first
+    wait()
+    saved_headers.clear()
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            state_data = f.read()
+            f.close()
+    except (OSError, ValueError) as e:
+        return f"Could not read checkpoint: {e}"
+
+    if type(header) is not dict or header.get('version') != CHECKPOINT_VERSION:
+        return f"Checkpoint is not a version [{CHECKPOINT_VERSION}] checkpoint"
+
+    if sha256(state_data).hexdigest() != header.get('checksum'):
+        return "Checkpoint does not match its checksum"
+
+    height = header['height']
+    if height >= blockchain.get_block_count() or blockchain.hash_block(blockchain.get_block(index=height)) \
+            != header['tip_hash']:
+        return f"Block [{header['tip_hash']}] the checkpoint was taken at is no longer at height [{height}]"
+
+    state = json.loads(state_data)
+    try:
+        headers = load_headers(state['headers'])
+    except (OSError, ValueError) as e:
+        return f"Could not read the headers of the checkpoint: {e}"
+    if headers is None or len(headers) != height + 1 or headers[-1]['hash'] != header['tip_hash']:
+        return "The headers the checkpoint was taken with are no longer in the headers log"
+
+    state['headers'] = headers
+    return height, state
+
+
+# Returns True if CHECKPOINT_INTERVAL blocks were added since the last checkpoint
+def is_due():
+    height = blockchain.get_block_count() - 1
+    return checkpoint_height is None or abs(height - checkpoint_height) >= CHECKPOINT_INTERVAL
@@ -0,0 +1,146 @@
+"""
+Core.py is the concurrency model of the node. The chain, the UTXO set, the indexes and the mempool live in node.py and
+the modules under it, which don't lock anything themselves. Every thread that touches that state goes through here
+instead, so the server can handle many requests at once without corrupting it.
+
+Writes - anything that changes the state (adding a block, which may reorganize the chain, adding a transaction, which
+may evict others, saving a checkpoint) is handed to submit(). The writer thread takes jobs off writer_queue one at a
+time, so there is only ever one writer and changes are applied in the order they were submitted. The caller waits for
+its job and gets back whatever the function returned (or the exception it raised).
+
+Reads - a thread reading the state does it inside `with core.reading():`. Any number of readers can hold the state at
+once but never while the writer is applying a job, so a read sees the state between two writes and never half of one.
+A waiting write goes ahead of readers that arrive after it so a steady stream of reads can't hold writes off forever.
+
+Slow work that doesn't need the state, like waiting for the mempool journal to reach the disk, is handed to defer() by
+a job. It runs on the submitting thread after the job has let go of the state, so the writer can move on to the next
+job meanwhile and the submitter still only hears back once it is done.
+
+A job that submits another job or reads runs it straight away since it already has the state to itself. Submitting
+from inside `with core.reading():` would wait on itself and must not be done. Until start() is called submit() runs
+the job on the calling thread while holding the state the same way the writer thread would.
+"""
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+import queue
+import threading
+
+# (future, function, args) waiting for the writer thread
+writer_queue = queue.Queue()
+writer_thread = None
+
+state_condition = threading.Condition()
+active_readers = 0
+waiting_writers = 0
+writer_active = False
+
+# Whether the current thread is already reading or writing
+thread_state = threading.local()
+
+
+# Start the writer thread if it isn't running yet
+def start():
+    global writer_thread
+
+    if writer_thread is not None:
+        return
+
+    writer_thread = threading.Thread(target=run_writer, daemon=True)
+    writer_thread.start()
+
+
+# Apply the jobs on writer_queue one at a time
+def run_writer():
+    while True:
+        future, function, args = writer_queue.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+
+        thread_state.deferred = []
+        future.deferred = thread_state.deferred
+        try:
+            with writing():
+                result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+# Run function(*args) as a write and return what it returned once it has been applied
+def submit(function, *args):
+    if getattr(thread_state, 'writing', False):
+        return function(*args)
+
+    if writer_thread is None:
+        with writing():
+            return function(*args)
+
+    future = Future()
+    writer_queue.put((future, function, args))
+    try:
+        return future.result()
+    finally:
+        for deferred_function, deferred_args in future.deferred:
+            deferred_function(*deferred_args)
+
+
+# Run function(*args) on the thread that submitted the current job once the job is done, right away outside of a job
+# on the writer thread
+def defer(function, *args):
+    if threading.current_thread() is writer_thread:
+        thread_state.deferred.append((function, args))
+    else:
+        function(*args)
+
+
+"""
+Readers-writer lock
+"""
+
+
+# Hold the state for reading, shared with other readers
+@contextmanager
+def reading():
+    global active_readers
+
+    if getattr(thread_state, 'writing', False) or getattr(thread_state, 'reading', False):
+        yield
+        return
+
+    with state_condition:
+        state_condition.wait_for(lambda: not writer_active and waiting_writers == 0)
+        active_readers += 1
+
+    thread_state.reading = True
+    try:
+        yield
+    finally:
+        thread_state.reading = False
+        with state_condition:
+            active_readers -= 1
+            if active_readers == 0:
+                state_condition.notify_all()
+
+
+# Hold the state for writing, nobody else can read or write it meanwhile
+@contextmanager
+def writing():
+    global waiting_writers
+    global writer_active
+
+    with state_condition:
+        waiting_writers += 1
+        state_condition.wait_for(lambda: not writer_active and active_readers == 0)
+        waiting_writers -= 1
+        writer_active = True
+
+    thread_state.writing = True
+    try:
+        yield
+    finally:
+        thread_state.writing = False
+        with state_condition:
+            writer_active = False
+            state_condition.notify_all()
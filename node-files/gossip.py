@@ -0,0 +1,168 @@
+"""
+Gossip.py spreads new transactions to other nodes in the background so that /node/tx/submit returns as soon as the
+transaction is in this node's mempool, however many peers there are.
+
+Transactions are queued by announce() and a single gossip thread wakes up every GOSSIP_INTERVAL seconds (or as soon as
+BATCH_SIZE transactions are waiting) to send everything queued as one batch. Each batch goes to at most FANOUT randomly
+chosen peers, the peers pass it on the same way so it still reaches the whole network. Posts go through a small pool of
+sender threads that each keep a keep-alive session per peer, and at most MAX_CONCURRENCY posts are in flight at once.
+
+Every transaction id that was accepted or sent is remembered (up to SEEN_CAPACITY of them) so a transaction that comes
+back around from another peer is dropped before it is verified again or gossiped twice.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import random
+import threading
+import requests
+import core
+import mempool
+import node
+import peers
+
+GOSSIP_INTERVAL = 0.2
+BATCH_SIZE = 100
+FANOUT = 8
+MAX_CONCURRENCY = 8
+SEEN_CAPACITY = 50000
+GOSSIP_TIMEOUT = 5
+
+# tx_id -> None, oldest first, used as a bounded set
+seen_tx_ids = OrderedDict()
+
+# (transaction, url of the peer it came from) waiting for the next batch
+pending = []
+pending_lock = threading.Lock()
+pending_event = threading.Event()
+
+# Limits how many batches are being posted at once, the gossip thread waits here instead of queueing without bound
+send_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+send_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+
+# Every sender thread gets its own requests session so connections to peers are kept alive and reused
+thread_state = threading.local()
+
+gossip_thread = None
+
+
+# Remember a tx_id, returns False if it was already known
+def mark_seen(tx_id):
+    if tx_id in seen_tx_ids:
+        seen_tx_ids.move_to_end(tx_id)
+        return False
+
+    seen_tx_ids[tx_id] = None
+    if len(seen_tx_ids) > SEEN_CAPACITY:
+        seen_tx_ids.popitem(last=False)
+
+    return True
+
+
+# Queue a transaction this node accepted to be sent to its peers, sender_url is left out when it is sent on
+def announce(transaction, sender_url=None):
+    with pending_lock:
+        if not mark_seen(transaction['tx_id']):
+            return
+
+        pending.append((transaction, sender_url))
+        batch_full = len(pending) >= BATCH_SIZE
+
+    start()
+    if batch_full:
+        pending_event.set()
+
+
+# Handle a batch of transactions gossiped by sender_url, returns a dict of how many were added, already known and why
+# the rest were rejected
+def receive_transactions(transactions, sender_url=None):
+    result = {
+        'added': 0,
+        'known': 0,
+        'rejected': {}
+    }
+
+    candidates = []
+    with core.reading():
+        for index, transaction in enumerate(transactions):
+            tx_id = transaction.get('tx_id') if type(transaction) is dict else None
+
+            with pending_lock:
+                known = tx_id in seen_tx_ids
+            if known or (type(tx_id) is str and mempool.get(tx_id) is not None):
+                result['known'] += 1
+                continue
+
+            candidates.append((index, tx_id, transaction))
+
+    # Everything new is verified and added to the mempool as one batch
+    verification_errors = core.submit(node.add_batch_to_mempool, [transaction for _, _, transaction in candidates])
+
+    for (index, tx_id, transaction), verification_error in zip(candidates, verification_errors):
+        if verification_error is not None:
+            result['rejected'][str(tx_id if tx_id is not None else index)] = verification_error
+            continue
+
+        result['added'] += 1
+        announce(transaction, sender_url)
+
+    return result
+
+
+# Start the gossip thread if it isn't running yet
+def start():
+    global gossip_thread
+
+    with pending_lock:
+        if gossip_thread is not None:
+            return
+
+        gossip_thread = threading.Thread(target=run, name='gossip', daemon=True)
+        gossip_thread.start()
+
+
+# Gossip thread, sends whatever is queued every GOSSIP_INTERVAL seconds or when a batch fills up
+def run():
+    while True:
+        pending_event.wait(GOSSIP_INTERVAL)
+        pending_event.clear()
+        flush()
+
+
+# Send everything queued to up to FANOUT peers, a peer never gets back the transactions it sent this node
+def flush():
+    with pending_lock:
+        if len(pending) == 0:
+            return
+
+        batch = pending[:]
+        pending.clear()
+
+    peer_urls = peers.get_peers()
+    for peer_url in random.sample(peer_urls, min(FANOUT, len(peer_urls))):
+        transactions = [transaction for transaction, sender_url in batch if sender_url != peer_url]
+        if len(transactions) == 0:
+            continue
+
+        body = json.dumps({
+            'transactions': transactions,
+            'sender': peers.own_url
+        })
+
+        send_slots.acquire()
+        send_executor.submit(post_transactions, peer_url, body)
+
+
+# Post a batch to a single peer over this thread's keep-alive session, a peer that can't be reached misses the batch
+def post_transactions(peer_url, body):
+    try:
+        if not hasattr(thread_state, 'session'):
+            thread_state.session = requests.Session()
+
+        thread_state.session.post(f'{peer_url}/node/tx/broadcast', body, timeout=GOSSIP_TIMEOUT,
+                                  headers={'Content-Type': 'application/json'})
+    except requests.RequestException:
+        pass
+    finally:
+        send_slots.release()
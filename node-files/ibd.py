@@ -0,0 +1,260 @@
+"""
+Ibd.py is the initial block download used to bootstrap a node that is far behind the network. Unlike sync.py, which
+pulls every block from a single peer one range after another, it spreads the download over every peer that has the
+blocks:
+
+The header chain is downloaded and checked headers-first from the peer with the longest chain (see sync.py), then the
+missing heights are cut into ranges of RANGE_SIZE blocks. Ranges are requested from several peers at once, with at
+most REQUESTS_PER_PEER outstanding per peer and never more than WINDOW ranges ahead of the next block to verify so a
+slow range can't make memory grow without bound.
+
+Downloads run on background threads while the calling thread verifies finished ranges in height order, so verifying
+one range overlaps with downloading the next ones. A range that has been in flight for longer than STALL_TIMEOUT
+seconds, or that a peer answered with the wrong blocks, is requested again from another peer. A peer that fails
+MAX_FAILURES times is dropped for the rest of the download.
+
+Progress is printed every PROGRESS_INTERVAL seconds and kept in the progress dict for /node/info/stats.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+import requests
+import blockchain
+import core
+import node
+import sync
+
+RANGE_SIZE = 100
+REQUESTS_PER_PEER = 2
+WINDOW = 32
+STALL_TIMEOUT = 15
+MAX_FAILURES = 3
+PROGRESS_INTERVAL = 5
+
+# Every download thread keeps its own keep-alive session
+thread_state = threading.local()
+
+# Only one download can run at a time
+download_lock = threading.Lock()
+
+progress = {
+    'running': False,
+    'start_height': None,
+    'height': None,
+    'target_height': None,
+    'peers': 0,
+    'blocks_per_second': 0.0,
+    'error': None
+}
+
+
+# Download and verify the chain from peer_urls until this node has the longest chain any of them has
+# Returns None if it caught up, otherwise a string describing why it stopped
+def download_chain(peer_urls):
+    if not download_lock.acquire(blocking=False):
+        return "An initial block download is already running"
+
+    try:
+        progress['running'] = True
+        progress['error'] = download_from_peers(peer_urls)
+        return progress['error']
+    finally:
+        progress['running'] = False
+        download_lock.release()
+
+
+# Finds the peer with the longest chain, checks its headers and then downloads the blocks from every peer
+def download_from_peers(peer_urls):
+    session = requests.Session()
+
+    # Ask every peer for its tip, peers that don't answer are left out
+    peer_heights = {}
+    for peer_url in peer_urls:
+        try:
+            peer_heights[peer_url] = sync.get_json(session, f'{peer_url}/node/chain/tip')['height']
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            continue
+
+    with core.reading():
+        local_height = blockchain.get_block_count() - 1
+        tip_hash = blockchain.get_tip_hash()
+
+    if len(peer_heights) == 0:
+        return "None of the peers could be reached"
+
+    best_peer = max(peer_heights, key=peer_heights.get)
+    if peer_heights[best_peer] <= local_height:
+        return f"No peer has a chain longer than this node's chain [{local_height}]"
+
+    try:
+        headers = sync.download_headers(session, best_peer, local_height, peer_heights[best_peer])
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        return f"Could not download headers from peer [{best_peer}]: {e}"
+
+    if type(headers) is str:
+        return headers
+
+    if headers[0]['hash'] != tip_hash:
+        return f"Chain of peer [{best_peer}] does not extend this node's chain, sync with it to find where they fork"
+
+    return download_blocks(peer_heights, headers)
+
+
+# Download the bodies of headers (after the first one, which is this node's tip) from every peer tall enough to have
+# them while verifying finished ranges in order
+def download_blocks(peer_heights, headers):
+    first_height = headers[0]['height'] + 1
+    last_height = headers[-1]['height']
+
+    # Ranges not requested yet (or that have to be requested again), by start height
+    queued = list(range(first_height, last_height + 1, RANGE_SIZE))
+    # future -> (start height, peer, time it was requested)
+    in_flight = {}
+    # start height -> blocks, waiting for the ranges before them to be verified
+    downloaded = {}
+    # start height -> peers that already failed to deliver it
+    failed_peers = {}
+    failures = {peer_url: 0 for peer_url in peer_heights}
+
+    next_height = first_height
+    started = time.time()
+    last_report = started
+    progress.update({
+        'start_height': first_height - 1,
+        'height': first_height - 1,
+        'target_height': last_height,
+        'blocks_per_second': 0.0
+    })
+
+    # Twice the requests that can be outstanding so threads stuck on a stalled peer don't hold up the re-requests
+    executor = ThreadPoolExecutor(max_workers=max(1, len(peer_heights) * REQUESTS_PER_PEER * 2))
+    try:
+        while next_height <= last_height:
+            # Ranges that have been in flight too long go back to the front of the queue for another peer
+            now = time.time()
+            for future, (range_start, peer_url, requested) in list(in_flight.items()):
+                if now - requested > STALL_TIMEOUT:
+                    del in_flight[future]
+                    failed_peers.setdefault(range_start, set()).add(peer_url)
+                    failures[peer_url] += 1
+                    queued.insert(0, range_start)
+
+            usable_peers = [peer_url for peer_url in peer_heights if failures[peer_url] < MAX_FAILURES]
+            if len(usable_peers) == 0:
+                return f"Every peer failed to deliver blocks, stopped at height [{next_height - 1}]"
+            progress['peers'] = len(usable_peers)
+
+            assign_ranges(executor, queued, in_flight, downloaded, failed_peers, usable_peers, peer_heights,
+                          next_height, last_height)
+
+            if len(in_flight) > 0 and next_height not in downloaded:
+                done, not_done = wait(list(in_flight), timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    range_start, peer_url, requested = in_flight.pop(future)
+                    blocks = future.result()
+                    range_end = min(range_start + RANGE_SIZE, last_height + 1)
+
+                    if range_start < next_height or range_start in downloaded:
+                        continue
+
+                    if not matches_headers(blocks, headers, range_start, range_end):
+                        failed_peers.setdefault(range_start, set()).add(peer_url)
+                        failures[peer_url] += 1
+                        queued.insert(0, range_start)
+                        continue
+
+                    downloaded[range_start] = blocks
+            elif len(in_flight) == 0 and next_height not in downloaded:
+                # Every peer that has the next range is waiting to be given another chance, try again shortly
+                time.sleep(0.1)
+
+            # Verify every range that is ready, the downloads keep going on the other threads meanwhile
+            while next_height in downloaded:
+                for height, block in enumerate(downloaded.pop(next_height), start=next_height):
+                    verification_error = core.submit(node.add_to_blockchain, block)
+                    if verification_error is not None:
+                        return f"Block at height [{height}] is invalid: {verification_error}"
+
+                next_height = min(next_height + RANGE_SIZE, last_height + 1)
+
+            now = time.time()
+            progress['height'] = next_height - 1
+            progress['blocks_per_second'] = (next_height - first_height) / max(now - started, 1e-9)
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                report()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    report()
+    return None
+
+
+# Request queued ranges from idle peers, only ranges within WINDOW ranges of the next block to verify are requested
+def assign_ranges(executor, queued, in_flight, downloaded, failed_peers, usable_peers, peer_heights, next_height,
+                  last_height):
+    window_end = next_height + WINDOW * RANGE_SIZE
+    outstanding = {peer_url: 0 for peer_url in usable_peers}
+    for range_start, peer_url, requested in in_flight.values():
+        if peer_url in outstanding:
+            outstanding[peer_url] += 1
+
+    for range_start in list(queued):
+        if range_start >= window_end:
+            break
+
+        if range_start < next_height or range_start in downloaded:
+            queued.remove(range_start)
+            continue
+
+        range_end = min(range_start + RANGE_SIZE, last_height + 1)
+        excluded = failed_peers.get(range_start, set())
+
+        # The least busy peer that has every block in the range and hasn't failed it yet
+        candidates = [peer_url for peer_url in usable_peers if outstanding[peer_url] < REQUESTS_PER_PEER
+                      and peer_heights[peer_url] >= range_end - 1 and peer_url not in excluded]
+        if len(candidates) == 0:
+            # Every peer that has the range already failed it once, give them another chance
+            if all(peer_url in excluded for peer_url in usable_peers if peer_heights[peer_url] >= range_end - 1):
+                failed_peers.pop(range_start, None)
+            continue
+
+        peer_url = min(candidates, key=outstanding.get)
+        outstanding[peer_url] += 1
+        queued.remove(range_start)
+        future = executor.submit(fetch_range, peer_url, range_start, range_end)
+        in_flight[future] = (range_start, peer_url, time.time())
+
+
+# Returns the blocks from start to end (exclusive) from a peer, or None if it didn't answer
+def fetch_range(peer_url, start, end):
+    try:
+        if not hasattr(thread_state, 'session'):
+            thread_state.session = requests.Session()
+
+        return sync.get_json(thread_state.session, f'{peer_url}/node/chain/blocks?start={start}&end={end}')
+    except (requests.RequestException, ValueError):
+        return None
+
+
+# Returns True if blocks are exactly the blocks the checked headers from start to end (exclusive) describe
+def matches_headers(blocks, headers, start, end):
+    if type(blocks) is not list or len(blocks) != end - start:
+        return False
+
+    first_height = headers[0]['height']
+    try:
+        for height, block in enumerate(blocks, start=start):
+            if blockchain.hash_block(block) != headers[height - first_height]['hash']:
+                return False
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+    return True
+
+
+# Print how far along the download is
+def report():
+    print(f"[initial block download] height: {progress['height']}/{progress['target_height']} | "
+          f"{progress['blocks_per_second']:.1f} blocks/s | peers: {progress['peers']}")
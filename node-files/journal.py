@@ -0,0 +1,271 @@
+"""
+Journal.py is the write-ahead journal the mempool is persisted through. Instead of rewriting all of mempool.json after
+every change, each transaction added to or removed from the pool is appended to the journal as one small record, so a
+write costs the size of the change instead of the size of the pool.
+
+Record layout (./mempool/journal.log), one compact json line per change:
+{"add": transaction}
+{"remove": tx_id}
+
+mempool.json is the base, the pool as it was when the journal was last compacted. The pool is the base with the
+journal replayed on top of it. A torn last line from a crash ends the usable part of the journal.
+
+Compaction starts a new journal and writes a fresh base from a copy of the pool on a background thread. The journal
+it replaced is kept as journal.log.old until the new base is on disk, when the node starts it replays the base, the
+old journal (if compaction was cut off) and then the current one. Replaying a record twice leaves the pool the same,
+so it doesn't matter whether the base already had the old journal's changes in it.
+
+The durability mode decides when a commit returns:
+'always'   - after the records written so far are fsynced, every commit pays for its own fsync
+'group'    - after the flusher thread has fsynced them, commits that come in while it is busy share its next fsync
+'periodic' - straight away, the flusher fsyncs every FLUSH_INTERVAL seconds so a crash can lose that much
+"""
+
+import os
+import json
+import threading
+import time
+
+DURABILITY_MODES = ['always', 'group', 'periodic']
+FLUSH_INTERVAL = 1
+
+# Compaction starts once the journal holds this many records, or twice as many as the pool has transactions if more
+COMPACT_RECORDS = 1000
+
+base_path = None
+log_path = None
+old_log_path = None
+durability = 'always'
+log_file = None
+
+# Records written and records known to be on disk since the node started, never reset
+written_count = 0
+synced_count = 0
+
+# Records in the current journal
+journal_records = 0
+compacting = False
+
+# write_lock guards the journal file, sync_lock is held while it is fsynced or swapped for a new one
+write_lock = threading.Lock()
+sync_lock = threading.Lock()
+synced_condition = threading.Condition()
+commit_requested = threading.Event()
+flusher = None
+
+
+# Returns the base and every journaled record (oldest first) that has to be replayed on top of it
+def load(base='./mempool/mempool.json', path='./mempool/journal.log'):
+    global base_path
+    global log_path
+    global old_log_path
+
+    base_path = base
+    log_path = path
+    old_log_path = path + '.old'
+
+    base_entries = []
+    if os.path.isfile(base_path):
+        with open(base_path, 'r') as f:
+            base_entries = json.load(f)
+            f.close()
+
+    records = []
+    for journal_path in [old_log_path, log_path]:
+        if not os.path.isfile(journal_path):
+            continue
+
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+            f.close()
+
+    return base_entries, records
+
+
+# Write entries as the new base, drop the old journals and start appending to an empty one
+def open_journal(entries, mode='always'):
+    global log_file
+    global durability
+    global journal_records
+    global flusher
+
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"Durability mode must be one of {DURABILITY_MODES} but it was [{mode}]")
+
+    close()
+    durability = mode
+
+    write_base(entries)
+    for journal_path in [old_log_path, log_path]:
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+    log_file = open(log_path, 'ab')
+    journal_records = 0
+
+    if durability != 'always' and flusher is None:
+        flusher = threading.Thread(target=run_flusher, daemon=True)
+        flusher.start()
+
+
+# Flush and fsync everything written to the journal and stop writing to it
+def close():
+    global log_file
+
+    if log_file is None:
+        return
+
+    sync_written()
+    with sync_lock, write_lock:
+        log_file.close()
+        log_file = None
+
+
+"""
+Writing and committing
+"""
+
+
+# Append a change to the journal, it is only durable once commit returns (nothing is written before open_journal)
+def append(record):
+    global written_count
+    global journal_records
+
+    with write_lock:
+        if log_file is None:
+            return
+
+        log_file.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+        written_count += 1
+        journal_records += 1
+
+
+# Make the records appended so far as durable as the durability mode promises
+def commit():
+    if log_file is None:
+        return
+
+    if durability == 'always':
+        sync_written()
+
+    elif durability == 'group':
+        with write_lock:
+            target = written_count
+        commit_requested.set()
+        with synced_condition:
+            synced_condition.wait_for(lambda: synced_count >= target)
+
+    else:
+        with write_lock:
+            log_file.flush()
+
+
+# Fsync the journal up to the last record written, other threads can keep appending while the fsync runs
+def sync_written():
+    global synced_count
+
+    with sync_lock:
+        with write_lock:
+            if log_file is None:
+                return
+            target = written_count
+            log_file.flush()
+            fd = log_file.fileno()
+
+        os.fsync(fd)
+
+        with synced_condition:
+            synced_count = max(synced_count, target)
+            synced_condition.notify_all()
+
+
+# Fsync the journal whenever a group commit is waiting, or every FLUSH_INTERVAL seconds in periodic mode
+def run_flusher():
+    while True:
+        if durability == 'group':
+            commit_requested.wait()
+            commit_requested.clear()
+        else:
+            time.sleep(FLUSH_INTERVAL)
+
+        sync_written()
+
+
+"""
+Compaction
+"""
+
+
+# Returns True if the journal has grown enough compared to the pool (of pool_size transactions) to compact it
+def needs_compaction(pool_size):
+    return not compacting and journal_records >= max(COMPACT_RECORDS, 2 * pool_size)
+
+
+# Start a new journal and write entries, a copy of the pool with every record so far applied, as the base in the
+# background. Has to be called from the thread making changes to the pool so nothing is appended in between
+def compact(entries):
+    global log_file
+    global journal_records
+    global compacting
+    global synced_count
+
+    with sync_lock, write_lock:
+        if compacting or log_file is None:
+            return
+        compacting = True
+
+        log_file.flush()
+        os.fsync(log_file.fileno())
+        log_file.close()
+
+        os.replace(log_path, old_log_path)
+        log_file = open(log_path, 'ab')
+        journal_records = 0
+        target = written_count
+
+    with synced_condition:
+        synced_count = max(synced_count, target)
+        synced_condition.notify_all()
+
+    thread = threading.Thread(target=finish_compaction, args=(entries,), daemon=True)
+    thread.start()
+
+
+# Write the new base and drop the journal it replaces
+def finish_compaction(entries):
+    global compacting
+
+    write_base(entries)
+    if os.path.isfile(old_log_path):
+        os.remove(old_log_path)
+    compacting = False
+
+
+# Write the base, the old file is only replaced once the new one is on disk
+def write_base(entries):
+    with open(base_path + '.tmp', 'w') as f:
+        f.write(json.dumps(entries, indent=4))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    os.replace(base_path + '.tmp', base_path)
+
+
+# Returns the size of the journal and how much of it is on disk
+def get_stats():
+    stats = {
+        'durability': durability,
+        'records': journal_records,
+        'written': written_count,
+        'synced': synced_count,
+        'compacting': compacting
+    }
+
+    return stats
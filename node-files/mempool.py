@@ -0,0 +1,240 @@
+"""
+Mempool.py holds the node's pool of unconfirmed transactions in memory. node.py is still the only module that decides
+what goes in or out of it, this module just keeps the data structures that make those decisions cheap:
+
+transactions        tx_id -> transaction, in the order they arrived
+fees                tx_id -> fee the transaction pays, worked out once by node.py when it is admitted
+sizes               tx_id -> size of the transaction serialized as compact json in bytes
+fee_rate_index      (-fee per byte, arrival number, tx_id) of every transaction, sorted so the best fee rate is first
+spent_outpoints     (height, tx index, output index) -> tx_id of the mempool transaction redeeming that output
+outputs_by_address  pk_script -> list of (tx_id, output index) for outputs sent to that key
+
+The pool holds at most max_bytes of serialized transactions. When a new transaction pushes it over, the transactions
+with the lowest fee per byte are evicted until it fits again, which may be the new transaction itself. Block builders
+walk fee_rate_index from the front to pick the best transactions without sorting the pool.
+
+Every change is appended to a write-ahead journal (see journal.py) and save commits it, ./mempool/mempool.json is
+only rewritten in the background when the journal is compacted. When the node starts the pool is rebuilt from that file
+and the journal. Every change bumps version so callers can tell if the pool is different from before.
+"""
+
+import os
+import json
+from bisect import bisect_left, insort
+from itertools import count as counter
+from uuid import uuid4
+import core
+import journal
+import utxo
+
+mempool_path = None
+version = 0
+
+# Byte cap on the serialized transactions in the pool and how many bytes they take up now
+max_bytes = 16 * 1024 * 1024
+total_bytes = 0
+
+# Breaks fee rate ties in favour of the transaction that arrived first
+arrival_numbers = counter()
+
+# Changes every time the mempool is loaded so a version number from before a restart is never mistaken for a new one
+generation = uuid4().hex
+
+transactions = {}
+fees = {}
+sizes = {}
+fee_rate_index = []
+index_keys = {}
+spent_outpoints = {}
+outputs_by_address = {}
+
+
+# Load the saved mempool into memory, size_limit is the byte cap on the pool and durability is the journal's
+# durability mode
+def initialize(path='./mempool/mempool.json', size_limit=16 * 1024 * 1024, durability='always'):
+    global mempool_path
+    global generation
+    global max_bytes
+    global total_bytes
+
+    mempool_path = path
+    generation = uuid4().hex
+    total_bytes = 0
+    transactions.clear()
+    fees.clear()
+    sizes.clear()
+    fee_rate_index.clear()
+    index_keys.clear()
+    spent_outpoints.clear()
+    outputs_by_address.clear()
+
+    # Nothing is journaled or evicted while the saved changes are replayed, the fees aren't known yet so the cap would
+    # evict by arrival order. node.py re-admits the pool with its real fees afterwards and the cap applies then
+    journal.close()
+    max_bytes = float('inf')
+    base_entries, records = journal.load(mempool_path, os.path.join(os.path.dirname(mempool_path), 'journal.log'))
+
+    for tx in base_entries:
+        if find_conflict(tx) is None and tx['tx_id'] not in transactions:
+            add(tx)
+
+    for record in records:
+        if 'add' in record and find_conflict(record['add']) is None and record['add']['tx_id'] not in transactions:
+            add(record['add'])
+        elif 'remove' in record:
+            remove(record['remove'])
+
+    max_bytes = size_limit
+
+    # Start from a fresh base so the journal only holds changes made from now on
+    journal.open_journal(get_all(), durability)
+
+
+# Commit the changes made to the mempool since the last save, compacting the journal once it has grown too long
+# The commit waits for the disk after the writer has moved on (see core.py)
+def save():
+    core.defer(journal.commit)
+
+    if journal.needs_compaction(len(transactions)):
+        journal.compact(get_all())
+
+
+# Commit anything left in the journal and close it
+def close():
+    journal.close()
+
+
+"""
+Transaction getters and setters
+"""
+
+
+# Add an already verified transaction to the pool along with the fee it pays
+# Returns the tx_ids evicted to keep the pool under max_bytes, which includes this transaction if its fee rate is the
+# lowest in the pool
+def add(transaction, fee=0):
+    global version
+    global total_bytes
+
+    tx_id = transaction['tx_id']
+    transactions[tx_id] = transaction
+    fees[tx_id] = fee
+    sizes[tx_id] = len(json.dumps(transaction, separators=(',', ':')))
+    total_bytes += sizes[tx_id]
+
+    index_keys[tx_id] = (-fee / sizes[tx_id], next(arrival_numbers), tx_id)
+    insort(fee_rate_index, index_keys[tx_id])
+    journal.append({'add': transaction})
+
+    for tx_input in transaction['inputs']:
+        outpoint = utxo.make_outpoint(tx_input['previous_output'])
+        if outpoint is not None:
+            spent_outpoints[outpoint] = tx_id
+
+    for output_index, output in enumerate(transaction['outputs']):
+        outputs_by_address.setdefault(output['pk_script'], []).append((tx_id, output_index))
+
+    version += 1
+
+    # Mempool transactions only redeem confirmed outputs, so evicting one never invalidates another
+    evicted = []
+    while total_bytes > max_bytes and len(fee_rate_index) > 0:
+        evicted.append(fee_rate_index[-1][2])
+        remove(fee_rate_index[-1][2])
+
+    return evicted
+
+
+# Remove a transaction from the pool by id and return it, or None if it wasn't there
+def remove(tx_id):
+    global version
+    global total_bytes
+
+    transaction = transactions.pop(tx_id, None)
+    if transaction is None:
+        return None
+    fees.pop(tx_id, None)
+    total_bytes -= sizes.pop(tx_id)
+
+    key = index_keys.pop(tx_id)
+    del fee_rate_index[bisect_left(fee_rate_index, key)]
+    journal.append({'remove': tx_id})
+
+    for tx_input in transaction['inputs']:
+        outpoint = utxo.make_outpoint(tx_input['previous_output'])
+        if spent_outpoints.get(outpoint) == tx_id:
+            del spent_outpoints[outpoint]
+
+    for output in transaction['outputs']:
+        entries = outputs_by_address.get(output['pk_script'], [])
+        entries[:] = [entry for entry in entries if entry[0] != tx_id]
+        if len(entries) == 0:
+            outputs_by_address.pop(output['pk_script'], None)
+
+    version += 1
+    return transaction
+
+
+# Remove the transactions a block confirmed along with any mempool transaction that now double-spends the block
+def remove_block_transactions(block_dict):
+    for tx in block_dict['transactions']:
+        remove(tx['tx_id'])
+
+        for tx_input in tx['inputs']:
+            outpoint = utxo.make_outpoint(tx_input['previous_output'])
+            if outpoint in spent_outpoints:
+                remove(spent_outpoints[outpoint])
+
+
+# Returns the tx_id of a mempool transaction redeeming any of the same outputs as this one, otherwise None
+def find_conflict(transaction):
+    for tx_input in transaction['inputs']:
+        outpoint = utxo.make_outpoint(tx_input['previous_output'])
+        if outpoint in spent_outpoints:
+            return spent_outpoints[outpoint]
+
+    return None
+
+
+# Returns a transaction by tx_id, or None
+def get(tx_id):
+    return transactions.get(tx_id)
+
+
+# Returns every transaction in arrival order
+def get_all():
+    return list(transactions.values())
+
+
+# Yields transactions from the highest fee per byte to the lowest
+def iter_by_fee_rate():
+    for negative_rate, arrival_number, tx_id in fee_rate_index:
+        yield transactions[tx_id]
+
+
+# Returns the fee per serialized byte a transaction pays
+def get_fee_rate(tx_id):
+    return fees[tx_id] / sizes[tx_id]
+
+
+# Returns the number of transactions in the pool
+def count():
+    return len(transactions)
+
+
+# Returns how full the pool is and the fee rates at either end of it
+def get_stats():
+    stats = {
+        'transactions': len(transactions),
+        'bytes': total_bytes,
+        'max_bytes': max_bytes,
+        'highest_fee_rate': -fee_rate_index[0][0] if len(fee_rate_index) > 0 else None,
+        'lowest_fee_rate': -fee_rate_index[-1][0] if len(fee_rate_index) > 0 else None
+    }
+
+    return stats
+
+
+# Returns a tag that changes whenever the contents of the mempool do
+def get_version_tag():
+    return f'{generation}-{version}'
@@ -52,18 +52,50 @@ then the transaction is invalid.
 """
 
 import os
-import json
+import threading
 import blockchain
-import ecdsa
+import blocktree
+import checkpoint
+import core
+import journal
+import utxo
+import undolog
+import addressindex
+import mempool
+import schema
+import sigverify
+import snapshot
 
 block_reward = 1000
 block_difficulty = None
 block_transaction_minimum = None
 block_transaction_maximum = None
 
+# Totals over the whole chain, kept up to date as blocks are connected and disconnected
+# (when the node started from a UTXO snapshot transactions are only counted from the snapshot onwards)
+chain_stats = {
+    'blocks': 0,
+    'transactions': 0,
+    'supply': 0.0
+}
+
+# False while the address index and undo log are built in the background after starting from a UTXO snapshot, until
+# then address queries, reorganizations and checkpoints have to wait
+history_available = True
+history_builder = None
+
+# Number of blocks build_history reads from the chain at a time
+HISTORY_BATCH = 100
+
+# Key and type tables compiled from the example-json templates when the node starts
+transaction_schema = None
+coinbase_schema = None
+block_schema = None
+
 
 # Create directories and assign node parameters
-def initialize(difficulty=1, tx_min=0, tx_max=10):
+def initialize(difficulty=1, tx_min=0, tx_max=10, verify_workers=0, signature_cache_size=10000, snapshot_path=None,
+               mempool_size=16 * 1024 * 1024, durability='always'):
     # Setting the values of the node parameters
     # (I know using global state is bad but these arent constants and need to be accessible by this entire module...)
     # (in order for it to adjust over time. So for this purpose I think global state is a reasonable design choice.)
@@ -77,15 +109,175 @@ def initialize(difficulty=1, tx_min=0, tx_max=10):
     block_transaction_minimum = tx_min
     block_transaction_maximum = tx_max
 
+    # Read the templates once and keep only what verification needs from them
+    global transaction_schema
+    global coinbase_schema
+    global block_schema
+
+    transaction_schema = schema.compile_schema(blockchain.get_transaction_template())
+    coinbase_schema = schema.compile_schema(blockchain.get_coinbase_template())
+    block_schema = schema.compile_schema(blockchain.get_block_template())
+
+    # Start the signature verification workers (0 checks signatures in this process) before any other thread is started
+    sigverify.initialize(verify_workers, signature_cache_size)
+
     # Create mempool directory
     if not os.path.isdir('./mempool'):
         os.mkdir('./mempool')
 
-    if not os.path.isfile('./mempool/mempool.json'):
-        with open('./mempool/mempool.json', 'w+') as f:
-            data = []
-            f.write(json.dumps(data))
-            f.close()
+    # Load the mempool and replay its journal into memory, never holding more than mempool_size bytes of transactions
+    mempool.initialize('./mempool/mempool.json', mempool_size, durability)
+
+    # Build the UTXO set and address index from the checkpoint and the blocks after it (or a UTXO snapshot and the
+    # blocks after it, or every block on disk)
+    rebuild_state(snapshot_path)
+
+    # Every known block, including side chains, with the work behind it
+    blocktree.initialize(block_difficulty)
+
+    # Check the saved mempool against the chain, work out the fee of every transaction in it and apply the byte cap
+    restore_mempool([])
+
+    # A snapshot the logs didn't reach yet leaves them to be built in the background
+    if not history_available:
+        start_history_builder()
+
+
+# Replay the chain into the UTXO set, only indexing blocks that the address index and undo logs don't already hold
+# A usable checkpoint means only the blocks after it are replayed. Otherwise, with a snapshot the UTXO set is loaded
+# from it and only the blocks after it are replayed. The blocks up to the snapshot are then verified in the background,
+# and if the logs don't cover the snapshot's height yet they are built in the background too (see build_history)
+def rebuild_state(snapshot_path=None):
+    global history_available
+
+    history_available = True
+    utxo.unspent_outputs.clear()
+    chain_stats.update({'blocks': 0, 'transactions': 0, 'supply': 0.0})
+
+    start = restore_checkpoint()
+    if start is not None:
+        indexed_blocks = start
+        undo_blocks = start
+    else:
+        start = 0
+        indexed_blocks = addressindex.initialize(blockchain.get_block_count())
+        undo_blocks = undolog.initialize(blockchain.get_block_count())
+
+    if snapshot_path is not None and start == 0:
+        loaded = snapshot.load(snapshot_path)
+        if type(loaded) is str:
+            print(f"[snapshot] {loaded}, replaying the whole chain instead")
+        else:
+            snapshot_info, unspent_outputs = loaded
+            if min(indexed_blocks, undo_blocks) <= snapshot_info['height']:
+                print(f"[snapshot] The address index and undo logs don't reach height [{snapshot_info['height']}], "
+                      f"building them in the background")
+                history_available = False
+
+            utxo.unspent_outputs.update(unspent_outputs)
+            start = snapshot_info['height'] + 1
+            chain_stats['blocks'] = start
+            chain_stats['supply'] = sum(output['value'] for output in unspent_outputs.values())
+            snapshot.start_verification(snapshot_info, block_difficulty, block_reward)
+
+    for height, block in enumerate(blockchain.iter_blocks(start), start=start):
+        spent_outputs = utxo.connect_block(block, height)
+        if history_available and height >= indexed_blocks:
+            addressindex.connect_block(block, height, spent_outputs)
+        if history_available and height >= undo_blocks:
+            undolog.append(height, spent_outputs)
+        count_block(block, spent_outputs)
+
+
+# Start build_history on another thread
+def start_history_builder():
+    global history_builder
+
+    history_builder = threading.Thread(target=build_history, daemon=True)
+    history_builder.start()
+
+
+# Build the address index and undo log after starting from a UTXO snapshot by replaying the chain from genesis into a
+# private UTXO set. The chain only grows meanwhile (reorganizations wait for the undo log), so it is read a batch at a
+# time and the records are written by the writer until they reach the tip
+def build_history():
+    unspent_outputs = {}
+    height = 0
+
+    while True:
+        with core.reading():
+            blocks = list(blockchain.iter_blocks(height, height + HISTORY_BATCH))
+
+        records = []
+        for block in blocks:
+            records.append((block, height, utxo.connect_block(block, height, unspent_outputs)))
+            height += 1
+
+        if core.submit(write_history, records, height):
+            return
+
+
+# Write the records build_history replayed that the logs don't have yet, returns True once they reach the tip (of
+# chain_length blocks) and history is available
+def write_history(records, chain_length):
+    global history_available
+
+    for block, height, spent_outputs in records:
+        if height == addressindex.indexed_blocks:
+            addressindex.connect_block(block, height, spent_outputs)
+        if height == undolog.count():
+            undolog.append(height, spent_outputs)
+
+    if chain_length < blockchain.get_block_count():
+        return False
+
+    history_available = True
+    print("[snapshot] The address index and undo logs reach the tip, history is available")
+    return True
+
+
+# Load the derived state saved by the last checkpoint, returns the height to replay from or None if there is no usable
+# checkpoint and everything has to be rebuilt
+def restore_checkpoint():
+    checkpoint.checkpoint_height = None
+    loaded = checkpoint.load()
+    if type(loaded) is str:
+        print(f"[checkpoint] {loaded}, rebuilding from genesis")
+    if type(loaded) is not tuple:
+        return None
+
+    height, state = loaded
+    if not addressindex.restore(state['address_index']) or not undolog.restore(state['undo_log']):
+        print("[checkpoint] The address index or undo log is shorter than the checkpoint, rebuilding from genesis")
+        return None
+
+    for block_height, tx_index, output_index, value, pk in state['utxo']:
+        utxo.unspent_outputs[(block_height, tx_index, output_index)] = {'value': value, 'pk_script': pk}
+
+    blockchain.restore_headers(state['headers'])
+    chain_stats.update(state['chain_stats'])
+    checkpoint.checkpoint_height = height
+
+    return height + 1
+
+
+# Write a checkpoint of the derived state at the current tip in the background, not before the logs reach it
+# wait makes it wait for the checkpoint to be on disk
+def save_checkpoint(wait=False):
+    if not history_available:
+        return
+
+    checkpoint.write(dict(chain_stats), wait=wait)
+
+
+# Add (direction 1) or take away (direction -1) a block's share of the chain stats
+def count_block(block, spent_outputs, direction=1):
+    created = sum(output['value'] for tx in block['transactions'] for output in tx['outputs'])
+    spent = sum(output['value'] for outpoint, output in spent_outputs)
+
+    chain_stats['blocks'] += direction
+    chain_stats['transactions'] += direction * len(block['transactions'])
+    chain_stats['supply'] = round(chain_stats['supply'] + direction * (created - spent), 2)
 
 
 """
@@ -94,55 +286,54 @@ Data Verification
 
 
 # Returns a string describing the transaction verification error, otherwise returns None
-def verify_transaction(transaction_dict):
+def verify_transaction(transaction_dict, check_signature=True):
     # Verify that the data is a dict
     if type(transaction_dict) is not dict:
         return "Must submit a stringified python dict!"
 
-    # Data formatting validation
-    transaction_keys = list(transaction_dict.keys())
-    example_dict = blockchain.get_transaction_template()
-    example_keys = list(example_dict.keys())
-
     # Root key check
-    for key in example_keys:
-        if key not in transaction_keys:
+    mismatch = schema.find_mismatch(transaction_schema[''], transaction_dict)
+    if mismatch is not None:
+        key, reason = mismatch
+        if reason == 'missing':
             return "Not all required keys present. Check the example-json folder."
         # Root value type check
-        if type(example_dict[key]) != type(transaction_dict[key]):
-            return f"Dict key, {key} is type {type(transaction_dict[key])}, not {type(example_dict[key])}"
+        return f"Dict key, {key} is type {type(transaction_dict[key])}, not {dict(transaction_schema[''])[key]}"
 
     # Nested key check: user-data
-    for key in list(example_dict['user_data'].keys()):
-        if key not in list(transaction_dict['user_data'].keys()):
-            return ("[Improper formatting] Not all required keys present in 'user_data' dict." +
-                    " Check the example-json folder.")
-        # Nested value type check: user-data
-        if type(example_dict['user_data'][key]) != type(example_dict['user_data'][key]):
-            return (f"Dict key, {key} is type {type(transaction_dict['user_data'][key])}, " +
-                    f"not {type(example_dict['user_data'][key])}")
+    # (Only key presence is checked, the template's default signature is an int while real signatures are hex strings)
+    if schema.find_mismatch(transaction_schema['user_data'], transaction_dict['user_data'], False) is not None:
+        return ("[Improper formatting] Not all required keys present in 'user_data' dict." +
+                " Check the example-json folder.")
 
     # Nested key check: inputs
     for tx_input in transaction_dict['inputs']:
-        if len(tx_input['previous_output']) != 3:
-            return "All transaction inputs 'previous output' key should contain a list with exactly 3 values"
-        for key in list(example_dict['inputs'][0].keys()):
-            if key not in list(tx_input.keys()):
+        # The length of previous_output is checked before the keys and types of the input
+        try:
+            if len(tx_input['previous_output']) != 3:
+                return "All transaction inputs 'previous output' key should contain a list with exactly 3 values"
+        except (KeyError, TypeError):
+            pass
+
+        mismatch = schema.find_mismatch(transaction_schema['inputs[]'], tx_input)
+        if mismatch is not None:
+            key, reason = mismatch
+            if reason == 'missing':
                 return f"Key {key} not found in an input of this transaction"
             # Nested value type check: inputs
-            if type(example_dict['inputs'][0][key]) != type(tx_input[key]):
-                return (f"Dict key {key} is type {type(tx_input[key])}, " +
-                        f"not type {type(example_dict['inputs'][0][key])}")
+            return (f"Dict key {key} is type {type(tx_input[key])}, " +
+                    f"not type {dict(transaction_schema['inputs[]'])[key]}")
 
     # Nested key check: outputs
     for tx_output in transaction_dict['outputs']:
-        for key in list(example_dict['outputs'][0].keys()):
-            if key not in list(tx_output.keys()):
+        mismatch = schema.find_mismatch(transaction_schema['outputs[]'], tx_output)
+        if mismatch is not None:
+            key, reason = mismatch
+            if reason == 'missing':
                 return f"Key {key} not found in an input of this transaction"
             # Nested value type check: outputs
-            if type(example_dict['outputs'][0][key]) != type(tx_output[key]):
-                return (f"Dict key {key} is type {type(tx_output[key])}, " +
-                        f"not type {type(example_dict['outputs'][0][key])}")
+            return (f"Dict key {key} is type {type(tx_output[key])}, " +
+                    f"not type {dict(transaction_schema['outputs[]'])[key]}")
 
     # Check that transaction ID is a real number
     if len(transaction_dict['tx_id']) != 32:
@@ -164,61 +355,31 @@ def verify_transaction(transaction_dict):
                 else:
                     return None
 
-        # Check if block containing corresponding output exists
-        output_block_index = 0
-        transaction_found = False
-        with open('./blockchain/blockchain.json') as f:
-            data = json.load(f)
-            for block in data:
-                if data.index(block) == tx_input['previous_output'][0]:
-                    output_block_index = data.index(block)
-                    transaction_found = True
-                    break
+        # Find the output this input redeems in the UTXO set
+        outpoint = utxo.make_outpoint(tx_input['previous_output'])
+        if outpoint is None:
+            return f"Input {tx_input['previous_output']} of transaction [{transaction_dict['tx_id']}] should " \
+                   f"contain a block height, transaction index and output index"
 
-            if not transaction_found:
-                return None
+        previous_output = utxo.get_output(outpoint)
+        if previous_output is None:
+            # Only look at the chain itself to tell the two errors apart
+            if utxo.output_exists(outpoint):
+                return f"Output in transaction [{transaction_dict['tx_id']}] is already redeemed in the blockchain"
+            return f"Input {tx_input['previous_output']} of transaction [{transaction_dict['tx_id']}] " \
+                   f"does not point at an output in the blockchain"
 
         # Check that the corresponding output is addressed to the sender of this transaction
-        with open('./blockchain/blockchain.json', 'r') as f:
-            data = json.load(f)
-
-            previous_transaction = data[output_block_index]['transactions'][tx_input['previous_output'][1]]
-            previous_output = previous_transaction['outputs'][tx_input['previous_output'][2]]
-
-            if previous_output['pk_script'] != transaction_dict['user_data']['pk']:
-                return f"An output of transaction {transaction_dict['tx_id']} is not addressed to the sender " \
-                       f"[{transaction_dict['user_data']['pk']}]"
-
-            input_sum += int(previous_output['value'])
-            f.close()
-
-        # Check all mempool transactions for double-spend
-        with open('./mempool/mempool.json', 'r+') as f:
-            data = json.load(f)
-            for mempool_tx in data:
-
-                # Skip this pass if this is the transaction being verified and remove it from the mempool
-                if mempool_tx == transaction_dict:
-                    del data[data.index(mempool_tx)]
-                    continue
-
-                for mempool_transaction_input in mempool_tx['inputs']:
-                    if mempool_transaction_input['previous_output'] == tx_input['previous_output']:
-                        return f"Output in transaction [{transaction_dict['tx_id']}] is already redeemed in mempool"
-            f.seek(0)
-            f.write(json.dumps(data, indent=4))
-            f.truncate()
-            f.close()
-
-        # Check all blockchain transactions for double-spend
-        with open('./blockchain/blockchain.json', 'r') as f:
-            data = json.load(f)
-            for block in data:
-                for tx in block['transactions']:
-                    for blockchain_previous_output in tx['inputs']:
-                        if blockchain_previous_output['previous_output'] == tx_input['previous_output']:
-                            return f"Output in transaction [{transaction_dict['tx_id']}] " \
-                                   f"is already redeemed in the blockchain"
+        if previous_output['pk_script'] != transaction_dict['user_data']['pk']:
+            return f"An output of transaction {transaction_dict['tx_id']} is not addressed to the sender " \
+                   f"[{transaction_dict['user_data']['pk']}]"
+
+        input_sum += int(previous_output['value'])
+
+        # Check the mempool for double-spend, skipping the transaction being verified if it is already in there
+        mempool_tx_id = mempool.spent_outpoints.get(outpoint)
+        if mempool_tx_id is not None and mempool.get(mempool_tx_id) != transaction_dict:
+            return f"Output in transaction [{transaction_dict['tx_id']}] is already redeemed in mempool"
 
     # Outputs validation
     for tx_output in transaction_dict['outputs']:
@@ -239,10 +400,11 @@ def verify_transaction(transaction_dict):
         return f"The total output [{output_sum}] is greater than the total input [{input_sum}] in " \
                f"transaction [{transaction_dict['tx_id']}]"
 
-    # RSA signature validation
-    signing_error = verify_signature(transaction_dict)
-    if signing_error is not None:
-        return signing_error
+    # ECDSA signature validation (skipped when the caller already handed it to the verify workers)
+    if check_signature:
+        signing_error = verify_signature(transaction_dict)
+        if signing_error is not None:
+            return signing_error
 
     return None
 
@@ -253,34 +415,31 @@ def verify_coinbase_transaction(coinbase_dict):
     if type(coinbase_dict) is not dict:
         return "Must submit a stringified python dict!"
 
-    coinbase_example_dict = blockchain.get_coinbase_template()
-    coinbase_example_keys = list(coinbase_example_dict.keys())
-
     # Root key check
-    for key in coinbase_example_keys:
-        if key not in coinbase_example_keys:
+    mismatch = schema.find_mismatch(coinbase_schema[''], coinbase_dict)
+    if mismatch is not None:
+        key, reason = mismatch
+        if reason == 'missing':
             return "Not all required keys in coinbase transaction"
-
-        if type(coinbase_example_dict[key]) != type(coinbase_dict[key]):
-            return f"Dict key, {key} should be {type(coinbase_example_dict[key])}, not {type(coinbase_dict[key])}"
+        return f"Dict key, {key} should be {dict(coinbase_schema[''])[key]}, not {type(coinbase_dict[key])}"
 
     # Nested key check: inputs
-    for key in list(coinbase_example_dict['inputs'][0].keys()):
-        if key not in list(coinbase_example_dict['inputs'][0].keys()):
+    mismatch = schema.find_mismatch(coinbase_schema['inputs[]'], coinbase_dict['inputs'][0])
+    if mismatch is not None:
+        key, reason = mismatch
+        if reason == 'missing':
             return "Not all required keys in coinbase transaction inputs"
-
-        if type(coinbase_example_dict['inputs'][0][key]) != type(coinbase_dict['inputs'][0][key]):
-            return f"Dict key, {key} should be {type(coinbase_example_dict['inputs'][0][key])}, " \
-                   f"not {type(coinbase_dict['inputs'][0][key])}"
+        return f"Dict key, {key} should be {dict(coinbase_schema['inputs[]'])[key]}, " \
+               f"not {type(coinbase_dict['inputs'][0][key])}"
 
     # Nested key check: outputs
-    for key in list(coinbase_example_dict['outputs'][0].keys()):
-        if key not in list(coinbase_example_dict['outputs'][0].keys()):
+    mismatch = schema.find_mismatch(coinbase_schema['outputs[]'], coinbase_dict['outputs'][0])
+    if mismatch is not None:
+        key, reason = mismatch
+        if reason == 'missing':
             return "Not all required keys in coinbase transaction inputs"
-
-        if type(coinbase_example_dict['outputs'][0][key]) != type(coinbase_dict['outputs'][0][key]):
-            return f"Dict key, {key} should be {type(coinbase_example_dict['outputs'][0][key])}, " \
-                   f"not {type(coinbase_dict['outputs'][0][key])}"
+        return f"Dict key, {key} should be {dict(coinbase_schema['outputs[]'])[key]}, " \
+               f"not {type(coinbase_dict['outputs'][0][key])}"
 
     if len(coinbase_dict['inputs']) != 1 or len(coinbase_dict['outputs']) != 1:
         return "The coinbase transaction should have exactly one input and one output"
@@ -306,25 +465,13 @@ def find_transaction_sum(transaction_dict):
     output_sum = 0
 
     for tx_input in transaction_dict['inputs']:
-        # Check if block containing corresponding output exists
-        transaction_found = False
-        with open('./blockchain/blockchain.json') as f:
-            data = json.load(f)
-            for block in data:
-                if block['height'] == tx_input['previous_output'][0]:
-                    output_block = block
-                    transaction_found = True
-                    break
-
-            if not transaction_found:
-                return None
-
-            # Find input sum
-            previous_transaction = output_block['transactions'][tx_input['previous_output'][1]]
-            previous_output = previous_transaction['outputs'][tx_input['previous_output'][2]]
-
-            input_sum += int(previous_output['value'])
-            f.close()
+        # Find the unspent output this input redeems
+        outpoint = utxo.make_outpoint(tx_input['previous_output'])
+        if outpoint is None or utxo.get_output(outpoint) is None:
+            return None
+
+        # Find input sum
+        input_sum += int(utxo.get_output(outpoint)['value'])
 
     for tx_output in transaction_dict['outputs']:
         output_sum += tx_output['value']
@@ -337,28 +484,24 @@ def verify_block(block_dict):
     # Verify that the data is a dict
     if type(block_dict) is not dict:
         return "Must submit a stringified python dict!"
-    block_keys = list(block_dict.keys())
-    example_dict = blockchain.get_block_template()
-    example_keys = list(example_dict.keys())
 
     # Root key check
-    for key in example_keys:
-        if key not in block_keys:
-            return "Not all required keys present. Check the example-json folder."
+    if schema.find_mismatch(block_schema[''], block_dict, False) is not None:
+        return "Not all required keys present. Check the example-json folder."
 
-    # Verify transaction in blocks
-    for transaction in block_dict['transactions']:
-        # Skip this pass for the coinbase transaction
-        if block_dict['transactions'][0] == transaction:
-            continue
+    # Version 2 blocks commit to their transactions through a merkle root in a fixed size header
+    header_error = verify_block_header_format(block_dict)
+    if header_error is not None:
+        return header_error
 
-        verification_error = verify_transaction(transaction)
-        if verification_error is not None:
-            return verification_error
+    # Verify transaction in blocks, skipping the coinbase transaction
+    verification_error = verify_block_transactions(block_dict['transactions'][1:])
+    if verification_error is not None:
+        return verification_error
 
     # Verify that block height is correct
-    current_chain = json.loads(blockchain.get_block(all_blocks=True))
-    if block_dict['height'] != current_chain[-1]['height'] + 1:
+    previous_block = blockchain.get_last_block()
+    if block_dict['height'] != previous_block['height'] + 1:
         return "Block should contain block height of index in blockchain"
 
     # Check for minimum amount of transactions
@@ -398,43 +541,168 @@ def verify_block(block_dict):
                f"in the block for a total of [{block_remainder + block_reward}]"
 
     # Make sure proof-of-work data included in block is valid
-    with open('./blockchain/blockchain.json') as f:
-        # Check that header matches the previous block
-        data = json.load(f)
-
-        # Hash the previous block in the directory
-        previous_block = data[len(data) - 1]
-
-        # Make sure it matches the header of this block
-        previous_block_hash = blockchain.hash_dict_hex(previous_block)
-        if block_dict['header'] != previous_block_hash:
-            return f"Header of block does not match hash [{previous_block_hash}] of previous block"
-
-        # Check that nonce is valid...
-        block_hash = blockchain.hash_dict_hex(block_dict)
-        # Hash this block with the nonce and make sure its within the node's threshold
-        for character in block_hash[:block_difficulty]:
-            if str(character) != '0':
-                return f"Nonce [{block_dict['nonce']}] is invalid, hash of block must " \
-                       f"start with [{block_difficulty}] zeroes"
+    # Make sure the header matches the hash of the previous block in the directory
+    previous_block_hash = blockchain.get_tip_hash()
+    if block_dict['header'] != previous_block_hash:
+        return f"Header of block does not match hash [{previous_block_hash}] of previous block"
+
+    # Check that nonce is valid...
+    return verify_proof_of_work(block_dict)
+
+
+# Returns a string describing why the hash of a block doesn't meet the node's difficulty, otherwise None
+def verify_proof_of_work(block_dict):
+    block_hash = blockchain.hash_block(block_dict)
+    # Hash this block with the nonce and make sure its within the node's threshold
+    for character in block_hash[:block_difficulty]:
+        if str(character) != '0':
+            return f"Nonce [{block_dict['nonce']}] is invalid, hash of block must " \
+                   f"start with [{block_difficulty}] zeroes"
+
+    return None
+
+
+# Returns a string describing what is wrong with a block that builds on a side chain, otherwise None
+# Only what can be checked without the UTXO set of its chain is checked here, the rest is checked by verify_block
+# if the side chain ever becomes the node's chain
+def verify_side_block(block_dict, parent_entry):
+    if schema.find_mismatch(block_schema[''], block_dict, False) is not None:
+        return "Not all required keys present. Check the example-json folder."
+
+    header_error = verify_block_header_format(block_dict)
+    if header_error is not None:
+        return header_error
+
+    if block_dict['height'] != parent_entry['height'] + 1:
+        return "Block should contain block height of index in blockchain"
+
+    if len(block_dict['transactions']) - 1 < block_transaction_minimum:
+        return f"This node requires that a block have at least [{block_transaction_minimum}] transaction(s)"
+    elif len(block_dict['transactions']) - 1 > block_transaction_maximum:
+        return f"This node requires that a block have at most [{block_transaction_maximum}] transaction(s)"
+
+    return verify_proof_of_work(block_dict)
+
+
+# Returns a string describing what is wrong with the version and header fields of a block, otherwise None
+def verify_block_header_format(block_dict):
+    version = block_dict.get('version', 1)
+    if type(version) is not int or version not in [1, blockchain.BLOCK_VERSION]:
+        return f"Block version should be 1 or {blockchain.BLOCK_VERSION} but it was [{version}]"
+
+    if version == 1:
+        return None
+
+    # Every header field has to fit in the fixed size header
+    if type(block_dict['height']) is not int or type(block_dict['nonce']) is not int \
+            or not 0 <= block_dict['height'] < 2 ** 64 or not 0 <= block_dict['nonce'] < 2 ** 64:
+        return "Block height and nonce should be whole numbers that fit in 8 bytes"
+
+    if type(block_dict['timestamp']) not in [int, float]:
+        return "Block timestamp should be a unix timestamp in seconds"
+
+    if type(block_dict.get('merkle_root')) is not str:
+        return "A version 2 block should contain its ['merkle_root'] as a hex string"
+
+    merkle_root = blockchain.compute_merkle_root(block_dict['transactions'])
+    if block_dict['merkle_root'] != merkle_root:
+        return f"Merkle root of block does not match the hash [{merkle_root}] of its transactions"
 
     return None
 
 
+# Returns a string describing the first invalid transaction in a block (without its coinbase), otherwise None
+# When the verify workers are running every signature is checked in parallel with the rest of the checks, but the
+# error returned is still the one a transaction by transaction pass would have found first
+def verify_block_transactions(transactions):
+    signature_results = None
+    if sigverify.is_parallel():
+        jobs = []
+        for transaction in transactions:
+            # Badly formed transactions are caught by verify_transaction before their signature would matter
+            try:
+                jobs.append(sigverify.make_job(transaction))
+            except (KeyError, IndexError, TypeError, AttributeError):
+                jobs.append(None)
+        signature_results = sigverify.submit_batch(jobs)
+
+    verification_error = None
+    signatures_that_count = len(transactions)
+    spent_in_block = set()
+    for index, transaction in enumerate(transactions):
+        verification_error = verify_transaction(transaction, signature_results is None)
+        if verification_error is not None:
+            signatures_that_count = index
+            break
+
+        # Two transactions in the same block can't redeem the same output
+        for tx_input in transaction['inputs']:
+            outpoint = utxo.make_outpoint(tx_input['previous_output'])
+            if outpoint in spent_in_block:
+                verification_error = f"Output {tx_input['previous_output']} is redeemed more than once in this block"
+                break
+            spent_in_block.add(outpoint)
+
+        if verification_error is not None:
+            signatures_that_count = index + 1
+            break
+
+    if signature_results is not None:
+        for valid in signature_results()[:signatures_that_count]:
+            if not valid:
+                return "Signature is invalid."
+
+    return verification_error
+
+
 # Verifies the signature of a transaction
 def verify_signature(transaction_dict):
-    transaction_hash = transaction_dict.copy()
-    del transaction_hash['user_data']
-    transaction_hash = blockchain.hash_dict_bytes(transaction_hash)
-
-    vk = ecdsa.VerifyingKey.from_string(bytes.fromhex(transaction_dict['user_data']['pk']), curve=ecdsa.SECP256k1)
-    sig = bytes.fromhex(transaction_dict['user_data']['signature'])
-    if not vk.verify(sig, transaction_hash):
+    if not sigverify.check(sigverify.make_job(transaction_dict)):
         return "Signature is invalid."
 
     return None
 
 
+# Re-checks the signature of every transaction in the chain in batches, returns a string describing the first invalid
+# one, otherwise None. The next batch is read from disk while the workers check the one before it
+def verify_chain_signatures(batch_size=256):
+    batches = []
+    jobs = []
+    positions = []
+
+    for height, block in enumerate(blockchain.iter_blocks()):
+        for tx_index, transaction in enumerate(block['transactions'][1:], start=1):
+            jobs.append(sigverify.make_job(transaction))
+            positions.append((height, tx_index))
+
+        if len(jobs) >= batch_size or height == blockchain.get_block_count() - 1:
+            batches.append((sigverify.submit_batch(jobs), positions))
+            jobs = []
+            positions = []
+
+            # Only keep one batch waiting while the next one is built
+            if len(batches) > 1:
+                error = find_signature_error(*batches.pop(0))
+                if error is not None:
+                    return error
+
+    for batch in batches:
+        error = find_signature_error(*batch)
+        if error is not None:
+            return error
+
+    return None
+
+
+# Returns a string describing the first invalid signature in a submitted batch, otherwise None
+def find_signature_error(signature_results, positions):
+    for valid, (height, tx_index) in zip(signature_results(), positions):
+        if not valid:
+            return f"Signature of transaction [{tx_index}] in block [{height}] is invalid."
+
+    return None
+
+
 """
 Add data to directories
 """
@@ -442,59 +710,267 @@ Add data to directories
 
 # Takes a transaction dict and adds it to the mempool if verified
 def add_to_mempool(transaction):
+    # Don't accept the same transaction twice
+    if type(transaction) is dict and type(transaction.get('tx_id')) is str and mempool.get(transaction['tx_id']):
+        return f"Transaction [{transaction['tx_id']}] is already in the mempool"
+
     # Validate transaction before adding it to the mempool
     verification_error = verify_transaction(transaction)
     if verification_error is not None:
         return verification_error
 
-    # Add to mempool file
-    with open('./mempool/mempool.json', 'r+') as f:
-        data = json.load(f)
-        data.append(transaction)
-        data = json.dumps(data, indent=4)
-        f.seek(0)
-        f.write(data)
-        f.truncate()
-        f.close()
+    # Add to mempool, the fee is worked out once here so block templates don't have to look up inputs again
+    # A full mempool makes room by evicting the transactions paying the least per byte
+    evicted = mempool.add(transaction, get_transaction_fee(transaction))
+    mempool.save()
+
+    if transaction['tx_id'] in evicted:
+        return f"Mempool is full and transaction [{transaction['tx_id']}] pays less per byte than every transaction " \
+               f"in it [{mempool.get_stats()['lowest_fee_rate']}]"
+    return None
+
+
+# Takes a list of transaction dicts and adds the verified ones to the mempool, returns a list with None for every
+# transaction that was added and a string describing why for every one that wasn't, in the same order
+# The whole batch shares one pass of the signature workers and one mempool save, and a transaction redeeming an output
+# already redeemed by an earlier transaction in the batch is rejected
+def add_batch_to_mempool(transactions):
+    signature_results = None
+    if sigverify.is_parallel():
+        jobs = []
+        for transaction in transactions:
+            # Badly formed transactions are caught by verify_transaction before their signature would matter
+            try:
+                jobs.append(sigverify.make_job(transaction))
+            except (KeyError, IndexError, TypeError, AttributeError):
+                jobs.append(None)
+        signature_results = sigverify.submit_batch(jobs)()
+
+    results = []
+    redeemed_in_batch = {}
+    evicted = set()
+    for index, transaction in enumerate(transactions):
+        if type(transaction) is dict and type(transaction.get('tx_id')) is str and mempool.get(transaction['tx_id']):
+            results.append(f"Transaction [{transaction['tx_id']}] is already in the mempool")
+            continue
+
+        verification_error = find_batch_conflict(transaction, redeemed_in_batch)
+        if verification_error is None:
+            verification_error = verify_transaction(transaction, signature_results is None)
+        if verification_error is None and signature_results is not None and not signature_results[index]:
+            verification_error = "Signature is invalid."
+
+        if verification_error is not None:
+            results.append(verification_error)
+            continue
+
+        for tx_input in transaction['inputs']:
+            redeemed_in_batch[utxo.make_outpoint(tx_input['previous_output'])] = transaction['tx_id']
+
+        evicted.update(mempool.add(transaction, get_transaction_fee(transaction)))
+        results.append(None)
+
+    mempool.save()
+
+    # A transaction later in the batch may have pushed an earlier one out of a full mempool
+    for index, transaction in enumerate(transactions):
+        if results[index] is None and transaction['tx_id'] in evicted:
+            results[index] = f"Mempool is full and transaction [{transaction['tx_id']}] pays less per byte than " \
+                             f"every transaction in it [{mempool.get_stats()['lowest_fee_rate']}]"
+
+    return results
+
+
+# Returns a string describing which earlier transaction in a batch already redeems an output this one does, otherwise
+# None (badly formed transactions are left to verify_transaction)
+def find_batch_conflict(transaction, redeemed_in_batch):
+    try:
+        for tx_input in transaction['inputs']:
+            outpoint = utxo.make_outpoint(tx_input['previous_output'])
+            if outpoint is not None and outpoint in redeemed_in_batch:
+                return f"Output {tx_input['previous_output']} is already redeemed by transaction " \
+                       f"[{redeemed_in_batch[outpoint]}] earlier in this batch"
+    except (KeyError, IndexError, TypeError, AttributeError):
         return None
 
+    return None
+
+
+# Returns the fee a verified transaction pays (what is left of its inputs after its outputs)
+def get_transaction_fee(transaction):
+    input_sum, output_sum = find_transaction_sum(transaction)
+    return input_sum - output_sum
+
 
 # Takes a block dict and adds it to the blockchain if verified
+# A block that builds on a known block other than the tip is stored on a side chain, and the node switches to that side
+# chain once it has more work behind it than the node's chain
 def add_to_blockchain(block):
+    if type(block) is dict and block.get('header') != blockchain.get_tip_hash() \
+            and type(block.get('header')) is str and blocktree.contains(block['header']):
+        return add_side_block(block)
+
     verification_error = verify_block(block)
     if verification_error is not None:
         return verification_error
 
-    blockchain.add_block(block)
+    connect_block(block)
+    mempool.save()
+
+    if checkpoint.is_due():
+        save_checkpoint()
+    return None
+
+
+# Stores a block that builds on a side chain and reorganizes onto it if it is now the chain with the most work
+def add_side_block(block):
+    # The header fields are checked before the block is hashed
+    verification_error = verify_side_block(block, blocktree.get_entry(block['header']))
+    if verification_error is not None:
+        return verification_error
+
+    block_hash = blockchain.hash_block(block)
+    if blocktree.contains(block_hash):
+        return f"Block [{block_hash}] is already known to this node"
+
+    blocktree.store_side_block(block, block_hash)
+    blocktree.add_block(block_hash, block['header'], block['height'])
+
+    if blocktree.get_work(block_hash) > blocktree.get_work(blockchain.get_tip_hash()):
+        return reorganize(block_hash)
+
     return None
 
 
+# Switch the node's chain to the side chain ending in new_tip_hash, only the blocks after the fork are disconnected
+# and connected. If a side chain block turns out to be invalid the node goes back to its old chain and that block
+# (and everything built on it) is forgotten
+def reorganize(new_tip_hash):
+    # Blocks can only be disconnected with their undo records
+    if not history_available:
+        return "The undo log is still being built after starting from a UTXO snapshot, the side chain is kept " \
+               "but the node can't switch to it yet"
+
+    # Walk back from the new tip to the last block both chains share
+    branch = []
+    fork_hash = new_tip_hash
+    while blockchain.get_block_height(fork_hash) is None:
+        branch.append(fork_hash)
+        fork_hash = blocktree.get_entry(fork_hash)['parent']
+    branch.reverse()
+    fork_height = blockchain.get_block_height(fork_hash)
+
+    # The mempool is emptied first so a branch block redeeming the same output as a mempool transaction isn't taken
+    # for a double-spend, whatever is still valid afterwards goes back in
+    pooled = mempool.get_all()
+    for tx in pooled:
+        mempool.remove(tx['tx_id'])
+
+    disconnected = []
+    while blockchain.get_tip_hash() != fork_hash:
+        disconnected.append(disconnect_tip())
+
+    connected = []
+    for block_hash in branch:
+        block = blocktree.read_side_block(block_hash)
+        verification_error = verify_block(block)
+
+        if verification_error is not None:
+            blocktree.discard(block_hash)
+
+            # Put the old chain back
+            for _ in connected:
+                disconnect_tip()
+            for old_block in reversed(disconnected):
+                connect_block(old_block)
+                blocktree.remove_side_block(blockchain.get_tip_hash())
+
+            restore_mempool(connected, pooled)
+            return f"Side chain block at height [{block['height']}] is invalid: {verification_error}"
+
+        connect_block(block)
+        blocktree.remove_side_block(block_hash)
+        connected.append(block)
+
+    # Transactions only confirmed by the old chain go back to the mempool
+    restore_mempool(disconnected, pooled)
+
+    # A checkpoint taken on a block that just left the chain is no use anymore
+    if checkpoint.checkpoint_height is not None and checkpoint.checkpoint_height >= fork_height + 1 \
+            or checkpoint.is_due():
+        save_checkpoint()
+    return None
+
+
+# Connect a verified block to the tip of the chain and update the UTXO set, undo log, address index and mempool
+def connect_block(block):
+    blockchain.add_block(block)
+    height = blockchain.get_block_count() - 1
+    spent_outputs = utxo.connect_block(block, height)
+    if history_available:
+        undolog.append(height, spent_outputs)
+        addressindex.connect_block(block, height, spent_outputs)
+    count_block(block, spent_outputs)
+
+    block_hash = blockchain.get_tip_hash()
+    if not blocktree.contains(block_hash):
+        blocktree.add_block(block_hash, block['header'], height)
+
+    # Confirmed transactions and anything that conflicts with them leave the mempool
+    mempool.remove_block_transactions(block)
+
+
+# Take the tip block off the chain using its undo record and keep it as a side chain block, returns the block
+def disconnect_tip():
+    block_hash = blockchain.get_tip_hash()
+    height = blockchain.get_block_count() - 1
+    block = blockchain.remove_last_block()
+
+    spent_outputs = undolog.read(height)
+    utxo.disconnect_block(block, height, spent_outputs)
+    undolog.truncate(height)
+    count_block(block, spent_outputs, -1)
+    addressindex.disconnect_block()
+    blocktree.store_side_block(block, block_hash)
+
+    return block
+
+
+# Put the transactions of blocks that left the chain back in the mempool, along with the transactions already in
+# there (and pooled, ones taken out of it), keeping only the ones that are still valid on the new chain
+def restore_mempool(blocks, pooled=()):
+    candidates = [tx for block in blocks for tx in block['transactions'][1:]] + list(pooled) + mempool.get_all()
+
+    for tx in mempool.get_all():
+        mempool.remove(tx['tx_id'])
+
+    for tx in candidates:
+        if mempool.get(tx['tx_id']) is None and verify_transaction(tx) is None:
+            mempool.add(tx, get_transaction_fee(tx))
+
+    mempool.save()
+
+
 """
 Node Data Getters
 """
 
 
-# Returns list or dict from the mempool directory (all transactions, by index, or by tx id)
+# Returns list or dict from the mempool (all transactions, by index, or by tx id)
 def get_tx(all_tx=False, index=-1, tx_id=None):
-    # Writes all blocks to one json file and returns it
+    # Returns every transaction in the mempool as a list
     if all_tx:
-        transactions = json.load(open('./mempool/mempool.json', 'r'))
-        return transactions
+        return mempool.get_all()
 
-    # If index is specified and header is not then return file at index
+    # If index is specified and tx_id is not then return the transaction at index
     if index >= 0 and tx_id is None:
-        transactions = json.load(open('./mempool/mempool.json', 'r'))
-        if index < len(transactions) + 1:
+        if index >= mempool.count():
             return None
-        return transactions[index]
+        return mempool.get_all()[index]
 
-    # If header is specified and index is not then find file with name header
+    # If tx_id is specified and index is not then find the transaction with that id
     elif tx_id is not None and index < 0:
-        transactions = json.load(open('./mempool/mempool.json', 'r'))
-        for tx in transactions:
-            if id == tx['tx_id']:
-                return tx
-        return None
+        return mempool.get(tx_id)
 
     return None
 
@@ -505,12 +981,27 @@ def get_node_parameters():
         'reward': block_reward,
         'difficulty': block_difficulty,
         'tx_minimum': block_transaction_minimum,
-        'tx_maximum': block_transaction_maximum
+        'tx_maximum': block_transaction_maximum,
+        'block_version': blockchain.BLOCK_VERSION
     }
 
     return parameters
 
 
+# Returns counters describing how the node's caches and indexes are doing
+def get_node_stats():
+    stats = {
+        'signature_cache': sigverify.get_cache_stats(),
+        'chain': dict(chain_stats),
+        'mempool': mempool.get_stats(),
+        'journal': journal.get_stats(),
+        'snapshot': dict(snapshot.status),
+        'history_available': history_available
+    }
+
+    return stats
+
+
 # Find UTXO of public key on blockchain or blockchain and mempool
 # modes = ['confirmed', 'unconfirmed']
 def get_utxo(public_key, mode):
@@ -521,85 +1012,23 @@ def get_utxo(public_key, mode):
     if mode not in ['confirmed', 'unconfirmed']:
         return "['mode'] must be equal to ['confirmed'], or ['unconfirmed']"
 
-    unspent_transactions = []
-    utxo_sum = 0
+    if not history_available:
+        return "The address index is still being built after starting from a UTXO snapshot"
+
+    # Confirmed outputs come straight out of the address index
+    unspent_transactions = addressindex.get_unspent(public_key)
 
-    # Check just the blockchain
-    if mode == 'confirmed':
-        with open('./blockchain/blockchain.json') as f:
-            data = json.load(f)
-
-            for block in data:
-                for tx in block['transactions']:
-                    # For every transaction output, if it is addressed to this public key, add it to the list
-                    for output in tx['outputs']:
-                        tx_output_sum = 0
-                        if output['pk_script'] == public_key:
-                            unspent_transactions.append(([data.index(block), block['transactions'].index(tx),
-                                                          tx['outputs'].index(output)], output['value']))
-
-                    # For every transaction input, if it already exists on the blockchain and it is in the list, then
-                    # remove it from the list
-                    for tx_input in tx['inputs']:
-                        for unspent_transaction in unspent_transactions:
-                            if tx_input['previous_output'] == unspent_transaction[0]:
-                                unspent_transactions.remove(unspent_transaction)
-
-            for unspent_transaction in unspent_transactions:
-                utxo_sum += unspent_transaction[1]
-
-            f.close()
-
-    # Check the mempool and the blockchain
-    elif mode == 'unconfirmed':
-        with open('./blockchain/blockchain.json') as f:
-            data = json.load(f)
-
-            for block in data:
-                for tx in block['transactions']:
-                    # For every transaction output, if it is addressed to this public key, add it to the list
-                    for output in tx['outputs']:
-                        tx_output_sum = 0
-                        if output['pk_script'] == public_key:
-                            unspent_transactions.append(([data.index(block), block['transactions'].index(tx),
-                                                         tx['outputs'].index(output)], output['value']))
-
-                    # For every transaction input, if it already exists on the blockchain and it is in the list, then
-                    # remove it from the list
-                    for tx_input in tx['inputs']:
-                        for unspent_transaction in unspent_transactions:
-                            if tx_input['previous_output'] == unspent_transaction[0]:
-                                unspent_transactions.remove(unspent_transaction)
-
-            for unspent_transaction in unspent_transactions:
-                utxo_sum += unspent_transaction[1]
-
-            f.close()
-
-        last_unspent_transaction_index = len(unspent_transactions)
-
-        with open('./mempool/mempool.json') as f:
-            data = json.load(f)
-
-            # Mark the index of the last unspent transaction in the blockchain so you don't loop over all of them again
-            # when adding the mempool transactions to the utxo_sum
-            for tx in data:
-                for output in tx['outputs']:
-                    tx_output_sum = 0
-                    if output['pk_script'] == public_key:
-                        unspent_transactions.append(([tx['outputs'].index(output)], output['value']))
-
-                    # For every transaction input, if it already exists on the blockchain and it is in the list, then
-                    # remove it from the list
-                    for tx_input in tx['inputs']:
-                        for unspent_transaction in unspent_transactions:
-                            if tx_input['previous_output'] == unspent_transaction[0]:
-                                unspent_transactions.remove(unspent_transaction)
-
-            for unspent_transaction in unspent_transactions[last_unspent_transaction_index:]:
-                utxo_sum += unspent_transaction[1]
-
-            f.close()
+    # Unconfirmed mode also drops outputs redeemed in the mempool and adds mempool outputs sent to this key
+    if mode == 'unconfirmed':
+        unspent_transactions = [unspent_transaction for unspent_transaction in unspent_transactions
+                                if tuple(unspent_transaction[0]) not in mempool.spent_outpoints]
+
+        for tx_id, output_index in mempool.outputs_by_address.get(public_key, []):
+            unspent_transactions.append(([output_index], mempool.get(tx_id)['outputs'][output_index]['value']))
+
+    utxo_sum = 0
+    for unspent_transaction in unspent_transactions:
+        utxo_sum += unspent_transaction[1]
 
     utxo_dict = {
         'transactions': unspent_transactions,
@@ -609,4 +1038,30 @@ def get_utxo(public_key, mode):
     return utxo_dict
 
 
+# Returns a page of the confirmed history of a public key, newest first
+def get_address_history(public_key, page=0, page_size=25):
+    if type(public_key) is not str:
+        return f"Public key must be type [{str}] but got [{type(public_key)}]"
+
+    if type(page) is not int or page < 0:
+        return "['page'] must be a whole number"
+
+    if type(page_size) is not int or not 0 < page_size <= 100:
+        return "['page_size'] must be a whole number between 1 and 100"
+
+    if not history_available:
+        return "The address index is still being built after starting from a UTXO snapshot"
+
+    history, total = addressindex.get_history(public_key, page, page_size)
+
+    history_dict = {
+        'history': history,
+        'page': page,
+        'page_size': page_size,
+        'total': total
+    }
+
+    return history_dict
+
+
 # Find the maximum hash of the block to adjust the difficulty
@@ -0,0 +1,48 @@
+"""
+Peers.py keeps the list of other nodes this node knows about and the address other nodes can reach this node at.
+The list is saved to ./peers/peers.json whenever a peer is added so it survives a restart.
+"""
+
+import os
+import json
+
+own_url = None
+peers_path = None
+peer_urls = []
+
+
+# Load the saved peers, own_url is the address this node tells other nodes to reach it at
+def initialize(url='http://127.0.0.1:1337', path='./peers/peers.json'):
+    global own_url
+    global peers_path
+
+    own_url = url.rstrip('/')
+    peers_path = path
+    peer_urls.clear()
+
+    if not os.path.isdir(os.path.dirname(peers_path)):
+        os.mkdir(os.path.dirname(peers_path))
+
+    if os.path.isfile(peers_path):
+        with open(peers_path, 'r') as f:
+            peer_urls.extend(json.load(f))
+            f.close()
+
+
+# Add a peer and save the list, returns False if it was already known or is this node
+def add_peer(url):
+    url = url.rstrip('/')
+    if url == own_url or url in peer_urls:
+        return False
+
+    peer_urls.append(url)
+    with open(peers_path, 'w') as f:
+        json.dump(peer_urls, f, indent=4)
+        f.close()
+
+    return True
+
+
+# Returns every known peer except the ones in exclude
+def get_peers(exclude=()):
+    return [url for url in peer_urls if url not in exclude]
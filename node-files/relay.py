@@ -0,0 +1,95 @@
+"""
+Relay.py propagates new blocks between nodes one block at a time instead of posting whole chains around.
+
+When a block arrives on /node/chain/broadcast it is checked against the blocks this node knows. A block that builds on
+the tip or on a side chain is handed to node.py like a submitted block, which may switch the node over to that side
+chain. A block whose parent this node doesn't have yet means the sender is ahead,
+so only the missing blocks between this node's tip and the new block are pulled from the sender (headers-first
+through sync.py). Blocks this node accepts are then relayed to every other known peer in the background, blocks it
+already has are not relayed again, which is what stops a block from bouncing around the network forever.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import requests
+import blockchain
+import blocktree
+import core
+import node
+import peers
+import sync
+
+RELAY_TIMEOUT = 5
+
+# Background threads that post blocks to peers so the request that triggered the relay doesn't wait on the network
+relay_executor = ThreadPoolExecutor(max_workers=8)
+
+
+# Handle a block broadcast by sender_url, returns None if it was added or already known, otherwise an error string
+def receive_block(block_dict, sender_url=None):
+    if type(block_dict) is not dict:
+        return "Must submit a stringified python dict!"
+
+    # The header fields have to fit in the fixed size header before the block can be hashed
+    try:
+        header_error = node.verify_block_header_format(block_dict)
+        if header_error is not None:
+            return header_error
+
+        block_hash = blockchain.hash_block(block_dict)
+        header = block_dict['header']
+        height = block_dict['height']
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return "Block is missing the fields needed to find its hash"
+
+    with core.reading():
+        known = blocktree.contains(block_hash)
+        parent_known = header == blockchain.get_tip_hash() or blocktree.contains(header)
+        tip_height = blockchain.get_block_count() - 1
+
+    # Already part of this chain or a side chain, nothing to do and nothing to relay
+    if known:
+        return None
+
+    # Blocks on the tip or on a side chain go straight to node.py, an unknown parent means the sender is ahead
+    if not parent_known:
+        if sender_url is None or type(height) is not int or height <= tip_height + 1:
+            return f"Block [{block_hash}] builds on block [{header}] which this node doesn't know"
+
+        # The sender is ahead of this node, fetch just the blocks in between (and the new block itself) from it
+        sync_error = sync.sync_from_peer(sender_url)
+        if sync_error is not None:
+            return sync_error
+
+        with core.reading():
+            known = blocktree.contains(block_hash)
+
+        if known:
+            relay_block(block_dict, [sender_url])
+            return None
+
+    verification_error = core.submit(node.add_to_blockchain, block_dict)
+    if verification_error is not None:
+        return verification_error
+
+    relay_block(block_dict, [sender_url])
+    return None
+
+
+# Post a block to every known peer except the ones in exclude, in the background
+def relay_block(block_dict, exclude=()):
+    body = json.dumps({
+        'block': block_dict,
+        'sender': peers.own_url
+    })
+
+    for peer_url in peers.get_peers(exclude):
+        relay_executor.submit(post_block, peer_url, body)
+
+
+# Post a block to a single peer, a peer that can't be reached just misses out on this block
+def post_block(peer_url, body):
+    try:
+        requests.post(f'{peer_url}/node/chain/broadcast', body, timeout=RELAY_TIMEOUT)
+    except requests.RequestException:
+        pass
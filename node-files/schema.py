@@ -0,0 +1,42 @@
+"""
+Schema.py turns the template dicts returned by blockchain.py into flat tables of required keys and value types so the
+node can check the shape of incoming data without re-reading and re-walking the example-json files every time.
+
+A compiled schema maps a path to a tuple of (key, type) pairs for the dict found at that path in the template:
+''          -> root keys of the template
+'user_data' -> keys of the dict stored under 'user_data'
+'inputs[]'  -> keys of each dict in the 'inputs' list (taken from the first example entry)
+
+The error messages are left to node.py, this module only finds the first key that is missing or has the wrong type.
+"""
+
+
+# Compile a template dict into {path: ((key, type), ...)}
+def compile_schema(template_dict):
+    schema = {}
+    compile_fields(template_dict, '', schema)
+
+    return schema
+
+
+# Add the fields of one dict of the template (and every dict nested inside it) to the schema
+def compile_fields(template_dict, path, schema):
+    schema[path] = tuple((key, type(value)) for key, value in template_dict.items())
+
+    for key, value in template_dict.items():
+        child_path = key if path == '' else f'{path}.{key}'
+        if type(value) is dict:
+            compile_fields(value, child_path, schema)
+        elif type(value) is list and len(value) > 0 and type(value[0]) is dict:
+            compile_fields(value[0], child_path + '[]', schema)
+
+
+# Returns (key, 'missing') or (key, 'type') for the first field data doesn't satisfy, otherwise None
+def find_mismatch(fields, data, check_types=True):
+    for key, value_type in fields:
+        if key not in data:
+            return key, 'missing'
+        if check_types and type(data[key]) is not value_type:
+            return key, 'type'
+
+    return None
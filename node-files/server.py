@@ -2,25 +2,89 @@
 Server.py is meant to run the flask server, route all of the requests, and call the necessary methods
 for handling incoming data. As little internal logic as possible will be done in this file, it is meant
 mostly to handle the networking part of this project.
+
+Requests are served on many threads at once. Routes that read the node's state do it inside core.reading() and routes
+that change it hand the change to core.submit(), see core.py.
 """
 
-from flask import Flask, request
+from flask import Flask, Response, request
+import os
 import json
+import atexit
+import signal
+import sys
+import threading
+import zlib
+import core
+import mempool
 import node
 import blockchain
+import blocktemplate
+import gossip
+import ibd
+import peers
+import relay
+import snapshot
+import sync
 from sys import argv
-from pprint import pprint
 
 """
 Initialization
 """
 
 app = Flask(__name__)
+MAX_BLOCK_RANGE = 100
+MAX_HEADER_RANGE = 2000
+MAX_SUBMIT_BATCH = 1000
+JSON_HEADERS = {'Content-Type': 'application/json'}
+STREAM_CHUNK_SIZE = 64 * 1024
 blockchain.initialize()
+
+# A UTXO snapshot to start from can be passed anywhere on the command line as --snapshot=path
+# the byte cap on the mempool as --mempool-size=bytes, the mempool journal's durability mode as
+# --durability=always|group|periodic and --verify-chain re-checks every signature in the chain before serving
+snapshot_path = None
+mempool_size = 16 * 1024 * 1024
+durability = 'always'
+verify_chain = '--verify-chain' in argv[1:]
+for argument in argv[1:]:
+    if argument.startswith('--snapshot='):
+        snapshot_path = argument[len('--snapshot='):]
+    elif argument.startswith('--mempool-size='):
+        mempool_size = int(argument[len('--mempool-size='):])
+    elif argument.startswith('--durability='):
+        durability = argument[len('--durability='):]
+argv = [argument for argument in argv if argument != '--verify-chain'
+        and not argument.startswith(('--snapshot=', '--mempool-size=', '--durability='))]
+
+options = {'snapshot_path': snapshot_path, 'mempool_size': mempool_size, 'durability': durability}
 if len(argv) < 4:
-    node.initialize()
+    node.initialize(**options)
+elif len(argv) < 5:
+    node.initialize(int(argv[1]), int(argv[2]), int(argv[3]), **options)
 else:
-    node.initialize(int(argv[1]), int(argv[2]), int(argv[3]))
+    node.initialize(int(argv[1]), int(argv[2]), int(argv[3]), int(argv[4]), **options)
+
+if verify_chain:
+    signature_error = node.verify_chain_signatures()
+    if signature_error is not None:
+        print(f"Chain failed verification: {signature_error}")
+        sys.exit(1)
+
+# Save the derived state on the way out so the next start only replays blocks added after this point, and make sure
+# the mempool journal is on disk whatever its durability mode
+atexit.register(core.submit, node.save_checkpoint, True)
+atexit.register(core.submit, mempool.close)
+signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+
+# The address other nodes should use to reach this one can be passed after the node parameters
+if len(argv) < 6:
+    peers.initialize()
+else:
+    peers.initialize(argv[5])
+
+# From here on every change to the node's state goes through the writer thread
+core.start()
 
 """
 Routing
@@ -29,18 +93,118 @@ Routing
 
 # [GET] requests
 
-# Returns the entire current blockchain as stringified json with code 200
+# Streams the entire current blockchain as stringified json with code 200 (304 if the tip hasn't changed)
 @app.route('/node/chain/currentchain', methods=['GET'])
 def return_current_chain():
-    chain_data = blockchain.get_block(all_blocks=True)
-    return chain_data, 200
+    with core.reading():
+        block_count = blockchain.get_block_count()
+        tip_hash = blockchain.get_tip_hash()
+
+    return stream_json_list(iter_chain(block_count, tip_hash), tip_hash)
+
+
+# Returns the blocks from ?start= up to (not including) ?end= as a stringified json list with code 200
+@app.route('/node/chain/blocks', methods=['GET'])
+def return_block_range():
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+
+    with core.reading():
+        block_count = blockchain.get_block_count()
+
+        if start is None or start < 0 or start >= block_count:
+            return f"?start= must be a block height between 0 and {block_count - 1}", 400
+
+        if end is None or end > block_count:
+            end = block_count
+        end = min(end, start + MAX_BLOCK_RANGE)
+
+        if end <= start:
+            return "?end= must be greater than ?start=", 400
+
+        return blockchain.get_blocks_raw(start, end), 200, JSON_HEADERS
+
+
+# Returns a single block by height as stringified json with code 200
+@app.route('/node/chain/block/<int:height>', methods=['GET'])
+def return_block(height):
+    with core.reading():
+        block_data = blockchain.get_block_raw(height)
+
+    if block_data is None:
+        return f"There is no block at height [{height}]", 404
+
+    return block_data, 200, JSON_HEADERS
+
+
+# Returns the compact headers of the blocks from ?start= up to (not including) ?end= as json with code 200
+@app.route('/node/chain/headers', methods=['GET'])
+def return_header_range():
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+
+    with core.reading():
+        block_count = blockchain.get_block_count()
+
+        if start is None or start < 0 or start >= block_count:
+            return f"?start= must be a block height between 0 and {block_count - 1}", 400
+
+        if end is None or end > block_count:
+            end = block_count
+        end = min(end, start + MAX_HEADER_RANGE)
+
+        if end <= start:
+            return "?end= must be greater than ?start=", 400
+
+        return json.dumps(blockchain.get_headers(start, end)), 200, JSON_HEADERS
+
+
+# Returns the height and hash of the most recent block along with the block itself with code 200
+@app.route('/node/chain/tip', methods=['GET'])
+def return_chain_tip():
+    with core.reading():
+        height = blockchain.get_block_count() - 1
+        tip_data = f'{{"height": {height}, "hash": "{blockchain.get_tip_hash()}", ' \
+                   f'"block": {blockchain.get_block_raw(height)}}}'
+
+    return tip_data, 200, JSON_HEADERS
+
+
+# Returns a gzipped snapshot of the UTXO set at ?height= (the tip by default) with code 200
+@app.route('/node/chain/snapshot', methods=['GET'])
+def return_utxo_snapshot():
+    if not os.path.isdir('./snapshots'):
+        os.makedirs('./snapshots', exist_ok=True)
+
+    with core.reading():
+        height = request.args.get('height', type=int)
+        if height is None:
+            height = blockchain.get_block_count() - 1
+
+        snapshot_file = f'./snapshots/utxo_{height}.json.gz'
+        res = snapshot.export(snapshot_file, height)
+    if type(res) is str:
+        return res, 400
+
+    with open(snapshot_file, 'rb') as f:
+        data = f.read()
+        f.close()
 
+    headers = {
+        'Content-Type': 'application/gzip',
+        'Content-Disposition': f'attachment; filename=utxo_{height}.json.gz',
+        'X-UTXO-Hash': res['utxo_hash']
+    }
+    return data, 200, headers
 
-# Returns the entire mempool as stringified json with code 200
+
+# Streams the entire mempool as stringified json with code 200 (304 if it hasn't changed)
 @app.route('/node/tx/currentmempool', methods=['GET'])
 def return_current_mempool():
-    mempool_data = node.get_tx(all_tx=True)
-    return json.dumps(mempool_data), 200
+    with core.reading():
+        version_tag = mempool.get_version_tag()
+        mempool_data = node.get_tx(all_tx=True)
+    return stream_json_list((json.dumps(tx) for tx in mempool_data), version_tag)
 
 
 # Returns a formatted template block as stringified json with code 200
@@ -50,6 +214,15 @@ def return_block_template():
     return data, 200
 
 
+# Returns a ready to mine template for the next block with its transactions, fees and coinbase value with code 200
+# (?max_transactions= picks fewer transactions than the node's maximum)
+@app.route('/node/template/mining', methods=['GET'])
+def return_mining_template():
+    with core.reading():
+        mining_template = blocktemplate.get_template(request.args.get('max_transactions', type=int))
+    return json.dumps(mining_template), 200, JSON_HEADERS
+
+
 # Returns a formatted template transaction as stringified json with code 200
 @app.route('/node/template/tx', methods=['GET'])
 def return_tx_template():
@@ -68,7 +241,13 @@ def return_coinbase_template():
 @app.route('/node/info/address', methods=['GET'])
 def return_node_address():
     # returns this nodes address as a string with code 200
-    pass
+    return peers.own_url, 200
+
+
+# Returns the list of nodes this node knows about
+@app.route('/node/peers', methods=['GET'])
+def return_peers():
+    return json.dumps(peers.get_peers()), 200, JSON_HEADERS
 
 
 # Returns this nodes unique id
@@ -81,21 +260,33 @@ def return_node_id():
 # Returns the current parameters for this node
 @app.route('/node/info/parameters', methods=['GET'])
 def return_node_parameters():
-    parameters = node.get_node_parameters()
+    with core.reading():
+        parameters = node.get_node_parameters()
     return parameters, 200
 
 
+# Returns cache and index counters for this node
+@app.route('/node/info/stats', methods=['GET'])
+def return_node_stats():
+    with core.reading():
+        stats = node.get_node_stats()
+    stats['initial_block_download'] = ibd.progress
+    return stats, 200
+
+
 # [POST] requests
 
 
 # Returns 200 if the block was valid and adds it to the blockchain, but 400 and an error message if it wasn't
 @app.route('/node/chain/submit', methods=['POST'])
 def submit_to_blockchain():
-    res = node.add_to_blockchain(request.get_json(force=True))
+    block = request.get_json(force=True)
+    res = core.submit(node.add_to_blockchain, block)
 
     if res is not None:
         return res, 400
     else:
+        relay.relay_block(block)
         return 'valid', 200
 
 
@@ -105,39 +296,149 @@ def submit_to_mempool():
     # sends data to node.py for validation in mempool. If valid it returns string 'valid' with code 200.
     # If not valid it returns string describing error with code 400.
     data = request.get_json(force=True)
-    res = node.add_to_mempool(data)
+    res = core.submit(node.add_to_mempool, data)
 
     if res is not None:
         return res, 400
     else:
+        gossip.announce(data)
         return 'valid', 200
 
 
-# Receives an entire stringified blockchain from another node and returns 200 if this node was updated
+# Returns 200 with what happened to every transaction in a batch, the valid ones are added to the mempool
+@app.route('/node/tx/submit_batch', methods=['POST'])
+def submit_batch_to_mempool():
+    # receives {'transactions': [tx, ...]} and returns a list with {'tx_id': tx_id, 'status': 'valid'} or
+    # {'tx_id': tx_id, 'status': 'rejected', 'error': string describing error} for every transaction in the same order
+    # with code 200. Transactions redeeming an output already redeemed earlier in the batch are rejected.
+    # If the data isn't a batch it returns a string describing error with code 400.
+    data = request.get_json(force=True)
+
+    if type(data) is not dict or type(data.get('transactions')) is not list:
+        return "Data must contain the key ['transactions']: (list of transactions)", 400
+
+    if len(data['transactions']) > MAX_SUBMIT_BATCH:
+        return f"A batch can't contain more than [{MAX_SUBMIT_BATCH}] transactions", 400
+
+    results = core.submit(node.add_batch_to_mempool, data['transactions'])
+
+    statuses = []
+    for transaction, res in zip(data['transactions'], results):
+        tx_id = transaction.get('tx_id') if type(transaction) is dict else None
+        if res is None:
+            gossip.announce(transaction)
+            statuses.append({'tx_id': tx_id, 'status': 'valid'})
+        else:
+            statuses.append({'tx_id': tx_id, 'status': 'rejected', 'error': res})
+
+    return json.dumps(statuses), 200, JSON_HEADERS
+
+
+# Receives a single new block relayed by another node and returns 200 if this node has it now
 @app.route('/node/chain/broadcast', methods=['POST'])
 def receive_chain_broadcast():
-    # receives entire blockchain. If other nodes is longer and valid it returns string 'updated' with code 200
+    # receives {'block': block, 'sender': url of the node relaying it}. If the block is added or already known it
+    # returns string 'updated' with code 200, missing ancestors are fetched from the sender first.
     # If not then it returns a string describing error with code 400.
-    pass
+    data = request.get_json(force=True)
+
+    if type(data) is not dict or 'block' not in data:
+        return "Data must contain the key ['block'] and optionally ['sender']: (url of the relaying node)", 400
+
+    sender = data.get('sender')
+    if type(sender) is str:
+        sender = sender.rstrip('/')
+        peers.add_peer(sender)
+    else:
+        sender = None
+
+    res = relay.receive_block(data['block'], sender)
+
+    if res is not None:
+        return res, 400
+    else:
+        return 'updated', 200
+
+
+# Adds a node to the list of peers this node relays to ({'peer': 'http://address:port'})
+@app.route('/node/peers/add', methods=['POST'])
+def add_peer():
+    data = request.get_json(force=True)
+
+    if type(data) is not dict or type(data.get('peer')) is not str:
+        return "Data must contain the key ['peer']: (url of the node)", 400
+
+    if peers.add_peer(data['peer']):
+        return 'added', 200
+    else:
+        return 'known', 200
 
 
-# Receives an entire stringified mempool from another node and returns 200 if this node was updated
+# Receives a batch of transactions gossiped by another node and returns 200 with what happened to each of them
 @app.route('/node/tx/broadcast', methods=['POST'])
 def receive_tx_broadcast():
-    # receives entire mempool. If other nodes is longer and valid it returns string 'updated' with code 200
-    # If not then it returns a string describing error with code 400.
-    pass
+    # receives {'transactions': [tx, ...], 'sender': url of the node gossiping them}. Valid new transactions are added
+    # to the mempool and gossiped on, it returns {'added': count, 'known': count, 'rejected': {tx_id: error}} with
+    # code 200. If the data isn't a batch it returns a string describing error with code 400.
+    data = request.get_json(force=True)
+
+    if type(data) is not dict or type(data.get('transactions')) is not list:
+        return "Data must contain the key ['transactions'] and optionally ['sender']: (url of the gossiping node)", 400
+
+    sender = data.get('sender')
+    if type(sender) is str:
+        sender = sender.rstrip('/')
+        peers.add_peer(sender)
+    else:
+        sender = None
+
+    return json.dumps(gossip.receive_transactions(data['transactions'], sender)), 200, JSON_HEADERS
+
+
+# Syncs this node with the chain of the peer in the body ({'peer': 'http://address:port'}) headers-first
+@app.route('/node/chain/sync', methods=['POST'])
+def sync_with_peer():
+    data = request.get_json(force=True)
+
+    if type(data) is not dict or type(data.get('peer')) is not str:
+        return "Data must contain the key ['peer']: (url of the node to sync with)", 400
+
+    res = sync.sync_from_peer(data['peer'].rstrip('/'))
+
+    if res is not None:
+        return res, 400
+    else:
+        return 'synced', 200
+
+
+# Starts downloading the chain from several peers at once ({'peers': ['http://address:port', ...]}, defaults to every
+# known peer), progress is reported on /node/info/stats
+@app.route('/node/chain/download', methods=['POST'])
+def download_from_peers():
+    data = request.get_json(force=True, silent=True)
+
+    if type(data) is dict and 'peers' in data:
+        if type(data['peers']) is not list or not all(type(url) is str for url in data['peers']):
+            return "['peers'] must be a list of node urls", 400
+        peer_urls = [url.rstrip('/') for url in data['peers']]
+    else:
+        peer_urls = peers.get_peers()
+
+    if len(peer_urls) == 0:
+        return "No peers to download the chain from", 400
+
+    if ibd.progress['running']:
+        return "An initial block download is already running", 400
+
+    threading.Thread(target=ibd.download_chain, args=(peer_urls,), daemon=True).start()
+    return 'started', 200
 
 
 # Responds with list of UTXO
 @app.route('/node/chain/utxo', methods=['POST'])
 def return_utxo():
-    print("Utxo request received")
-
     data = request.get_json(force=True)
 
-    pprint(data)
-
     if type(data) is not dict:
         return f"Data must be type [{dict} but it was [{type(data)}]]", 400
 
@@ -147,8 +448,102 @@ def return_utxo():
     pk = str(data['pk'])
     mode = str(data['mode'])
 
-    return node.get_utxo(pk, mode), 200
+    with core.reading():
+        return node.get_utxo(pk, mode), 200
+
+
+# Responds with one page of the confirmed history of a public key
+@app.route('/node/chain/history', methods=['POST'])
+def return_address_history():
+    data = request.get_json(force=True)
+
+    if type(data) is not dict:
+        return f"Data must be type [{dict} but it was [{type(data)}]]", 400
+
+    if 'pk' not in data:
+        return "Data must contain the key ['pk']: (public key) and optionally ['page'] and ['page_size']", 400
+
+    with core.reading():
+        res = node.get_address_history(str(data['pk']), data.get('page', 0), data.get('page_size', 25))
+
+    if type(res) is str:
+        return res, 400
+    return res, 200
+
+
+"""
+Response helpers
+"""
+
+
+# Yields the stored json of the first block_count blocks a few at a time, only holding the state while reading them
+# Stops the stream with an error if a reorganization replaced any of them in the meantime
+def iter_chain(block_count, tip_hash):
+    for start in range(0, block_count, MAX_BLOCK_RANGE):
+        with core.reading():
+            headers = blockchain.get_headers(block_count - 1, block_count)
+            if len(headers) == 0 or headers[0]['hash'] != tip_hash:
+                raise RuntimeError(f"Block [{tip_hash}] left the chain while it was being sent")
+
+            blocks = list(blockchain.iter_blocks_raw(start, min(start + MAX_BLOCK_RANGE, block_count)))
+
+        yield from blocks
+
+
+# Returns a chunked response of the json list made of items (stringified json), gzipped if the client accepts it
+# The ETag lets a client that already has this version skip the download with If-None-Match
+def stream_json_list(items, etag):
+    # The gzipped body isn't the same bytes as the plain one, so it gets an ETag of its own
+    gzipped = 'gzip' in request.accept_encodings
+    if gzipped:
+        etag = f'{etag}-gzip'
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    chunks = join_chunks(items)
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(chunks, status=200, mimetype='application/json', headers=headers)
+
+
+# Yields the json list of items in chunks of about STREAM_CHUNK_SIZE bytes
+def join_chunks(items):
+    buffer = ['[']
+    buffered_size = 1
+    for index, item in enumerate(items):
+        if index > 0:
+            buffer.append(',')
+        buffer.append(item)
+        buffered_size += len(item) + 1
+
+        if buffered_size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer = []
+            buffered_size = 0
+
+    buffer.append(']')
+    yield ''.join(buffer).encode()
+
+
+# Compresses a stream of byte chunks into a gzip stream
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=1337)
+    app.run(host='0.0.0.0', port=1337, threaded=True)
@@ -0,0 +1,172 @@
+"""
+Sigverify.py checks transaction signatures (ECDSA over SECP256k1), either one at a time or in batches spread across a
+pool of worker processes. Verifying a signature is pure python and is by far the most expensive part of validating a
+block, so when the node is started with more than one verify worker node.py hands every signature in a block (or in
+the whole chain) to this module at once.
+
+Results always come back in the order the transactions were given so the first error reported never depends on which
+worker finished first.
+
+Signatures that check out are remembered in a bounded least-recently-used cache keyed by the (pk, signature, message)
+job, so a transaction verified when it entered the mempool isn't verified a second time when it shows up in a block.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import blockchain
+import ecdsa
+
+worker_count = 0
+executor = None
+
+# (pk, signature, message) -> True for every signature recently found valid, oldest first
+verified_signatures = OrderedDict()
+cache_capacity = 0
+cache_hits = 0
+cache_misses = 0
+
+
+# Start the worker pool, 0 or 1 workers means every signature is checked in this process
+def initialize(workers=0, cache_size=10000):
+    global worker_count
+    global executor
+    global cache_capacity
+    global cache_hits
+    global cache_misses
+
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+    # The workers are forked straight away, a forked pool starts all of them with its first job. node.py starts the
+    # pool before any other thread, forking once the writer, gossip or server threads are running could deadlock
+    worker_count = workers
+    if worker_count > 1:
+        executor = ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context('fork'))
+        executor.submit(check_job, None).result()
+
+    verified_signatures.clear()
+    cache_capacity = cache_size
+    cache_hits = 0
+    cache_misses = 0
+
+
+# Returns True if signatures are being checked across several processes
+def is_parallel():
+    return executor is not None
+
+
+"""
+Signature checks
+"""
+
+
+# Returns the (pk, signature, message) job needed to check a transaction's signature, or None if it has none to check
+def make_job(transaction_dict):
+    # Coinbase transactions aren't signed
+    if transaction_dict['inputs'][0]['previous_output'][0] == 'COINBASE':
+        return None
+
+    transaction_hash = transaction_dict.copy()
+    del transaction_hash['user_data']
+
+    return (transaction_dict['user_data']['pk'], transaction_dict['user_data']['signature'],
+            blockchain.hash_dict_bytes(transaction_hash))
+
+
+# Returns True if the signature in a job is valid, this runs inside the worker processes
+def check_job(job):
+    if job is None:
+        return True
+
+    pk, signature, message = job
+    try:
+        vk = ecdsa.VerifyingKey.from_string(bytes.fromhex(pk), curve=ecdsa.SECP256k1)
+        return vk.verify(bytes.fromhex(signature), message)
+    except (ValueError, TypeError, AssertionError, ecdsa.BadSignatureError):
+        return False
+
+
+# Check a single job in this process, going through the cache
+def check(job):
+    if job is None or lookup(job):
+        return True
+
+    valid = check_job(job)
+    if valid:
+        remember(job)
+
+    return valid
+
+
+# Start checking a list of jobs and return a function that waits for the results (a list of bools in job order)
+# Jobs found in the cache never leave this process
+def submit_batch(jobs):
+    results = [True if job is None or lookup(job) else None for job in jobs]
+    pending_indexes = [index for index, result in enumerate(results) if result is None]
+    pending_jobs = [jobs[index] for index in pending_indexes]
+
+    if executor is None or len(pending_jobs) < 2:
+        pending_results = map(check_job, pending_jobs)
+    else:
+        chunk_size = max(1, len(pending_jobs) // (worker_count * 4))
+        pending_results = executor.map(check_job, pending_jobs, chunksize=chunk_size)
+
+    def wait():
+        for index, valid in zip(pending_indexes, pending_results):
+            results[index] = valid
+            if valid:
+                remember(jobs[index])
+
+        return results
+
+    return wait
+
+
+"""
+Signature cache
+"""
+
+
+# Returns True if a job's signature is already known to be valid, counting the hit or miss
+def lookup(job):
+    global cache_hits
+    global cache_misses
+
+    # A pk or signature that isn't a string makes the job unhashable, it can't be valid so it is never in the cache
+    try:
+        cached = job in verified_signatures
+    except TypeError:
+        cached = False
+
+    if cached:
+        verified_signatures.move_to_end(job)
+        cache_hits += 1
+        return True
+
+    cache_misses += 1
+    return False
+
+
+# Remember a job whose signature was found valid, forgetting the least recently used one if the cache is full
+def remember(job):
+    if cache_capacity <= 0:
+        return
+
+    verified_signatures[job] = True
+    verified_signatures.move_to_end(job)
+    if len(verified_signatures) > cache_capacity:
+        verified_signatures.popitem(last=False)
+
+
+# Returns the size and hit/miss counters of the signature cache
+def get_cache_stats():
+    stats = {
+        'size': len(verified_signatures),
+        'capacity': cache_capacity,
+        'hits': cache_hits,
+        'misses': cache_misses
+    }
+
+    return stats
@@ -0,0 +1,272 @@
+"""
+Snapshot.py exports and imports snapshots of the UTXO set so a node can start serving without replaying every block to
+build its set of spendable outputs.
+
+A snapshot is a gzipped json file:
+{"version": 1, "height": 120, "block_hash": "...", "utxo_hash": "...",
+ "outputs": [[height, tx index, output index, value, pk], ...]}
+
+utxo_hash commits to the outputs, it is the sha256 of every output (sorted by outpoint) written as a compact json list
+on its own line. block_hash is the hash of the block at height, the snapshot is only loaded if this node's chain has
+that block at that height.
+
+A snapshot can be exported at any height of the chain, the outputs at an earlier height are worked out by undoing the
+blocks after it with their undo records (see undolog.py) on a copy of the set.
+
+When a node starts from a snapshot it doesn't trust it for long. A background thread replays the chain from genesis
+up to the snapshot's height, checking the proof-of-work, links, merkle roots, signatures, inputs and coinbase of every
+block against its own copy of the UTXO set. It then compares the hash of that set with the snapshot's. The outcome is
+kept in status and shown on /node/info/stats, a mismatch is also printed. A node that doesn't have the address index
+and undo log up to the snapshot's height yet builds them in the background as well (see node.build_history).
+"""
+
+from hashlib import sha256
+import os
+import gzip
+import json
+import threading
+import blockchain
+import core
+import sigverify
+import undolog
+import utxo
+
+SNAPSHOT_VERSION = 1
+
+# Number of blocks verify_history reads from the chain at a time
+VERIFY_BATCH = 100
+
+# What the node knows about the snapshot it started from
+status = {
+    'height': None,
+    'block_hash': None,
+    'utxo_hash': None,
+    'verification': None,
+    'verified_height': None,
+    'error': None
+}
+
+
+# Returns the hash the snapshot format commits to for a set of unspent outputs
+def hash_outputs(unspent_outputs):
+    digest = sha256()
+    for outpoint in sorted(unspent_outputs):
+        output = unspent_outputs[outpoint]
+        line = json.dumps([*outpoint, output['value'], output['pk_script']], separators=(',', ':'))
+        digest.update(line.encode() + b'\n')
+
+    return digest.hexdigest()
+
+
+# Returns a copy of the UTXO set as it was right after the block at height was added
+def get_outputs_at(height):
+    unspent_outputs = dict(utxo.unspent_outputs)
+
+    for undo_height in range(blockchain.get_block_count() - 1, height, -1):
+        block = blockchain.get_block(index=undo_height)
+        for tx_index, tx in enumerate(block['transactions']):
+            for output_index in range(len(tx['outputs'])):
+                unspent_outputs.pop((undo_height, tx_index, output_index), None)
+
+        for outpoint, output in undolog.read(undo_height):
+            unspent_outputs[outpoint] = output
+
+    return unspent_outputs
+
+
+# Write a snapshot of the UTXO set at height (the tip by default) to path
+# Returns the snapshot without its outputs, or a string describing why it couldn't be written
+def export(path, height=None):
+    tip_height = blockchain.get_block_count() - 1
+    if height is None:
+        height = tip_height
+
+    if type(height) is not int or not 0 <= height <= tip_height:
+        return f"Snapshot height must be a whole number between 0 and the chain's height [{tip_height}]"
+
+    # Earlier heights are worked out with the undo log, which isn't there yet while it is built behind a snapshot
+    if height < tip_height and undolog.count() < tip_height + 1:
+        return "The undo log doesn't reach the tip yet, only the tip can be exported for now"
+
+    unspent_outputs = get_outputs_at(height)
+
+    info = {
+        'version': SNAPSHOT_VERSION,
+        'height': height,
+        'block_hash': blockchain.get_headers(height, height + 1)[0]['hash'],
+        'utxo_hash': hash_outputs(unspent_outputs),
+        'output_count': len(unspent_outputs)
+    }
+
+    snapshot_data = dict(info)
+    snapshot_data['outputs'] = [[*outpoint, unspent_outputs[outpoint]['value'], unspent_outputs[outpoint]['pk_script']]
+                                for outpoint in sorted(unspent_outputs)]
+
+    # The old file is only replaced once the new one is complete, two exports of the same height can run at once
+    temporary_path = f'{path}.{threading.get_ident()}.tmp'
+    with gzip.open(temporary_path, 'wt') as f:
+        f.write(json.dumps(snapshot_data, separators=(',', ':')))
+        f.close()
+
+    os.replace(temporary_path, path)
+    return info
+
+
+# Read a snapshot and check it against its hash and this node's chain
+# Returns (snapshot without its outputs, UTXO set dict) or a string describing why it can't be used
+def load(path):
+    try:
+        with gzip.open(path, 'rt') as f:
+            snapshot_data = json.load(f)
+            f.close()
+    except (OSError, ValueError) as e:
+        return f"Could not read snapshot [{path}]: {e}"
+
+    if type(snapshot_data) is not dict or snapshot_data.get('version') != SNAPSHOT_VERSION:
+        return f"Snapshot [{path}] is not a version [{SNAPSHOT_VERSION}] snapshot"
+
+    unspent_outputs = {}
+    try:
+        for height, tx_index, output_index, value, pk in snapshot_data['outputs']:
+            unspent_outputs[(height, tx_index, output_index)] = {'value': value, 'pk_script': pk}
+    except (KeyError, TypeError, ValueError):
+        return f"Outputs in snapshot [{path}] should be lists of [height, tx index, output index, value, pk]"
+
+    if hash_outputs(unspent_outputs) != snapshot_data['utxo_hash']:
+        return f"Outputs in snapshot [{path}] do not match its hash [{snapshot_data['utxo_hash']}]"
+
+    height = snapshot_data['height']
+    headers = blockchain.get_headers(height, height + 1)
+    if len(headers) == 0 or headers[0]['hash'] != snapshot_data['block_hash']:
+        return f"This node's chain does not have block [{snapshot_data['block_hash']}] at height [{height}]"
+
+    del snapshot_data['outputs']
+    return snapshot_data, unspent_outputs
+
+
+"""
+Background verification
+"""
+
+
+# Verify the chain up to the snapshot's height on another thread, difficulty and reward are the node's parameters
+def start_verification(snapshot_info, difficulty, reward):
+    status.update({
+        'height': snapshot_info['height'],
+        'block_hash': snapshot_info['block_hash'],
+        'utxo_hash': snapshot_info['utxo_hash'],
+        'verification': 'pending',
+        'verified_height': None,
+        'error': None
+    })
+
+    thread = threading.Thread(target=verify_history, args=(snapshot_info, difficulty, reward), daemon=True)
+    thread.start()
+
+
+# Replay the chain from genesis to the snapshot's height into a private UTXO set, checking every block on the way,
+# and compare the result with the snapshot. If the chain can't be read the verification ends as 'error'
+def verify_history(snapshot_info, difficulty, reward):
+    status['verification'] = 'running'
+    try:
+        replay_history(snapshot_info, difficulty, reward)
+    except Exception as e:
+        status['verification'] = 'error'
+        status['error'] = f"Could not read the chain up to the snapshot: {e}"
+        print(f"[snapshot] {status['error']}")
+
+
+# The work of verify_history, blocks are read a batch at a time under the read lock so a reorganization can't change
+# them half way through a read
+def replay_history(snapshot_info, difficulty, reward):
+    unspent_outputs = {}
+    previous_hash = None
+    height = 0
+
+    while height <= snapshot_info['height']:
+        with core.reading():
+            blocks = list(blockchain.iter_blocks(height, min(height + VERIFY_BATCH, snapshot_info['height'] + 1)))
+
+        if len(blocks) == 0:
+            status['verification'] = 'invalid'
+            status['error'] = f"The chain no longer reaches the snapshot's height [{snapshot_info['height']}]"
+            print(f"[snapshot] {status['error']}")
+            return
+
+        for block in blocks:
+            try:
+                block_error = check_block(block, height, previous_hash, unspent_outputs, difficulty, reward)
+            except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+                block_error = "Block is not formatted like the example-json templates"
+            if block_error is not None:
+                status['verification'] = 'invalid'
+                status['error'] = f"Block at height [{height}] is invalid: {block_error}"
+                print(f"[snapshot] {status['error']}")
+                return
+
+            previous_hash = blockchain.hash_block(block)
+            status['verified_height'] = height
+            height += 1
+
+    utxo_hash = hash_outputs(unspent_outputs)
+    if utxo_hash != snapshot_info['utxo_hash']:
+        status['verification'] = 'mismatch'
+        status['error'] = f"UTXO set replayed from genesis hashes to [{utxo_hash}] " \
+                          f"but the snapshot committed to [{snapshot_info['utxo_hash']}]"
+        print(f"[snapshot] {status['error']}")
+        return
+
+    status['verification'] = 'valid'
+
+
+# Returns a string describing what is wrong with a block given the outputs unspent before it, otherwise None
+# The outputs the block spends and creates are applied to unspent_outputs as it goes
+def check_block(block, height, previous_hash, unspent_outputs, difficulty, reward):
+    if block['height'] != height:
+        return f"Block claims height [{block['height']}]"
+
+    # Genesis is the only block that isn't mined and doesn't point at another block
+    if height > 0:
+        if block['header'] != previous_hash:
+            return "Header does not match the hash of the previous block"
+
+        if blockchain.hash_block(block)[:difficulty] != '0' * difficulty:
+            return f"Hash of block does not start with [{difficulty}] zeroes"
+
+    if block.get('version', 1) >= 2 and block['merkle_root'] != blockchain.compute_merkle_root(block['transactions']):
+        return "Merkle root does not match the transactions of the block"
+
+    # Checked without the signature cache, which belongs to the thread serving requests
+    transactions = block['transactions'][1:]
+    for tx in transactions:
+        if not sigverify.check_job(sigverify.make_job(tx)):
+            return f"Signature of transaction [{tx['tx_id']}] is invalid"
+
+    fees = 0
+    for tx in transactions:
+        input_sum = 0
+        for tx_input in tx['inputs']:
+            outpoint = utxo.make_outpoint(tx_input['previous_output'])
+            output = unspent_outputs.pop(outpoint, None)
+            if output is None:
+                return f"Transaction [{tx['tx_id']}] redeems an output that is spent or doesn't exist"
+            if output['pk_script'] != tx['user_data']['pk']:
+                return f"Transaction [{tx['tx_id']}] redeems an output that isn't addressed to its sender"
+            input_sum += int(output['value'])
+
+        output_sum = sum(output['value'] for output in tx['outputs'])
+        if output_sum > input_sum:
+            return f"Transaction [{tx['tx_id']}] spends more than its inputs"
+        fees += input_sum - output_sum
+
+    if height > 0 and block['transactions'][0]['outputs'][0]['value'] != reward + fees:
+        return f"Coinbase output should be the reward plus fees [{reward + fees}]"
+
+    for tx_index, tx in enumerate(block['transactions']):
+        for output_index, output in enumerate(tx['outputs']):
+            unspent_outputs[(height, tx_index, output_index)] = {
+                'value': output['value'],
+                'pk_script': output['pk_script']
+            }
+
+    return None
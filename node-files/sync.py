@@ -0,0 +1,145 @@
+"""
+Sync.py brings this node's chain up to date with a peer headers-first. The compact header chain of the peer is
+downloaded and checked (height, hash linkage and proof-of-work) before a single block body is requested, so a peer
+with an invalid or shorter chain is turned away after a few kilobytes instead of after the whole chain.
+
+Once the headers check out the bodies are fetched in ranges, each one has to hash to the header that was already
+checked and is then handed to node.py to be verified and added like any other submitted block. If the peer's chain
+leaves this node's chain somewhere below the tip only the blocks after the fork are fetched, node.py keeps them on a
+side chain and switches to it once it has more work behind it.
+"""
+
+import requests
+import blockchain
+import core
+import node
+
+HEADER_BATCH = 2000
+BLOCK_BATCH = 100
+REQUEST_TIMEOUT = 10
+
+
+# Sync with the peer at peer_url, returns None if this node caught up, otherwise a string describing why it didn't
+def sync_from_peer(peer_url):
+    session = requests.Session()
+
+    try:
+        peer_tip = get_json(session, f'{peer_url}/node/chain/tip')
+        # The height and hash of the tip are read together so they belong to the same tip
+        with core.reading():
+            local_height = blockchain.get_block_count() - 1
+            tip_hash = blockchain.get_tip_hash()
+
+        if peer_tip['height'] <= local_height:
+            return f"Peer chain [{peer_tip['height']}] is not longer than this node's chain [{local_height}]"
+
+        # Usually the peer's chain extends this one, then only the headers after this node's tip are needed
+        headers = download_headers(session, peer_url, local_height, peer_tip['height'])
+        if type(headers) is str:
+            return headers
+
+        if headers[0]['hash'] != tip_hash:
+            # Otherwise check the peer's whole header chain
+            headers = download_headers(session, peer_url, 0, peer_tip['height'])
+            if type(headers) is str:
+                return headers
+
+            fork_height = find_fork_height(headers)
+            if fork_height is None:
+                return "Peer chain does not start from the same genesis block as this node"
+
+            # Only the blocks after the fork are downloaded, they are stored as a side chain until it outgrows the
+            # node's chain and node.py reorganizes onto it
+            headers = headers[fork_height:]
+
+        return download_blocks(session, peer_url, headers)
+
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        return f"Could not sync with peer [{peer_url}]: {e}"
+
+
+# Download and check the headers from start to end (inclusive), returns the list or a string describing the problem
+def download_headers(session, peer_url, start, end):
+    headers = []
+    while start + len(headers) <= end:
+        batch_start = start + len(headers)
+        batch = get_json(session, f'{peer_url}/node/chain/headers?start={batch_start}'
+                                  f'&end={min(batch_start + HEADER_BATCH, end + 1)}')
+        if len(batch) == 0:
+            return f"Peer stopped sending headers at height [{batch_start}]"
+
+        previous_header = headers[-1] if len(headers) > 0 else None
+        header_error = verify_headers(batch, batch_start, previous_header)
+        if header_error is not None:
+            return header_error
+
+        headers.extend(batch)
+
+    return headers
+
+
+# Returns a string describing the first header that isn't linked to the one before it or lacks proof-of-work
+def verify_headers(headers, start, previous_header):
+    for index, header in enumerate(headers):
+        if header['height'] != start + index:
+            return f"Peer sent header for height [{header['height']}] instead of [{start + index}]"
+
+        if previous_header is not None and header['header'] != previous_header['hash']:
+            return f"Header at height [{header['height']}] does not point at the hash of the header before it"
+
+        # Version 2 hashes can be checked from the header alone, version 1 hashes are checked with the body
+        if header.get('version', 1) >= 2 and blockchain.hash_block(header) != header['hash']:
+            return f"Header at height [{header['height']}] does not hash to [{header['hash']}]"
+
+        # Genesis is the only block that isn't mined
+        if header['height'] > 0 and header['hash'][:node.block_difficulty] != '0' * node.block_difficulty:
+            return f"Header at height [{header['height']}] does not have enough proof-of-work"
+
+        previous_header = header
+
+    return None
+
+
+# Returns the height of the last block this node shares with a header chain starting at genesis, or None
+def find_fork_height(headers):
+    with core.reading():
+        local_headers = blockchain.get_headers(0, len(headers))
+
+    fork_height = None
+    for local_header, header in zip(local_headers, headers):
+        if local_header['hash'] != header['hash']:
+            break
+        fork_height = header['height']
+
+    return fork_height
+
+
+# Download the bodies of headers (after the first one, which this node already has) and add them to the chain
+def download_blocks(session, peer_url, headers):
+    first_height = headers[0]['height'] + 1
+    last_height = headers[-1]['height']
+
+    for batch_start in range(first_height, last_height + 1, BLOCK_BATCH):
+        batch_end = min(batch_start + BLOCK_BATCH, last_height + 1)
+        blocks = get_json(session, f'{peer_url}/node/chain/blocks?start={batch_start}&end={batch_end}')
+
+        if len(blocks) != batch_end - batch_start:
+            return f"Peer sent [{len(blocks)}] blocks for heights [{batch_start}] to [{batch_end - 1}]"
+
+        for height, block in enumerate(blocks, start=batch_start):
+            if blockchain.hash_block(block) != headers[height - headers[0]['height']]['hash']:
+                return f"Block at height [{height}] does not match the header the peer sent for it"
+
+            verification_error = core.submit(node.add_to_blockchain, block)
+            if verification_error is not None:
+                return f"Block at height [{height}] from peer is invalid: {verification_error}"
+
+    return None
+
+
+# Returns the json body of a GET request, raising if the peer didn't answer with 200
+def get_json(session, url):
+    response = session.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    return response.json()
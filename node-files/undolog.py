@@ -0,0 +1,133 @@
+"""
+Undolog.py keeps an undo record for every block in the chain: the outputs that block spent, exactly as they were in the
+UTXO set before the block was connected. With it a reorganization can take blocks off the tip one by one and put the
+UTXO set back the way it was, instead of rebuilding it from genesis.
+
+The records are persisted as an append-only log (./blockchain/undo.log) holding one json line per block:
+{"height": 5, "spent": [[height, tx index, output index, value, pk], ...]}
+
+Only the byte offset of each line is kept in memory, a record is read back from disk when its block is disconnected.
+Like the address index the log is derived data, blocks missing from it are added again when the node starts.
+"""
+
+import os
+import json
+
+log_path = None
+log_file = None
+
+# Byte offset of the record of every block in the log, entry n belongs to the block at height n
+record_offsets = []
+
+
+# Load the log and return the number of blocks it covers, anything past chain_length is thrown away
+def initialize(chain_length, path='./blockchain/undo.log'):
+    global log_path
+    global log_file
+
+    if log_file is not None:
+        log_file.close()
+
+    log_path = path
+    record_offsets.clear()
+
+    good_bytes = 0
+    if os.path.isfile(log_path):
+        with open(log_path, 'rb') as f:
+            for line in f:
+                # A torn last line from a crash ends the usable part of the log
+                if not line.endswith(b'\n') or len(record_offsets) == chain_length:
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['height'] != len(record_offsets):
+                    break
+                record_offsets.append(good_bytes)
+                good_bytes += len(line)
+            f.close()
+
+    log_file = open(log_path, 'ab')
+    log_file.truncate(good_bytes)
+    log_file.seek(good_bytes)
+
+    return len(record_offsets)
+
+
+# Write the undo record of a block, spent_outputs is the list of (outpoint, output) pairs returned by utxo.connect_block
+def append(height, spent_outputs):
+    record = {
+        'height': height,
+        'spent': [[*outpoint, output['value'], output['pk_script']] for outpoint, output in spent_outputs]
+    }
+
+    record_offsets.append(log_file.tell())
+    log_file.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+    log_file.flush()
+
+
+# Returns the (outpoint, output) pairs the block at height spent
+def read(height):
+    with open(log_path, 'rb') as f:
+        f.seek(record_offsets[height])
+        record = json.loads(f.readline())
+        f.close()
+
+    spent_outputs = []
+    for block_height, tx_index, output_index, value, pk in record['spent']:
+        spent_outputs.append(((block_height, tx_index, output_index), {'value': value, 'pk_script': pk}))
+
+    return spent_outputs
+
+
+# Drop the records of every block from height onwards
+def truncate(height):
+    if height >= len(record_offsets):
+        return
+
+    log_file.truncate(record_offsets[height])
+    log_file.seek(record_offsets[height])
+    del record_offsets[height:]
+
+
+# Returns everything needed to restore the log without reading it, the log is flushed but the checkpoint fsyncs it
+# (see checkpoint.py)
+def get_state():
+    log_file.flush()
+
+    state = {
+        'record_offsets': list(record_offsets),
+        'log_size': log_file.tell()
+    }
+
+    return state
+
+
+# Restore the log from get_state, cutting it back to where it was when the state was taken
+# Returns False if the log is shorter than that, then it has to be checked again with initialize
+def restore(state, path='./blockchain/undo.log'):
+    global log_path
+    global log_file
+
+    if log_file is not None:
+        log_file.close()
+        log_file = None
+
+    log_path = path
+    if not os.path.isfile(log_path) or os.path.getsize(log_path) < state['log_size']:
+        return False
+
+    record_offsets.clear()
+    record_offsets.extend(state['record_offsets'])
+
+    log_file = open(log_path, 'ab')
+    log_file.truncate(state['log_size'])
+    log_file.seek(state['log_size'])
+
+    return True
+
+
+# Returns the number of blocks with an undo record
+def count():
+    return len(record_offsets)
@@ -0,0 +1,73 @@
+"""
+Utxo.py keeps the set of unspent transaction outputs (UTXO) of the blockchain in memory so that node.py can resolve
+and double-spend check a transaction input with a single dict lookup instead of scanning every block.
+
+An outpoint is the tuple (block height, transaction index, output index) which is the same thing a transaction input
+holds in its 'previous_output' list. Each outpoint maps to a dict holding the 'value' and 'pk_script' of the output.
+
+The set is rebuilt from the block store when the node starts and updated by node.py every time a block is added or,
+during a reorganization, taken off the tip again.
+"""
+
+import blockchain
+
+# (height, tx index, output index) -> {'value': ..., 'pk_script': ...}
+unspent_outputs = {}
+
+
+# Spend the outputs redeemed by a block and add the outputs it creates, returns the (outpoint, output) pairs spent
+# The block is applied to the node's UTXO set unless another one is passed in as outputs
+def connect_block(block_dict, height, outputs=None):
+    if outputs is None:
+        outputs = unspent_outputs
+
+    spent_outputs = []
+    for tx_index, tx in enumerate(block_dict['transactions']):
+        for tx_input in tx['inputs']:
+            outpoint = make_outpoint(tx_input['previous_output'])
+            if outpoint is not None and outpoint in outputs:
+                spent_outputs.append((outpoint, outputs.pop(outpoint)))
+
+        for output_index, output in enumerate(tx['outputs']):
+            outputs[(height, tx_index, output_index)] = {
+                'value': output['value'],
+                'pk_script': output['pk_script']
+            }
+
+    return spent_outputs
+
+
+# Undo connect_block, spent_outputs is the list it returned for this block (see undolog.py)
+def disconnect_block(block_dict, height, spent_outputs):
+    for tx_index, tx in enumerate(block_dict['transactions']):
+        for output_index in range(len(tx['outputs'])):
+            unspent_outputs.pop((height, tx_index, output_index), None)
+
+    for outpoint, output in spent_outputs:
+        unspent_outputs[outpoint] = output
+
+
+# Returns the unspent output an outpoint points at, or None if it is spent or never existed
+def get_output(outpoint):
+    return unspent_outputs.get(outpoint)
+
+
+# Returns True if the outpoint points at an output that exists in the chain, spent or not
+def output_exists(outpoint):
+    block = blockchain.get_block(index=outpoint[0])
+    if block is None or outpoint[1] >= len(block['transactions']):
+        return False
+
+    return outpoint[2] < len(block['transactions'][outpoint[1]]['outputs'])
+
+
+# Turns an input's previous_output list into a hashable outpoint, returns None for coinbase or malformed inputs
+def make_outpoint(previous_output):
+    if len(previous_output) != 3:
+        return None
+
+    for value in previous_output:
+        if type(value) is not int or value < 0:
+            return None
+
+    return tuple(previous_output)
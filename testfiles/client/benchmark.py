@@ -0,0 +1,220 @@
+"""
+This file benchmarks the hashing and mining path of the client without needing a node. Blocks are generated from a
+fixed seed so every run mines exactly the same blocks, which makes the results of two runs comparable.
+
+For every combination of block version, difficulty, transactions per block and worker count it records the hashrate
+and the distribution of time-to-solution over several trials. It also measures how long it takes to produce the
+bytes hashed for a single nonce (the per-nonce serialization cost) for each block size.
+
+Results are written as json to ../mining_benchmarks/benchmark_<timestamp>.json
+
+Usage:
+python benchmark.py [--difficulties 3 4] [--tx-counts 0 10 100] [--workers 1 4] [--trials 5] [--seed 1]
+python benchmark.py --compare old_results.json new_results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from hashlib import sha256
+import miner
+
+
+# Returns a transaction shaped like the ones in the example-json folder filled with seeded random data
+def generate_transaction(rng):
+    transaction = {
+        'tx_id': '%032x' % rng.getrandbits(128),
+        'locktime': 0.0,
+        'inputs': [
+            {
+                'previous_output': [rng.randint(0, 1000), rng.randint(0, 10), rng.randint(0, 3)],
+                'signature_script': '0'
+            }
+            for i in range(rng.randint(1, 3))
+        ],
+        'outputs': [
+            {
+                'value': float(rng.randint(1, 1000)),
+                'pk_script': '%0128x' % rng.getrandbits(512)
+            }
+            for i in range(rng.randint(1, 3))
+        ],
+        'user_data': {
+            'pk': '%0128x' % rng.getrandbits(512),
+            'signature': '%0128x' % rng.getrandbits(512)
+        }
+    }
+
+    return transaction
+
+
+# Returns a block with tx_count transactions, version 2 blocks get a merkle root
+def generate_block(rng, tx_count, version):
+    block = {
+        'header': '%064x' % rng.getrandbits(256),
+        'height': rng.randint(1, 100000),
+        'timestamp': 1600000000.0 + rng.randint(0, 10 ** 6),
+        'transactions': [generate_transaction(rng) for i in range(tx_count)],
+        'nonce': 0
+    }
+
+    if version >= 2:
+        block['version'] = version
+        block['merkle_root'] = miner.compute_merkle_root(block['transactions'])
+
+    return block
+
+
+# Returns the average number of nanoseconds spent producing and hashing the data for one nonce
+def measure_nonce_cost(block, method, attempts=2000):
+    block = dict(block)
+
+    if method == 'full_json':
+        # The old client loop, the whole block is serialized for every nonce
+        start = time.perf_counter()
+        for nonce in range(attempts):
+            block['nonce'] = nonce
+            sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+    else:
+        prefix, suffix, is_header = miner.split_block(block)
+        prefix_hash = sha256(prefix)
+        start = time.perf_counter()
+        for nonce in range(attempts):
+            attempt = prefix_hash.copy()
+            attempt.update(miner.encode_nonce(nonce, is_header) + suffix)
+            attempt.hexdigest()
+
+    return (time.perf_counter() - start) / attempts * 10 ** 9
+
+
+# Returns the min, median, mean, 90th percentile and max of a list of numbers
+def summarize(values):
+    ordered = sorted(values)
+
+    summary = {
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.mean(ordered),
+        'p90': ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        'max': ordered[-1]
+    }
+
+    return summary
+
+
+# Runs every sweep and returns the results dict
+def run(difficulties, tx_counts, worker_counts, trials, seed):
+    results = {
+        'created': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'parameters': {
+            'difficulties': difficulties,
+            'tx_counts': tx_counts,
+            'workers': worker_counts,
+            'trials': trials,
+            'seed': seed
+        },
+        'nonce_cost': [],
+        'mining': []
+    }
+
+    # Per nonce serialization cost for each block size
+    for tx_count in tx_counts:
+        rng = random.Random(f'{seed}-{tx_count}')
+        legacy_block = generate_block(rng, tx_count, 1)
+        header_block = generate_block(rng, tx_count, 2)
+
+        entry = {
+            'tx_count': tx_count,
+            'full_json_ns': measure_nonce_cost(legacy_block, 'full_json'),
+            'json_prefix_ns': measure_nonce_cost(legacy_block, 'prefix'),
+            'header_prefix_ns': measure_nonce_cost(header_block, 'prefix')
+        }
+        results['nonce_cost'].append(entry)
+        print(f"[nonce cost] txs: {tx_count} | full json: {entry['full_json_ns']:.0f}ns | "
+              f"json prefix: {entry['json_prefix_ns']:.0f}ns | header prefix: {entry['header_prefix_ns']:.0f}ns")
+
+    # Mining sweeps, each trial mines a different seeded block so solutions take a realistic spread of time
+    for version in [1, 2]:
+        for difficulty in difficulties:
+            for tx_count in tx_counts:
+                for workers in worker_counts:
+                    seconds = []
+                    hashrates = []
+                    for trial in range(trials):
+                        rng = random.Random(f'{seed}-{version}-{difficulty}-{tx_count}-{trial}')
+                        block = generate_block(rng, tx_count, version)
+                        stats = miner.mine(block, difficulty, workers)
+                        seconds.append(stats['seconds'])
+                        hashrates.append(stats['hashrate'])
+
+                    entry = {
+                        'version': version,
+                        'difficulty': difficulty,
+                        'tx_count': tx_count,
+                        'workers': workers,
+                        'hashrate': summarize(hashrates),
+                        'time_to_solution': summarize(seconds)
+                    }
+                    results['mining'].append(entry)
+                    print(f"[mining] v{version} | difficulty: {difficulty} | txs: {tx_count} | workers: {workers} | "
+                          f"median hashrate: {entry['hashrate']['median']:.0f} H/s | "
+                          f"median time: {entry['time_to_solution']['median']:.3f}s")
+
+    return results
+
+
+# Prints how the median hashrate of every configuration changed between two result files
+def compare(old_path, new_path):
+    old_results = json.load(open(old_path, 'r'))
+    new_results = json.load(open(new_path, 'r'))
+
+    old_entries = {}
+    for entry in old_results['mining']:
+        old_entries[(entry['version'], entry['difficulty'], entry['tx_count'], entry['workers'])] = entry
+
+    for entry in new_results['mining']:
+        key = (entry['version'], entry['difficulty'], entry['tx_count'], entry['workers'])
+        if key not in old_entries:
+            continue
+
+        old_rate = old_entries[key]['hashrate']['median']
+        new_rate = entry['hashrate']['median']
+        change = (new_rate - old_rate) / old_rate * 100 if old_rate > 0 else 0
+        print(f"v{key[0]} | difficulty: {key[1]} | txs: {key[2]} | workers: {key[3]} | "
+              f"{old_rate:.0f} H/s -> {new_rate:.0f} H/s ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the client mining path')
+    parser.add_argument('--difficulties', type=int, nargs='+', default=[3, 4])
+    parser.add_argument('--tx-counts', type=int, nargs='+', default=[0, 10, 100])
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    arguments = parser.parse_args()
+
+    if arguments.compare:
+        compare(*arguments.compare)
+    else:
+        benchmark_results = run(arguments.difficulties, arguments.tx_counts, arguments.workers, arguments.trials,
+                                arguments.seed)
+
+        if not os.path.isdir('../mining_benchmarks'):
+            os.mkdir('../mining_benchmarks')
+
+        results_path = f'../mining_benchmarks/benchmark_{int(benchmark_results["created"])}.json'
+        with open(results_path, 'w+') as f:
+            json.dump(benchmark_results, f, indent=4)
+            f.close()
+
+        print(f"Results written to {results_path}")
@@ -3,11 +3,10 @@ This file is meant to be a fully working mining client to interact with the REST
 directory. Other client software can be written to mine and transact with the API however.
 """
 import json
-import sys
 import os
 import requests
-import time
 import ecdsa
+import miner
 from hashlib import sha256
 from pprint import pprint
 from uuid import uuid4
@@ -15,6 +14,7 @@ from uuid import uuid4
 NODE_URL = 'http://127.0.0.1:1337/'
 CLIENT_MODE = ''
 TRANSACTION_GOAL = 10
+MINING_WORKERS = os.cpu_count() or 1
 
 
 # Initialize client RSA credentials
@@ -53,7 +53,7 @@ def initialize():
     if not os.path.isdir('../mining_benchmarks'):
         os.mkdir('../mining_benchmarks')
 
-    if not os.path.isfile('./mining_benchmarks/client_stats.json'):
+    if not os.path.isfile('../mining_benchmarks/client_stats.json'):
         with open('../mining_benchmarks/client_stats.json', 'w+') as f:
             data = []
             json.dump(data, f)
@@ -161,79 +161,39 @@ Block Submission
 
 def create_block():
     # To create a block...
-    # Request all mempool transactions
-    mempool_transactions = requests.get(f'{NODE_URL}/node/tx/currentmempool').json()
-
-    # Request all node parameters
-    node_parameters = requests.get(f"{NODE_URL}/node/info/parameters").json()
+    # Request a ready to mine template from the node, it already holds the transactions, fees and coinbase value
+    mining_template = requests.get(f"{NODE_URL}/node/template/mining",
+                                   params={'max_transactions': TRANSACTION_GOAL}).json()
     print("CURRENT PARAMETERS--")
-    print(node_parameters)
+    print({key: mining_template[key] for key in ['reward', 'difficulty', 'tx_minimum', 'tx_maximum']})
     print('--------------------')
-    # Request the entire blockchain
-    current_blockchain = requests.get(f"{NODE_URL}/node/chain/currentchain").json()
-
-    # Find enough transactions to satisfy the node tx_threshold parameter
-    current_transactions = []
-    for tx in mempool_transactions:
-        if len(current_transactions) >= TRANSACTION_GOAL or len(current_transactions) >= node_parameters['tx_maximum']:
-            break
-        current_transactions.append(tx)
-        print(f"TRANSACTION [{tx['tx_id']}] WILL BE ADDED TO BLOCK")
-
-    # Find the most recent block and hash it to get the header of this block
-    last_block = current_blockchain[-1]
-    last_block_hash = hash_dict(last_block)
-
-    # Create a coinbase transaction and add it to the block first
-    coinbase_transaction = requests.get(f"{NODE_URL}/node/template/coinbase").json()
-
-    # Request a new block template
-    block = requests.get(f"{NODE_URL}/node/template/block").json()
-    block['header'] = last_block_hash
-    block['height'] = last_block['height'] + 1
-
-    # Add all of the transactions pulled from the mempool
-    for tx in current_transactions:
-        block['transactions'].append(tx)
-
-    # Find the block fees by subtracting the sum of all transaction inputs by the sum of all transaction outputs
-    total_input = 0
-    total_output = 0
 
+    block = mining_template['block']
     for tx in block['transactions']:
-        tx_sum = find_transaction_sum(tx, current_blockchain)
-
-        total_input += int(tx_sum[0])
-        total_output += int(tx_sum[1])
+        print(f"TRANSACTION [{tx['tx_id']}] WILL BE ADDED TO BLOCK")
 
-    print("BLOCK TOTAL INPUT AND OUTPUT--")
-    print(f"INPUT: {total_input} :: OUTPUT: {total_output}")
-    print(f"FEES: {total_input - total_output}")
+    print(f"FEES: {mining_template['fees']}")
 
-    # Make the value of the coinbase transaction output equal to the block reward plus the block fees
-    coinbase_transaction['inputs'][0]['previous_output'] = ["COINBASE"]
-    coinbase_transaction['outputs'][0]['value'] = node_parameters['reward'] + (total_input - total_output)
+    # Claim the coinbase transaction, its value is already the block reward plus the block fees
+    coinbase_transaction = mining_template['coinbase']
     coinbase_transaction['outputs'][0]['pk_script'] = vk.to_string().hex()
     coinbase_transaction['tx_id'] = str(uuid4().hex)
 
     # Insert the coinbase transaction at the top of the block
     block['transactions'].insert(0, coinbase_transaction)
 
-    # Find the nonce based on this nodes block difficulty
-    hash_string = ""
-    for i in range(node_parameters['difficulty']):
-        hash_string += "0"
+    # Version 2 blocks only hash a fixed size header, so commit to the transactions with a merkle root
+    if block.get('version', 1) >= 2:
+        block['merkle_root'] = miner.compute_merkle_root(block['transactions'])
 
-    # Mine the block and record the time it took
-    start_time = time.time()
-    while hash_dict(block)[:node_parameters['difficulty']] != hash_string:
-        block['nonce'] += 1
-    end_time = time.time()
+    # Find the nonce based on this nodes block difficulty and record the time it took
+    mining_stats = miner.mine(block, mining_template['difficulty'], MINING_WORKERS)
 
     print("HASH FOUND--")
-    print(f"TIME: {end_time - start_time}")
+    print(f"TIME: {mining_stats['seconds']}")
     print(f"NONCE: {block['nonce']}")
-    print(f"HASH: {hash_dict(block)}")
+    print(f"HASH: {mining_stats['hash']}")
+    print(f"HASHRATE: {mining_stats['hashrate']:.0f} H/s over {mining_stats['workers']} worker(s)")
     print("--------------------")
 
     # Submit the block
@@ -248,18 +208,18 @@ def create_block():
     if block_result == 'valid':
         data = json.load(open('../mining_benchmarks/client_stats.json', 'r'))
 
-        average_time = 0
-        for entry in data:
-            average_time += entry['block_time']
-
-        average_time += end_time - start_time
-        average_time = average_time / (len(data) + 1)
+        # Update the running average from the last entry instead of summing the whole file again
+        average_time = mining_stats['seconds']
+        if len(data) > 0:
+            average_time = (data[-1]['average_time'] * len(data) + mining_stats['seconds']) / (len(data) + 1)
 
         client_data = {
-            'block_time': end_time - start_time,
-            'difficulty': node_parameters['difficulty'],
+            'block_time': mining_stats['seconds'],
+            'difficulty': mining_template['difficulty'],
             'nonce': block['nonce'],
-            'hash': hash_dict(block),
+            'hash': mining_stats['hash'],
+            'hashrate': mining_stats['hashrate'],
+            'workers': mining_stats['workers'],
             'average_time': average_time
         }
         data.append(client_data)
@@ -276,44 +236,6 @@ Misc Functions
 """
 
 
-# Returns the input and output sum of the transaction
-def find_transaction_sum(transaction_dict, current_chain):
-    input_sum = 0
-    output_sum = 0
-
-    for tx_input in transaction_dict['inputs']:
-        # Check if block containing corresponding output exists
-        data = current_chain
-        for block in data:
-            if block['height'] == tx_input['previous_output'][0]:
-                output_block = block
-                break
-
-        # Find input sum
-        data = current_chain
-
-        previous_transaction = output_block['transactions'][tx_input['previous_output'][1]]
-        previous_output = previous_transaction['outputs'][tx_input['previous_output'][2]]
-
-        input_sum += int(previous_output['value'])
-
-    for tx_output in transaction_dict['outputs']:
-        output_sum += tx_output['value']
-        print(f"Adding {tx_output} to output sum for output #{transaction_dict['outputs'].index(tx_output)} "
-              f"in transaction {transaction_dict['tx_id']}")
-
-    return input_sum, output_sum
-
-
-# Returns a hash hex digest of any dict object
-def hash_dict(dictionary):
-    # Turn dict into string and return its hash
-    dict_data = json.dumps(dictionary, sort_keys=True)
-    dict_hash = sha256(dict_data.encode()).hexdigest()
-
-    return str(dict_hash)
-
-
 # Returns a hash digest of any dict object
 def hash_transaction(transaction):
     tx_data = json.dumps(transaction, sort_keys=True)
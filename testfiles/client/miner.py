@@ -0,0 +1,156 @@
+"""
+This file is the nonce search engine used by client.py to mine blocks. The nonce space is split between worker
+processes (worker n tries nonces n, n + workers, n + 2 * workers...) and every worker stops as soon as any of them
+finds a hash with enough leading zeroes.
+
+Everything in the serialized block except the nonce is the same for every attempt, so it is hashed once up front and
+each attempt only copies that hash state and feeds it the bytes of one nonce:
+version 2 blocks - the first 80 bytes of the header are the prefix, the nonce is the last 8 bytes
+version 1 blocks - the json of the block is split around the nonce into a prefix and a suffix
+"""
+
+import json
+import multiprocessing
+import os
+import struct
+import time
+from hashlib import sha256
+
+HEADER_FORMAT = struct.Struct('>32s32sQdQ')
+NONCE_FORMAT = struct.Struct('>Q')
+
+# How many nonces a worker tries between checking if another worker already found one
+CHECK_INTERVAL = 5000
+
+
+# Returns the fixed size header of a version 2 block as bytes
+def serialize_header(block):
+    if type(block['header']) is str:
+        previous_hash = bytes.fromhex(block['header'])
+    else:
+        previous_hash = bytes(32)
+
+    return HEADER_FORMAT.pack(previous_hash, bytes.fromhex(block['merkle_root']), block['height'],
+                              block['timestamp'], block['nonce'])
+
+
+# Returns the merkle root of a list of transactions as a hex string, the same way the node works it out
+def compute_merkle_root(transactions):
+    if len(transactions) == 0:
+        return bytes(32).hex()
+
+    level = [sha256(json.dumps(tx, sort_keys=True).encode()).digest() for tx in transactions]
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+
+    return level[0].hex()
+
+
+# Returns (prefix, suffix, is_header) where hashing prefix + nonce bytes + suffix gives the block's hash
+def split_block(block):
+    if block.get('version', 1) >= 2:
+        header = serialize_header(block)
+        return header[:-NONCE_FORMAT.size], b'', True
+
+    # Serialize once with a placeholder nonce and cut the json around it
+    placeholder = dict(block)
+    placeholder['nonce'] = -1
+    data = json.dumps(placeholder, sort_keys=True)
+
+    nonce_key = '"nonce": '
+    start = data.index(nonce_key + '-1') + len(nonce_key)
+    return data[:start].encode(), data[start + 2:].encode(), False
+
+
+# Returns the bytes a nonce is written as inside the serialized block
+def encode_nonce(nonce, is_header):
+    if is_header:
+        return NONCE_FORMAT.pack(nonce)
+
+    return str(nonce).encode()
+
+
+# Tries nonces start, start + step... until a hash starting with target is found or stop_event is set
+def search_nonces(prefix, suffix, is_header, target, start, step, stop_event, results, attempt_counter):
+    prefix_hash = sha256(prefix)
+    nonce = start
+
+    while not stop_event.is_set():
+        for i in range(CHECK_INTERVAL):
+            attempt = prefix_hash.copy()
+            attempt.update(encode_nonce(nonce, is_header) + suffix)
+            digest = attempt.hexdigest()
+
+            if digest.startswith(target):
+                with attempt_counter.get_lock():
+                    attempt_counter.value += i + 1
+                results.put((nonce, digest))
+                stop_event.set()
+                return
+
+            nonce += step
+
+        with attempt_counter.get_lock():
+            attempt_counter.value += CHECK_INTERVAL
+
+
+# Finds a nonce for block whose hash starts with difficulty zeroes, sets it on the block and returns mining stats
+def mine(block, difficulty, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Worker processes are forked so they don't re-run client.py, where that isn't possible mine in this process
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        workers = 1
+
+    prefix, suffix, is_header = split_block(block)
+    target = '0' * difficulty
+    start_time = time.time()
+
+    if workers <= 1:
+        nonce = block['nonce']
+        prefix_hash = sha256(prefix)
+        while True:
+            attempt = prefix_hash.copy()
+            attempt.update(encode_nonce(nonce, is_header) + suffix)
+            digest = attempt.hexdigest()
+            if digest.startswith(target):
+                break
+            nonce += 1
+        attempts = nonce - block['nonce'] + 1
+    else:
+        context = multiprocessing.get_context('fork')
+        stop_event = context.Event()
+        results = context.Queue()
+        attempt_counter = context.Value('Q', 0)
+
+        processes = []
+        for worker in range(workers):
+            process = context.Process(target=search_nonces,
+                                      args=(prefix, suffix, is_header, target, block['nonce'] + worker, workers,
+                                            stop_event, results, attempt_counter))
+            process.start()
+            processes.append(process)
+
+        nonce, digest = results.get()
+        stop_event.set()
+        for process in processes:
+            process.join()
+
+        attempts = attempt_counter.value
+
+    seconds = time.time() - start_time
+    block['nonce'] = nonce
+
+    stats = {
+        'nonce': nonce,
+        'hash': digest,
+        'attempts': attempts,
+        'seconds': seconds,
+        'hashrate': attempts / seconds if seconds > 0 else 0,
+        'workers': workers
+    }
+
+    return stats
@@ -0,0 +1,37 @@
+"""
+Fixtures shared by the node tests. Every test runs in its own copy of the repo layout (example-json next to an empty
+node-files directory) so the node's relative paths like ./blockchain and ../example-json land in a temporary directory.
+"""
+
+import os
+import sys
+import shutil
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'node-files'))
+
+
+# An empty node-files directory to run the node in
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(ROOT, 'example-json'), tmp_path / 'example-json')
+    os.mkdir(tmp_path / 'node-files')
+    monkeypatch.chdir(tmp_path / 'node-files')
+
+    return tmp_path / 'node-files'
+
+
+# A node with only the genesis block, difficulty 1 and no verify workers
+@pytest.fixture
+def node_env(workdir):
+    import blockchain
+    import checkpoint
+    import mempool
+    import node
+
+    blockchain.initialize()
+    node.initialize(1, 0, 10)
+    yield workdir
+    checkpoint.wait()
+    mempool.close()
@@ -0,0 +1,66 @@
+"""
+Helpers for building blocks and transactions in tests.
+"""
+
+import uuid
+import ecdsa
+import blockchain
+import node
+
+KEY = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+PK = KEY.get_verifying_key().to_string().hex()
+
+
+# Returns a mined version 2 block with txs built on parent (the tip by default), the coinbase pays the reward plus
+# the fees of txs, worked out against the node's current UTXO set
+def mine(txs=(), parent=None, miner=PK):
+    if parent is None:
+        parent = blockchain.get_last_block()
+
+    fees = 0
+    for tx in txs:
+        input_sum, output_sum = node.find_transaction_sum(tx)
+        fees += input_sum - output_sum
+
+    coinbase = blockchain.get_coinbase_template()
+    coinbase['outputs'][0]['value'] = node.block_reward + fees
+    coinbase['outputs'][0]['pk_script'] = miner
+    coinbase['tx_id'] = uuid.uuid4().hex
+
+    block = blockchain.get_block_template()
+    block['header'] = blockchain.hash_block(parent)
+    block['height'] = parent['height'] + 1
+    block['version'] = 2
+    block['transactions'] = [coinbase] + list(txs)
+    block['merkle_root'] = blockchain.compute_merkle_root(block['transactions'])
+
+    while blockchain.hash_block(block)[:node.block_difficulty] != '0' * node.block_difficulty:
+        block['nonce'] += 1
+
+    return block
+
+
+# Returns a signed transaction redeeming inputs ([height, tx index, output index] lists) into (value, pk) outputs
+def make_tx(inputs, outputs, key=KEY):
+    tx = blockchain.get_transaction_template()
+    tx['inputs'] = [{'previous_output': list(previous_output), 'signature_script': '0'} for previous_output in inputs]
+    tx['outputs'] = [{'value': float(value), 'pk_script': pk} for value, pk in outputs]
+    tx['tx_id'] = uuid.uuid4().hex
+
+    unsigned = dict(tx)
+    del unsigned['user_data']
+    tx['user_data']['pk'] = key.get_verifying_key().to_string().hex()
+    tx['user_data']['signature'] = key.sign(blockchain.hash_dict_bytes(unsigned)).hex()
+
+    return tx
+
+
+# Mines count empty blocks onto the tip and returns them
+def extend_chain(count):
+    blocks = []
+    for _ in range(count):
+        block = mine()
+        assert node.add_to_blockchain(block) is None
+        blocks.append(block)
+
+    return blocks
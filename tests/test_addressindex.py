@@ -0,0 +1,43 @@
+import mempool
+import node
+from helpers import KEY, PK, extend_chain, make_tx, mine
+
+OTHER_PK = '11' * 64
+
+
+def test_confirmed_utxo_and_history_of_an_address(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(600, OTHER_PK), (400, PK)])
+    assert node.add_to_blockchain(mine([tx])) is None
+
+    confirmed = node.get_utxo(OTHER_PK, 'confirmed')
+    assert confirmed == {'transactions': [([3, 1, 0], 600.0)], 'sum': 600.0}
+
+    history = node.get_address_history(PK, page_size=2)
+    assert history['total'] == 5
+    assert [(entry['type'], entry['height']) for entry in history['history']] == [('spent', 3), ('received', 3)]
+
+
+def test_unconfirmed_utxo_counts_the_mempool(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(node.block_reward, OTHER_PK)], KEY)
+    assert node.add_to_mempool(tx) is None
+
+    unconfirmed = node.get_utxo(PK, 'unconfirmed')
+    assert [1, 0, 0] not in [outpoint for outpoint, value in unconfirmed['transactions']]
+    assert node.get_utxo(OTHER_PK, 'unconfirmed')['sum'] == node.block_reward
+    assert mempool.count() == 1
+
+
+def test_disconnected_block_leaves_the_index(node_env):
+    main = extend_chain(3)
+    before = node.get_utxo(PK, 'confirmed')
+
+    side_3 = mine(parent=main[1], miner=OTHER_PK)
+    side_4 = mine(parent=side_3, miner=OTHER_PK)
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is None
+
+    after = node.get_utxo(PK, 'confirmed')
+    assert after['sum'] == before['sum'] - node.block_reward
+    assert node.get_utxo(OTHER_PK, 'confirmed')['sum'] == 2 * node.block_reward
@@ -0,0 +1,86 @@
+import os
+import blockstore
+
+
+def make_block(height):
+    return {'height': height, 'data': 'x' * 50}
+
+
+def test_blocks_read_back_after_reopening(workdir):
+    blockstore.initialize('./blockchain', max_bytes=300)
+    for height in range(10):
+        assert blockstore.append(make_block(height)) == height
+    blockstore.close()
+
+    blockstore.initialize('./blockchain', max_bytes=300)
+    assert blockstore.count() == 10
+    assert [block['height'] for block in map(blockstore.read, range(10))] == list(range(10))
+    assert len(os.listdir('./blockchain/segments')) > 1
+
+
+def test_torn_index_record_is_dropped(workdir):
+    blockstore.initialize('./blockchain')
+    for height in range(3):
+        blockstore.append(make_block(height))
+    blockstore.close()
+
+    with open('./blockchain/index.dat', 'ab') as f:
+        f.write(b'\x00\x00\x00')
+
+    blockstore.initialize('./blockchain')
+    assert blockstore.count() == 3
+    assert os.path.getsize('./blockchain/index.dat') == 3 * blockstore.INDEX_RECORD.size
+    assert blockstore.append(make_block(3)) == 3
+    assert blockstore.read(3)['height'] == 3
+
+
+def test_unindexed_and_torn_segment_data_is_cut_off(workdir):
+    blockstore.initialize('./blockchain')
+    for height in range(3):
+        blockstore.append(make_block(height))
+    blockstore.close()
+
+    # A block whose data was only partly written and never indexed
+    segment_path = blockstore.get_segment_path(0)
+    size = os.path.getsize(segment_path)
+    with open(segment_path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00{"height": 3')
+
+    blockstore.initialize('./blockchain')
+    assert blockstore.count() == 3
+    assert os.path.getsize(segment_path) == size
+
+    blockstore.append(make_block(3))
+    blockstore.close()
+    blockstore.initialize('./blockchain')
+    assert [blockstore.read(height)['height'] for height in range(4)] == [0, 1, 2, 3]
+
+
+def test_index_record_pointing_past_its_segment_is_dropped(workdir):
+    blockstore.initialize('./blockchain')
+    for height in range(3):
+        blockstore.append(make_block(height))
+    blockstore.close()
+
+    # The index record went down but the end of the block's data didn't
+    segment_path = blockstore.get_segment_path(0)
+    with open(segment_path, 'r+b') as f:
+        f.truncate(os.path.getsize(segment_path) - 10)
+
+    blockstore.initialize('./blockchain')
+    assert blockstore.count() == 2
+    assert blockstore.read(1)['height'] == 1
+
+
+def test_truncate_drops_blocks_from_height(workdir):
+    blockstore.initialize('./blockchain', max_bytes=300)
+    for height in range(8):
+        blockstore.append(make_block(height))
+
+    blockstore.truncate(3)
+    assert blockstore.count() == 3
+    blockstore.append(make_block(30))
+    blockstore.close()
+
+    blockstore.initialize('./blockchain', max_bytes=300)
+    assert [blockstore.read(height)['height'] for height in range(4)] == [0, 1, 2, 30]
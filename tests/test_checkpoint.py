@@ -0,0 +1,71 @@
+import os
+import blockchain
+import checkpoint
+import node
+import utxo
+from helpers import PK, extend_chain, make_tx, mine
+
+
+def restart():
+    checkpoint.wait()
+    blockchain.initialize()
+    node.initialize(1, 0, 10)
+
+
+def test_restart_restores_the_checkpoint(node_env):
+    extend_chain(3)
+    assert node.add_to_blockchain(mine([make_tx([[1, 0, 0]], [(node.block_reward, PK)])])) is None
+    node.save_checkpoint(wait=True)
+
+    outputs = dict(utxo.unspent_outputs)
+    history = node.get_address_history(PK)
+    headers = blockchain.get_headers(0, blockchain.get_block_count())
+    restart()
+
+    assert checkpoint.checkpoint_height == 4
+    assert utxo.unspent_outputs == outputs
+    assert node.get_address_history(PK) == history
+    assert blockchain.block_headers == headers
+
+
+def test_checkpoint_only_appends_new_headers(node_env):
+    extend_chain(2)
+    node.save_checkpoint(wait=True)
+    with open(checkpoint.headers_path, 'rb') as f:
+        saved = f.read()
+
+    extend_chain(2)
+    node.save_checkpoint(wait=True)
+    with open(checkpoint.headers_path, 'rb') as f:
+        data = f.read()
+
+    assert data.startswith(saved)
+    assert data.count(b'\n') == blockchain.get_block_count() == len(checkpoint.saved_headers)
+
+
+def test_checkpoint_after_a_reorg_replaces_the_headers_that_left_the_chain(node_env):
+    main = extend_chain(3)
+    node.save_checkpoint(wait=True)
+
+    side_3 = mine(parent=main[1])
+    side_4 = mine(parent=side_3)
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is None
+    node.save_checkpoint(wait=True)
+
+    headers = blockchain.get_headers(0, blockchain.get_block_count())
+    restart()
+
+    assert checkpoint.checkpoint_height == 4
+    assert blockchain.get_tip_hash() == blockchain.hash_block(side_4)
+    assert blockchain.block_headers == headers
+
+
+def test_checkpoint_with_missing_headers_is_not_used(node_env):
+    extend_chain(2)
+    node.save_checkpoint(wait=True)
+    os.remove(checkpoint.headers_path)
+
+    restart()
+    assert checkpoint.checkpoint_height is None
+    assert blockchain.get_block_count() == 3
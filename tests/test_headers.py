@@ -0,0 +1,31 @@
+import pytest
+import blockchain
+import ibd
+import relay
+from helpers import mine
+
+
+@pytest.mark.parametrize('key, value', [('nonce', -1), ('nonce', 2 ** 64), ('height', 1.5), ('height', -1),
+                                        ('timestamp', 'now'), ('timestamp', 10 ** 400)])
+def test_header_fields_that_do_not_fit_raise_value_error(node_env, key, value):
+    block = mine()
+    block[key] = value
+
+    with pytest.raises(ValueError):
+        blockchain.hash_block(block)
+
+
+def test_downloaded_block_with_bad_header_does_not_match(node_env):
+    block = mine()
+    headers = [{'height': 1, 'hash': blockchain.hash_block(block)}]
+    block['nonce'] = -1
+
+    assert not ibd.matches_headers([block], headers, 1, 2)
+
+
+def test_broadcast_block_with_bad_header_is_rejected(node_env):
+    block = mine()
+    block['nonce'] = -1
+
+    assert isinstance(relay.receive_block(block), str)
+    assert blockchain.get_block_count() == 1
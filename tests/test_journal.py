@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import pytest
+import journal
+import mempool
+import node
+from helpers import PK, extend_chain, make_tx
+
+
+# Writes one journal record per line, the last one cut off part way through if torn is set
+def write_journal(path, records, torn=False):
+    lines = b''.join(json.dumps(record).encode() + b'\n' for record in records)
+    with open(path, 'wb') as f:
+        f.write(lines[:-5] if torn else lines)
+
+
+@pytest.fixture
+def pool_dir(workdir):
+    os.mkdir('./mempool')
+    yield workdir
+    mempool.close()
+
+
+def test_torn_last_record_ends_the_replay(pool_dir):
+    first = make_tx([[1, 0, 0]], [(1, PK)])
+    second = make_tx([[2, 0, 0]], [(1, PK)])
+    write_journal('./mempool/journal.log', [{'add': first}, {'add': second}], torn=True)
+
+    mempool.initialize()
+
+    assert mempool.get(first['tx_id']) is not None
+    assert mempool.get(second['tx_id']) is None
+
+
+def test_old_journal_is_replayed_after_an_interrupted_compaction(pool_dir):
+    first = make_tx([[1, 0, 0]], [(1, PK)])
+    second = make_tx([[2, 0, 0]], [(1, PK)])
+    write_journal('./mempool/journal.log.old', [{'add': first}, {'add': second}])
+    write_journal('./mempool/journal.log', [{'remove': first['tx_id']}])
+
+    mempool.initialize()
+
+    assert [tx['tx_id'] for tx in mempool.get_all()] == [second['tx_id']]
+    assert not os.path.isfile('./mempool/journal.log.old')
+
+
+def test_compaction_writes_a_base_the_pool_reloads_from(pool_dir, monkeypatch):
+    monkeypatch.setattr(journal, 'COMPACT_RECORDS', 3)
+    mempool.initialize()
+
+    transactions = [make_tx([[height, 0, 0]], [(1, PK)]) for height in range(1, 5)]
+    for tx in transactions:
+        mempool.add(tx)
+    for tx in transactions[:3]:
+        mempool.remove(tx['tx_id'])
+    mempool.save()
+
+    deadline = time.time() + 5
+    while journal.compacting and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert not journal.compacting
+    assert journal.get_stats()['records'] == 0
+    assert not os.path.isfile('./mempool/journal.log.old')
+    with open('./mempool/mempool.json', 'r') as f:
+        assert [tx['tx_id'] for tx in json.load(f)] == [tx['tx_id'] for tx in transactions[3:]]
+
+    mempool.close()
+    mempool.initialize()
+    assert [tx['tx_id'] for tx in mempool.get_all()] == [tx['tx_id'] for tx in transactions[3:]]
+
+
+def test_eviction_journaled_at_the_cap_survives_a_restart(node_env):
+    extend_chain(2)
+    low_fee = make_tx([[1, 0, 0]], [(node.block_reward - 1, PK)])
+    high_fee = make_tx([[2, 0, 0]], [(node.block_reward - 100, PK)])
+    cap = len(json.dumps(low_fee, separators=(',', ':'))) * 3 // 2
+
+    mempool.close()
+    node.initialize(1, 0, 10, mempool_size=cap)
+    assert node.add_to_mempool(low_fee) is None
+    assert node.add_to_mempool(high_fee) is None
+    assert [tx['tx_id'] for tx in mempool.get_all()] == [high_fee['tx_id']]
+
+    mempool.close()
+    node.initialize(1, 0, 10, mempool_size=cap)
+    assert [tx['tx_id'] for tx in mempool.get_all()] == [high_fee['tx_id']]
+    assert mempool.fees[high_fee['tx_id']] == 100
+
+
+@pytest.mark.parametrize('mode', journal.DURABILITY_MODES)
+def test_committed_changes_survive_a_restart(pool_dir, mode):
+    mempool.initialize(durability=mode)
+    tx = make_tx([[1, 0, 0]], [(1, PK)])
+    mempool.add(tx)
+    mempool.save()
+
+    stats = journal.get_stats()
+    if mode != 'periodic':
+        assert stats['synced'] >= stats['written']
+
+    mempool.close()
+    mempool.initialize(durability=mode)
+    assert mempool.get(tx['tx_id']) is not None
+
+
+def test_unknown_durability_mode_is_rejected(pool_dir):
+    with pytest.raises(ValueError):
+        mempool.initialize(durability='sometimes')
@@ -0,0 +1,78 @@
+import json
+import blocktemplate
+import mempool
+import node
+from helpers import PK, extend_chain, make_tx, mine
+
+
+# Returns a signed transaction redeeming the coinbase of the block at height and paying fee
+def pay_fee(height, fee):
+    return make_tx([[height, 0, 0]], [(node.block_reward - fee, PK)])
+
+
+def size(tx):
+    return len(json.dumps(tx, separators=(',', ':')))
+
+
+def test_full_mempool_evicts_the_lowest_fee_rate(node_env):
+    extend_chain(3)
+    low, middle, high = pay_fee(1, 1), pay_fee(2, 50), pay_fee(3, 100)
+
+    mempool.close()
+    node.initialize(1, 0, 10, mempool_size=size(low) * 5 // 2)
+    assert node.add_to_mempool(middle) is None
+    assert node.add_to_mempool(high) is None
+
+    assert node.add_to_mempool(low).startswith("Mempool is full")
+    assert [tx['tx_id'] for tx in mempool.iter_by_fee_rate()] == [high['tx_id'], middle['tx_id']]
+
+
+def test_template_takes_the_best_fee_rates_first(node_env):
+    extend_chain(3)
+    low, middle, high = pay_fee(1, 1), pay_fee(2, 50), pay_fee(3, 100)
+    for tx in [low, high, middle]:
+        assert node.add_to_mempool(tx) is None
+
+    template = blocktemplate.get_template(max_transactions=2)
+
+    assert [tx['tx_id'] for tx in template['block']['transactions']] == [high['tx_id'], middle['tx_id']]
+    assert template['fees'] == 150
+    assert template['coinbase']['outputs'][0]['value'] == node.block_reward + 150
+
+
+def test_second_transaction_redeeming_the_same_output_is_rejected(node_env):
+    extend_chain(2)
+    first, second = pay_fee(1, 1), pay_fee(1, 2)
+
+    assert node.add_to_mempool(first) is None
+    assert type(node.add_to_mempool(second)) is str
+    assert mempool.find_conflict(second) == first['tx_id']
+
+
+def test_block_removes_the_transactions_it_confirms_from_the_mempool(node_env):
+    extend_chain(3)
+    pooled, other = pay_fee(1, 1), pay_fee(2, 1)
+    assert node.add_to_mempool(pooled) is None
+    assert node.add_to_mempool(other) is None
+
+    assert node.add_to_blockchain(mine([pooled])) is None
+
+    assert mempool.get(pooled['tx_id']) is None
+    assert mempool.get(other['tx_id']) is not None
+    assert list(mempool.spent_outpoints) == [(2, 0, 0)]
+
+
+def test_batch_reports_every_transaction_in_order(node_env):
+    extend_chain(3)
+    valid, double_spend, other = pay_fee(1, 1), pay_fee(1, 2), pay_fee(2, 1)
+    bad_signature = pay_fee(3, 1)
+    bad_signature['outputs'][0]['value'] -= 1
+
+    results = node.add_batch_to_mempool([valid, double_spend, 'not a transaction', bad_signature, other])
+
+    assert results[0] is None
+    assert 'earlier in this batch' in results[1]
+    assert type(results[2]) is str
+    assert results[3] == "Signature is invalid."
+    assert results[4] is None
+    assert [tx['tx_id'] for tx in mempool.get_all()] == [valid['tx_id'], other['tx_id']]
@@ -0,0 +1,109 @@
+import os
+import blockchain
+import blocktree
+import checkpoint
+import mempool
+import node
+import utxo
+from helpers import PK, extend_chain, make_tx, mine
+
+
+def test_heavier_side_chain_becomes_the_chain(node_env):
+    main = extend_chain(3)
+    side_3 = mine(parent=main[1])
+    side_4 = mine(parent=side_3)
+
+    assert node.add_to_blockchain(side_3) is None
+    assert blockchain.get_tip_hash() == blockchain.hash_block(main[2])
+
+    assert node.add_to_blockchain(side_4) is None
+    assert blockchain.get_tip_hash() == blockchain.hash_block(side_4)
+    assert blockchain.get_block_count() == 5
+    assert blocktree.contains(blockchain.hash_block(main[2]))
+
+
+def test_reorg_onto_branch_spending_an_output_a_mempool_transaction_spends(node_env):
+    reward = node.block_reward
+    main = extend_chain(3)
+
+    pooled = make_tx([[2, 0, 0]], [(reward, PK)])
+    assert node.add_to_mempool(pooled) is None
+
+    side_3 = mine([make_tx([[2, 0, 0]], [(reward, PK)])], parent=main[1])
+    side_4 = mine(parent=side_3)
+
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is None
+
+    assert blockchain.get_tip_hash() == blockchain.hash_block(side_4)
+    assert mempool.get(pooled['tx_id']) is None
+    assert utxo.get_output((2, 0, 0)) is None
+
+
+def test_transactions_only_in_the_old_chain_go_back_to_the_mempool(node_env):
+    reward = node.block_reward
+    main = extend_chain(2)
+
+    confirmed = make_tx([[1, 0, 0]], [(reward, PK)])
+    main_3 = mine([confirmed])
+    assert node.add_to_blockchain(main_3) is None
+    assert mempool.get(confirmed['tx_id']) is None
+
+    side_3 = mine(parent=main[1])
+    side_4 = mine(parent=side_3)
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is None
+
+    assert blockchain.get_tip_hash() == blockchain.hash_block(side_4)
+    assert mempool.get(confirmed['tx_id']) is not None
+    assert utxo.get_output((1, 0, 0)) is not None
+
+
+def test_side_block_with_a_header_field_out_of_range_is_rejected(node_env):
+    main = extend_chain(3)
+    side_3 = mine(parent=main[1])
+    side_3['nonce'] = -1
+
+    assert isinstance(node.add_to_blockchain(side_3), str)
+    assert blockchain.get_tip_hash() == blockchain.hash_block(main[2])
+
+
+def test_invalid_side_chain_block_puts_the_old_chain_back(node_env):
+    main = extend_chain(3)
+    outputs_before = dict(utxo.unspent_outputs)
+
+    side_3 = mine(parent=main[1])
+    side_4 = mine(parent=side_3)
+    side_4['transactions'][0]['outputs'][0]['value'] += 1
+    side_4['merkle_root'] = blockchain.compute_merkle_root(side_4['transactions'])
+    while blockchain.hash_block(side_4)[:node.block_difficulty] != '0' * node.block_difficulty:
+        side_4['nonce'] += 1
+
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is not None
+
+    assert blockchain.get_tip_hash() == blockchain.hash_block(main[2])
+    assert utxo.unspent_outputs == outputs_before
+    assert not blocktree.contains(blockchain.hash_block(side_4))
+    assert blocktree.contains(blockchain.hash_block(side_3))
+
+
+def test_state_after_reorg_matches_a_rebuild_from_genesis(node_env):
+    reward = node.block_reward
+    main = extend_chain(3)
+    side_3 = mine([make_tx([[1, 0, 0]], [(reward, PK)])], parent=main[1])
+    side_4 = mine(parent=side_3)
+    assert node.add_to_blockchain(side_3) is None
+    assert node.add_to_blockchain(side_4) is None
+
+    outputs = dict(utxo.unspent_outputs)
+    chain_stats = dict(node.chain_stats)
+
+    checkpoint.wait()
+    os.remove('./blockchain/checkpoint.json')
+    blockchain.initialize()
+    node.initialize(1, 0, 10)
+
+    assert blockchain.get_tip_hash() == blockchain.hash_block(side_4)
+    assert utxo.unspent_outputs == outputs
+    assert node.chain_stats == chain_stats
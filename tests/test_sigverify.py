@@ -0,0 +1,42 @@
+import multiprocessing
+import node
+import sigverify
+from helpers import PK, extend_chain, make_tx, mine
+
+
+def test_chain_with_valid_signatures_verifies(node_env):
+    extend_chain(2)
+    assert node.add_to_blockchain(mine([make_tx([[1, 0, 0]], [(node.block_reward, PK)])])) is None
+
+    assert node.verify_chain_signatures(batch_size=1) is None
+
+
+def test_chain_signature_check_reports_the_tampered_transaction(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(node.block_reward, PK)])
+    tx['outputs'][0]['value'] -= 1
+    node.connect_block(mine([tx]))
+
+    assert node.verify_chain_signatures() == "Signature of transaction [1] in block [3] is invalid."
+
+
+def test_transaction_with_a_signature_that_is_not_a_string_is_rejected(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(node.block_reward, PK)])
+    tx['user_data']['signature'] = {'r': 1, 's': 2}
+
+    assert node.add_to_mempool(tx) == "Signature is invalid."
+
+
+def test_verify_workers_are_started_with_the_pool(node_env):
+    sigverify.initialize(2)
+    try:
+        assert len(multiprocessing.active_children()) >= 2
+
+        extend_chain(2)
+        tx = make_tx([[1, 0, 0]], [(node.block_reward, PK)])
+        tx['outputs'][0]['value'] -= 1
+        node.connect_block(mine([tx]))
+        assert node.verify_chain_signatures() == "Signature of transaction [1] in block [3] is invalid."
+    finally:
+        sigverify.initialize(0)
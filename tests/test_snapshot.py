@@ -0,0 +1,59 @@
+import os
+import addressindex
+import blockchain
+import checkpoint
+import node
+import snapshot
+import undolog
+import utxo
+from helpers import PK, extend_chain, make_tx, mine
+
+
+def test_snapshot_starts_a_node_without_address_index_or_undo_log(node_env):
+    extend_chain(3)
+    assert node.add_to_blockchain(mine([make_tx([[1, 0, 0]], [(node.block_reward, PK)])])) is None
+
+    outputs = dict(utxo.unspent_outputs)
+    history = node.get_address_history(PK)
+    assert type(snapshot.export('./utxo.json.gz')) is dict
+
+    checkpoint.wait()
+    for path in ['./blockchain/checkpoint.json', './blockchain/address_index.log', './blockchain/undo.log']:
+        os.remove(path)
+    blockchain.initialize()
+    node.initialize(1, 0, 10, snapshot_path='./utxo.json.gz')
+    node.history_builder.join()
+
+    assert snapshot.status['height'] == 4
+
+    assert node.history_available
+    assert utxo.unspent_outputs == outputs
+    assert node.get_address_history(PK) == history
+    assert addressindex.indexed_blocks == undolog.count() == blockchain.get_block_count()
+
+
+def test_address_queries_wait_for_history(node_env, monkeypatch):
+    monkeypatch.setattr(node, 'history_available', False)
+
+    assert type(node.get_address_history(PK)) is str
+    assert type(node.get_utxo(PK, 'confirmed')) is str
+
+
+def test_history_verification_of_an_exported_snapshot_is_valid(node_env):
+    extend_chain(3)
+    info = snapshot.export('./utxo.json.gz')
+
+    snapshot.verify_history(info, node.block_difficulty, node.block_reward)
+    assert snapshot.status['verification'] == 'valid'
+
+
+def test_unreadable_chain_ends_history_verification(node_env, monkeypatch):
+    extend_chain(3)
+    info = snapshot.export('./utxo.json.gz')
+
+    def fail(start=0, end=None):
+        raise OSError("segment is gone")
+    monkeypatch.setattr(blockchain, 'iter_blocks', fail)
+
+    snapshot.verify_history(info, node.block_difficulty, node.block_reward)
+    assert snapshot.status['verification'] == 'error'
@@ -0,0 +1,19 @@
+import node
+from helpers import PK, extend_chain, make_tx
+
+
+def test_previous_output_length_is_checked_before_the_input_keys(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(node.block_reward, PK)])
+    tx['inputs'][0] = {'previous_output': [1, 0]}
+
+    assert node.verify_transaction(tx) == \
+        "All transaction inputs 'previous output' key should contain a list with exactly 3 values"
+
+
+def test_missing_input_key_is_reported(node_env):
+    extend_chain(2)
+    tx = make_tx([[1, 0, 0]], [(node.block_reward, PK)])
+    del tx['inputs'][0]['signature_script']
+
+    assert node.verify_transaction(tx) == "Key signature_script not found in an input of this transaction"